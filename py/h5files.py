@@ -23,14 +23,33 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import h5py
 import atexit
 import os
+import threading
+import itertools
 '''
   Need this because - citing the h5py docs
   http://www.h5py.org/docs/whatsnew/2.0.html#file-objects-must-be-manually-closed
   "Please note that opening the same file multiple times (i.e. without closing it first) continues to result in undefined behavior.".
   I need to access the same file multiple times though, but without knowing that it is in fact the same file!
+
+  Files are reference counted. open increments, close decrements and the
+  file is really closed when it is not used anymore. Files opened through
+  openLink are referenced by the file containing the link until that one is
+  closed.
+
+  Environment variables:
+    H5FILES_SEARCH_DIRS - ':' separated dirs where to look for files, e.g. targets of external links
+    H5FILES_MAX_OPEN - if > 0, unused files are kept open for reuse, and the least recently used
+                       unused ones are closed when more than this number are open.
+    H5FILES_CHUNK_CACHE_MB - size of the raw data chunk cache per file (hdf5 default is 1 MB)
+    H5FILES_SWMR - if 1, files opened read only use single writer multiple reader mode, so
+                   files can be read while a simulation writes them (call refresh() on datasets
+                   to see new data). Requires files written with libver='latest'.
 '''
 
 search_paths = map(lambda s: s.strip(), os.environ.get('H5FILES_SEARCH_DIRS', '') .split(':'))
+max_open = int(os.environ.get('H5FILES_MAX_OPEN', 0))
+chunk_cache_mb = float(os.environ.get('H5FILES_CHUNK_CACHE_MB', 0))
+swmr_read = os.environ.get('H5FILES_SWMR', '0') not in ('', '0')
 
 
 def FindFile_(filename, relatedH5Object):
@@ -46,8 +65,8 @@ def FindFile_(filename, relatedH5Object):
 
 
 class FileWrapper(h5py.File):
-  def __init__(self, fn, mode):
-    h5py.File.__init__(self, fn, mode)
+  def __init__(self, fn, mode, **kwargs):
+    h5py.File.__init__(self, fn, mode, **kwargs)
 
   def __enter__(self):
     return self
@@ -57,9 +76,45 @@ class FileWrapper(h5py.File):
     close(self)
 
 
+def file_kwargs_(mode, chunk_cache, swmr):
+  kwargs = dict()
+  if chunk_cache is None and chunk_cache_mb > 0:
+    chunk_cache = int(chunk_cache_mb * 1024 * 1024)
+  if chunk_cache:
+    kwargs['rdcc_nbytes'] = int(chunk_cache)
+  if swmr is None:
+    swmr = swmr_read
+  if swmr and mode == 'r':
+    kwargs['swmr'] = True
+  return kwargs
+
+
 class H5Files(object):
-  def __init__(self):
+  '''
+    pool of open files, see the module documentation. All methods are
+    thread safe, the files themselves are not.
+  '''
+  def __init__(self, max_open = 0):
     self.files = dict() # so we use a dict to keep track of the files
+    self.refcounts = dict()
+    self.last_use = dict()
+    self.links = dict() # memoized resolution of external links
+    self.link_refs = dict() # file key -> keys of the link targets it holds a reference to
+    self.max_open = max_open
+    self.counter = itertools.count()
+    self.lock = threading.RLock()
+
+  def reset_after_fork(self):
+    '''
+      forget everything inherited from the parent process by fork. The files
+      are not closed because that would affect the files of the parent.
+    '''
+    self.files = dict()
+    self.refcounts = dict()
+    self.last_use = dict()
+    self.links = dict()
+    self.link_refs = dict()
+    self.lock = threading.RLock()
 
   def makeKey_(self, fn):
     _, ino, dev, _, _, _, _, _, _, _ = os.stat(fn)
@@ -67,56 +122,140 @@ class H5Files(object):
     #http://effbot.org/zone/python-fileinfo.htm
     #return os.path.realpath(os.path.abspath(os.path.normpath(fn)))
 
-  def open(self, fn, mode = 'r', relatedObjectForSearch = None, search = True):
+  def forget_(self, key):
+    f = self.files.pop(key)
+    self.refcounts.pop(key, None)
+    self.last_use.pop(key, None)
+    for k in [ k for k in self.links if k[0] == key ]:
+      del self.links[k]
+    # link targets are referenced for as long as the file with the links is
+    for t in self.link_refs.pop(key, ()):
+      if t not in self.files:
+        continue
+      self.refcounts[t] -= 1
+      if self.refcounts[t] <= 0 and self.max_open <= 0:
+        self.forget_(t).close()
+    return f
+
+  def lookup_(self, key, mode, count):
+    f = self.files.get(key, None)
+    if f is None:
+      return None
+    if not f.id.valid: # was closed by f.close() rather than by us
+      self.forget_(key)
+      return None
+    if mode != 'r' and f.mode == 'r' and self.refcounts[key] == 0:
+      # kept open for reading but nobody uses it, so it can be reopened for writing
+      self.forget_(key).close()
+      return None
+    self.refcounts[key] += count
+    self.last_use[key] = next(self.counter)
+    return f
+
+  def evict_(self):
+    if self.max_open <= 0:
+      return
+    unused = sorted((self.last_use[k], k) for k, n in self.refcounts.iteritems() if n <= 0)
+    for _, key in unused:
+      if len(self.files) <= self.max_open:
+        break
+      if key in self.files:
+        self.forget_(key).close()
+
+  def open(self, fn, mode = 'r', relatedObjectForSearch = None, search = True, chunk_cache = None, swmr = None, count = 1):
+    '''
+      chunk_cache - raw data chunk cache size in bytes, default see H5FILES_CHUNK_CACHE_MB.
+      swmr - read in single writer multiple reader mode, default see H5FILES_SWMR.
+      Both only take effect if the file is not open already.
+    '''
     if not os.path.isfile(fn) and (search or relatedObjectForSearch is not None):
       fn, err = FindFile_(fn, relatedObjectForSearch)
     else:
       err = None
-    if os.path.isfile(fn): 
-      # does the file exist on disk, then generate a key and see if it is in the dict. 
-      #If not, then attempt to open it and put it in the dict after that.
-      key = self.makeKey_(fn)
-      try: 
-        f = self.files[key]
-        return f
-      except KeyError:
-        pass
-    # no luck, fallen through to here
-    try:
-      f = FileWrapper(fn, mode)
-    except Exception, e: # trouble opening the file
-      if err: 
-        print err.message
-      raise e
-    key = self.makeKey_(fn)    
-    self.files[key] = f
-    return f
+    with self.lock:
+      if os.path.isfile(fn): 
+        # does the file exist on disk, then generate a key and see if it is in the dict. 
+        #If not, then attempt to open it and put it in the dict after that.
+        f = self.lookup_(self.makeKey_(fn), mode, count)
+        if f is not None:
+          return f
+      # no luck, fallen through to here
+      self.evict_()
+      try:
+        f = FileWrapper(fn, mode, **file_kwargs_(mode, chunk_cache, swmr))
+      except Exception, e: # trouble opening the file
+        if err: 
+          print err.message
+        raise e
+      key = self.makeKey_(fn)    
+      self.files[key] = f
+      self.refcounts[key] = count
+      self.last_use[key] = next(self.counter)
+      return f
 
   def close(self, f):
-    key = self.makeKey_(f.filename)
-    del self.files[key]
-    f.close()
+    with self.lock:
+      key = self.makeKey_(f.filename)
+      if key not in self.files:
+        f.close()
+        return
+      self.refcounts[key] -= 1
+      if self.refcounts[key] > 0:
+        return
+      if self.max_open > 0 and f.id.valid:
+        f.flush() # keep it for reuse
+        self.evict_()
+      else:
+        self.forget_(key)
+        f.close()
 
   def closeall(self):
-    for f in self.files.itervalues(): f.close()
-    self.files = dict()
+    with self.lock:
+      for f in self.files.itervalues():
+        if f.id.valid:
+          f.close()
+      self.files = dict()
+      self.refcounts = dict()
+      self.last_use = dict()
+      self.links = dict()
+      self.link_refs = dict()
+
+  def openLink(self, g, name):
+    '''
+      follow external links through the pool. The target file and path are
+      memoized, so repeated lookups neither parse the link nor search for the file.
+    '''
+    with self.lock:
+      srckey = self.makeKey_(g.file.filename)
+      memokey = (srckey, g.name, name)
+      target = self.links.get(memokey, None)
+      if target is None:
+        if g.id.links.get_info(name).type != h5py.h5l.TYPE_EXTERNAL:
+          return g[name]
+        filename, path = g.id.links.get_val(name)
+        if not os.path.isfile(filename):
+          filename, _ = FindFile_(filename, g)
+        if os.path.isfile(filename): # independent of later chdir
+          filename = os.path.abspath(filename)
+        target = self.links[memokey] = (filename, path)
+      filename, path = target
+      f = self.open(filename, g.file.mode, relatedObjectForSearch = g, count = 0)
+      key = self.makeKey_(f.filename)
+      refs = self.link_refs.setdefault(srckey, set())
+      if key != srckey and key not in refs:
+        refs.add(key)
+        self.refcounts[key] += 1
+      return f[path]
 
 
 
-h5files_ = H5Files()
+h5files_ = H5Files(max_open)
 atexit.register(H5Files.closeall, h5files_)
 
 open = h5files_.open
 close = h5files_.close
 closeall = h5files_.closeall
-
-def openLink(g, name):
-  if g.id.links.get_info(name).type == h5py.h5l.TYPE_EXTERNAL:
-    filename, path = g.id.links.get_val(name)
-    f = h5files_.open(filename, g.file.mode, relatedObjectForSearch = g)
-    return f[path]
-  else:
-    return g[name]
+openLink = h5files_.openLink
 
 def isLink(g, name):
-  return True if  g.id.links.get_info(name).type in (h5py.h5l.TYPE_SOFT, h5py.h5l.TYPE_EXTERNAL) else False
\ No newline at end of file
+  return True if  g.id.links.get_info(name).type in (h5py.h5l.TYPE_SOFT, h5py.h5l.TYPE_EXTERNAL) else False
@@ -153,7 +153,7 @@ def create_auto_dicts(param_group):
 
        
 
-def worker_on_client(fn, grp_pattern, adaptionParams, num_threads):
+def worker_on_client(fn, grp_pattern, adaptionParams, num_threads, resume = False):
   print('Adaption on %s / %s / param: %s' % (fn, grp_pattern, adaptionParams['name']))
   h5files.search_paths = [dirname(fn)] # so the plotting and measurement scripts can find the original tumor files using the stored basename alone
   krebsutils.set_num_threads(num_threads)
@@ -161,7 +161,10 @@ def worker_on_client(fn, grp_pattern, adaptionParams, num_threads):
   vesselgroup = h5files.open(fn, 'r', search = False)[grp_pattern]
   f_opt_data = h5files.open('PSO_data_%s.h5' % basename(fn), 'a', search = False)
   
-  adaptionParams['counter'] = 0
+  if resume: # continue from the swarm stored in f_opt_data, and with the numbering of its data groups
+    adaptionParams['counter'] = len([k for k in f_opt_data.keys() if k.startswith('data_')])
+  else:
+    adaptionParams['counter'] = 0
   #for default_pso use only 20, hope this speed up
   #for all other simulations 50 was used here
   adaptionParams['adaption']['max_nun_iterations'] = 100
@@ -271,7 +274,9 @@ def worker_on_client(fn, grp_pattern, adaptionParams, num_threads):
                    processes=processes,
                    use_initial_guess=use_initial_guess,
                    phig=0.25,
-                   args=args)
+                   args=args,
+                   checkpoint=f_opt_data.require_group('pso_checkpoint'),
+                   resume=resume)
   
   f_opt_data.attrs.create('xopt', data = xopt)
   f_opt_data.attrs.create('fopt', data = fopt)
@@ -343,7 +348,7 @@ def run(parameter_set_name, filenames, grp_pattern):
                   days = 4.,
                   mem = '3500MB',
                   change_cwd = True)
-def run2(parameter_set, filenames, grp_pattern):
+def run2(parameter_set, filenames, grp_pattern, resume = False):
   print 'submitting ...', parameter_set['name']
  
 
@@ -352,7 +357,7 @@ def run2(parameter_set, filenames, grp_pattern):
     num_threads = parameter_set['num_threads']
     
   for fn in filenames:
-    qsub.submit(qsub.func(worker_on_client, fn, grp_pattern, parameter_set, num_threads),
+    qsub.submit(qsub.func(worker_on_client, fn, grp_pattern, parameter_set, num_threads, resume),
                   name = 'job_adaption_'+parameter_set['name']+'_'+basename(fn),
                   num_cpus = num_threads,
                   days = 4.,
@@ -402,6 +407,7 @@ if not qsub.is_client and __name__=='__main__':
   parser_run = subparsers.add_parser('run')  
   parser_run.add_argument('AdaptionParamSet')  
   parser_run.add_argument('grp_pattern',help='Where to find the vessel group in the file')  
+  parser_run.add_argument('--resume', help = 'continue the swarm stored in PSO_data_<file>.h5 by an interrupted run', default = False, action='store_true')
   #parser.add_argument('-a', '--analyze', help = 'loop through all files analyze data and make plot', default=False, action='store_true')
   parser_rep =  subparsers.add_parser('rep')   
   #parser.add_argument('-r', '--reproduze', help = 'reproduced vesselnetwork with optimized parameters', default = False, action='store_true')  
@@ -426,5 +432,5 @@ if not qsub.is_client and __name__=='__main__':
         
     factory = getattr(parameterSetsAdaption, goodArguments.AdaptionParamSet)
     factory['name'] = goodArguments.AdaptionParamSet
-    run2(factory, filenames, goodArguments.grp_pattern)
+    run2(factory, filenames, goodArguments.grp_pattern, goodArguments.resume)
       
\ No newline at end of file
@@ -126,16 +126,15 @@ def ComputeIsosurfaceRadialCurve(dataman, vesselgroup, tumorgroup, bins_spec, di
 
 def GetRootVesselData(vessels, data):
     flags = vessels['flags']
-    roots = set(vessels.roots)
-    arterialData = []
-    venousData = []
-    for i, (a,b) in enumerate(vessels.edgelist):
-      if not (flags[i] & krebsutils.CIRCULATED): continue
-      if (a in roots or b in roots):
-          if flags[i] & krebsutils.ARTERY:
-            arterialData.append(data[i])
-          elif flags[i] & krebsutils.VEIN:
-            venousData.append(data[i])
+    isroot = np.zeros((vessels.num_nodes,), dtype = np.bool)
+    isroot[vessels.roots] = True
+    el = vessels.edgelist
+    mask = myutils.bbitwise_and(flags, krebsutils.CIRCULATED) & (isroot[el[:,0]] | isroot[el[:,1]])
+    isartery = myutils.bbitwise_and(flags, krebsutils.ARTERY)
+    arterialIndices, = np.nonzero(mask & isartery)
+    venousIndices, = np.nonzero(mask & ~isartery & myutils.bbitwise_and(flags, krebsutils.VEIN))
+    arterialData = [ data[i] for i in arterialIndices ]
+    venousData = [ data[i] for i in venousIndices ]
     return arterialData, venousData
 
 
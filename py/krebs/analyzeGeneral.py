@@ -394,10 +394,12 @@ class DataDistanceFromCenter(object):
 #    return dist_smpl, distmap, ld, mask  
 
 
-def CalcPhiVessels(dataman, vesselgroup, ld, scaling, samples_per_cell = 5):
+def CalcPhiVessels(dataman, vesselgroup, ld, scaling, samples_per_cell = 5, sparse = False):
   '''samples per cell mean the lattice grid cell,
      the total number of samples for a vessel is determined by the ratio
-     of its volume to the volume of a grid cell times the samples_per_cell'''
+     of its volume to the volume of a grid cell times the samples_per_cell.
+     If sparse, returns (coords, values) of the non-zero sites instead of
+     the full field, see krebsutils.make_vessel_volume_fraction_sparse'''
   # vessel volume fraction
   #vessels = krebsutils.read_vesselgraph(ds, ['radius','position', 'flags'])
   vessels = dataman.obtain_data('vessel_graph', vesselgroup, ['radius', 'position', 'flags'])
@@ -405,6 +407,13 @@ def CalcPhiVessels(dataman, vesselgroup, ld, scaling, samples_per_cell = 5):
   vessels = vessels.get_filtered(edge_indices = mask)
   vessels.nodes['position'] *= scaling
   vessels.edges['radius'] *= scaling
+  if sparse:
+    return krebsutils.make_vessel_volume_fraction_sparse(
+      vessels.nodes['position'],
+      vessels.edgelist,
+      vessels.edges['radius'],
+      ld,
+      samples_per_cell)
   vessel_fraction = krebsutils.make_vessel_volume_fraction_field(
     vessels.nodes['position'],
     vessels.edgelist,
@@ -416,7 +425,7 @@ def CalcPhiVessels(dataman, vesselgroup, ld, scaling, samples_per_cell = 5):
 
 class DataBasicVessel(object):
     keywords = [
-      'vessel_graph', 'vessel_graph_property', 'vessel_system_length'
+      'vessel_graph', 'vessel_graph_lazy', 'vessel_graph_property', 'vessel_system_length'
     ]
 
     def get_property(self, dataman, vesselgroup, association, property_name):
@@ -440,8 +449,39 @@ class DataBasicVessel(object):
       else:
         return np.asarray(vesselgroup[association][property_name]), association
 
+    def get_association(self, vesselgroup, property_name):
+      if property_name == 'position':
+        return 'nodes'
+      elif property_name in ('length', 'velocity'):
+        return 'edges'
+      elif property_name in vesselgroup['edges']:
+        return 'edges'
+      elif property_name in vesselgroup['nodes']:
+        return 'nodes'
+      return None
+
+    def lazy_property_(self, dataman, vesselgroup, association, property_name):
+      return krebsutils.LazyColumn(lambda : self.get_property(dataman, vesselgroup, association, property_name)[0])
+
+    def lazy_graph_(self, dataman, vesselgroup, properties):
+      # properties are read from the file when they are accessed first, so
+      # the graph is only usable while vesselgroup's file is open
+      graph = krebsutils.read_vessels_from_hdf(vesselgroup, [], return_graph=True, lazy=True)
+      for prop in properties:
+        association = self.get_association(vesselgroup, prop)
+        if association is None: # let get_property deal with it
+          data, association = self.get_property(dataman, vesselgroup, 'auto', prop)
+          getattr(graph, association)[prop] = data
+        else:
+          getattr(graph, association).set_lazy(prop, self.lazy_property_(dataman, vesselgroup, association, prop))
+      return graph
+
     def obtain_data(self, dataman, dataname, *args):
-      if dataname == 'vessel_graph':
+      if dataname == 'vessel_graph_lazy':
+        vesselgroup, properties = args
+        return self.lazy_graph_(dataman, vesselgroup, properties)
+
+      elif dataname == 'vessel_graph':
         vesselgroup, properties = args
         graph = krebsutils.read_vessels_from_hdf(vesselgroup, [], return_graph=True)
         for prop in properties:
@@ -463,36 +503,40 @@ class DataBasicVessel(object):
         return myutils.hdf_data_caching(read, write, group, ('vessel_system_length',), (1,))
 
 
-def combineSamples(obtain_samples, arg_list, every):
-  results = []
-  for args in arg_list:
-    smpl = obtain_samples(args)
-    results.append(smpl[::every])
-  return np.concatenate(results)
-
-
 class DataVesselSamples(object):
     keywords = [
-      'basic_vessel_samples', 'basic_vessel_samples_avg'
+      'basic_vessel_samples', 'basic_vessel_samples_avg', 'basic_vessel_sample_plan'
     ]
 
     def obtain_data(self, dataman, dataname, *args):
+      if dataname == 'basic_vessel_sample_plan':
+        # sample locations are generated once and shared by all properties
+        vesselgroup, sample_length = args
+        graph = dataman.obtain_data('vessel_graph', vesselgroup, ['position'])
+        return krebsutils.sample_edges_plan(graph.nodes['position'], graph.edgelist, sample_length)
+
       if dataname == 'basic_vessel_samples':
         property_name, vesselgroup, sample_length = args
-        #graph = dataman.obtain_data('vessel_graph', vesselgroup, ['position','flags'])
-        graph = dataman.obtain_data('vessel_graph', vesselgroup, ['position'])
+        plan = dataman.obtain_data('basic_vessel_sample_plan', vesselgroup, sample_length)
         if property_name == 'weight':
-          smpl = krebsutils.sample_edges_weights(graph.nodes['position'], graph.edgelist, sample_length)
+          return plan[2]
+        graph = dataman.obtain_data('vessel_graph', vesselgroup, ['position'])
+        data, association = dataman.obtain_data('vessel_graph_property', vesselgroup, 'auto', property_name)
+        if association == 'edges':
+          mode = krebsutils.VesselSamplingFlags.DATA_CONST
         else:
-          data, association = dataman.obtain_data('vessel_graph_property', vesselgroup, 'auto', property_name)
-          smpl = generate_samples(graph, data, association, sample_length)
-        return smpl
+          mode = krebsutils.VesselSamplingFlags.DATA_LINEAR | krebsutils.VesselSamplingFlags.DATA_PER_NODE
+        return krebsutils.interpolate_edge_samples(plan, graph.edgelist, data, mode)
 
       if dataname == 'basic_vessel_samples_avg':
-        property_name, vesselgroups, sample_length, every = args
-        def obtain_samples(group):
-          return dataman.obtain_data('basic_vessel_samples', property_name, group, sample_length)
-        return combineSamples(obtain_samples, vesselgroups, every)
+        # optional 5th argument: number of worker processes which sample the
+        # files of the ensemble in parallel, default 1 (in this process)
+        property_name, vesselgroups, sample_length, every = args[:4]
+        num_workers = args[4] if len(args) > 4 else 1
+        def merge(results):
+          return np.concatenate([ smpl[::every] for smpl in results ])
+        arg_list = [ (property_name, group, sample_length) for group in vesselgroups ]
+        return dataman.obtain_data_ensemble('basic_vessel_samples', arg_list, merge, num_workers)
 
 
 
@@ -513,18 +557,21 @@ def GenerateRadialDistributions(dataman, vesselgroup, tumorgroup, sample_length,
   dist_smpl   = dist_smpl[mask]
   weight_smpl = weight_smpl[mask]
 
+  bins = bins_spec.arange()
+  binning = myutils.Binning(bins, dist_smpl, weight_smpl)
+  vol_cnt = None
   res = []
   for (smpl, avg_mode) in sample_iterator:
-    bins = bins_spec.arange()
     if avg_mode is radialAvgPerVolume:
-      a = myutils.MeanValueArray.fromHistogram1d(bins, dist_smpl, smpl[mask], weight_smpl) # integral over length within bins
-      b = myutils.MeanValueArray.fromHistogram1d(bins, distmap.ravel(), np.ones_like(distmap.ravel())) # how much tissue volume in the bins
-      a.cnt = b.cnt.copy()
+      a = binning.meanValueArray(smpl[mask]) # integral over length within bins
+      if vol_cnt is None:
+        vol_cnt = myutils.Binning(bins, distmap).cnt # how much tissue volume in the bins
+      a.cnt = vol_cnt.copy()
       a.sum *= 1./(tumor_ld.scale**3)
       a.sqr *= a.sum**2  # length integral per tissue volume
       #a *= 1.e6
     elif avg_mode is radialAvgPerVessels:
-      a = myutils.MeanValueArray.fromHistogram1d(bins, dist_smpl, smpl[mask], weight_smpl)
+      a = binning.meanValueArray(smpl[mask])
     else:
       assert (avg_mode is radialAvgPerVolume or avg_mode is radialAvgPerVessels)
     res.append(a)
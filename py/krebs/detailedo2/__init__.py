@@ -31,6 +31,7 @@ import myutils
 import posixpath
 import math
 from copy import deepcopy
+import collections
 
 import krebsutils # import of this must come in front of import of detailedo2 libs because some required initialization stuff on the c++ side (see mainboost.cpp)
 if sys.flags.debug:
@@ -105,19 +106,87 @@ def copyVesselnetworkAndComputeFlow(gvdst, gv, bloodflowparams):
   gvndst.create_dataset('pressure'  , data = pressure   , compression = 9)
 
 
-def computePO2_(gdst, vesselgroup, tumorgroup, parameters):
+def readInitialState(po2group):
+  '''
+    initial state for computePO2_ from the result in po2group: a tuple
+    (po2vessels, po2field, cold_iterations), where cold_iterations is the
+    number of iterations the computation took, or would have taken, when
+    started from scratch (None if unknown).
+  '''
+  po2vessels = np.asarray(po2group['po2vessels'], dtype = np.float32)
+  if po2vessels.shape[1] <> 2: po2vessels = np.transpose(po2vessels)
+  po2field = np.ascontiguousarray(po2group['po2field'], dtype = np.float32)
+  warm_started = any(name in po2group and po2group[name][()] == 'true' for name in ('warm_start_field', 'warm_start_vessels'))
+  if 'cold_iterations' in po2group:
+    cold_iterations = int(po2group['cold_iterations'][()])
+  elif 'iterations' in po2group and not warm_started:
+    cold_iterations = len(po2group['iterations'])
+  else:
+    cold_iterations = None
+  return np.ascontiguousarray(po2vessels), po2field, cold_iterations
+
+
+def openInitialState_(initial_state):
+  '''initial_state is a po2 group or a H5FileReference to it'''
+  if isinstance(initial_state, myutils.H5FileReference):
+    initial_state = h5files.open(initial_state.fn, 'r', search = False)[initial_state.path]
+  return initial_state
+
+
+def computePO2_(gdst, vesselgroup, tumorgroup, parameters, initial_state = None):
+  '''
+    initial_state - optional result (po2 group or H5FileReference) of a
+    similar configuration, e.g. the previous time step or a neighboring
+    parameter set, from which the iteration is started. The field is
+    only used if the grid is the same, the vessel po2 only if the vessel
+    network has the same number of edges.
+  '''
+  initial_state = openInitialState_(initial_state)
+  prepareOutputGroup_(gdst, vesselgroup, tumorgroup, parameters, initial_state)
+  # now we can compute PO2. The c++ routine can a.t.m. only read from hdf so it has to use our new file
+  initial = readInitialState(initial_state) if initial_state else None
+  pickDetailedO2Library(parameters).computePO2(vesselgroup, tumorgroup, parameters, parameters.get('calcflow'), gdst, initial)
+  #r = pickDetailedO2Library(parameters).computePO2(vesselgroup, tumorgroup, parameters, parameters.get('calcflow'), gdst)
+  #return r
+
+
+def prepareOutputGroup_(gdst, vesselgroup, tumorgroup, parameters, initial_state):
   myutils.buildLink(gdst, 'SOURCE_VESSELS', vesselgroup)
   myutils.buildLink(gdst, 'SOURCE_TISSUE', tumorgroup)
+  myutils.buildLink(gdst, 'WARM_START_SOURCE', initial_state)
   gdst.attrs['PARAMETER_CHECKSUM'] = myutils.checksum(parameters)
   gdst.attrs['UUID']               = myutils.uuidstr()
   #writing parameters as acsii string. but i think it is better to store them as hdf datasets directly
   #ds = gdst.create_dataset('PARAMETERS_AS_JSON', data = np.string_(json.dumps(parameters, indent=2)))
   myutils.hdf_write_dict_hierarchy(gdst, 'parameters', parameters)
   gdst.file.flush()
-  # now we can compute PO2. The c++ routine can a.t.m. only read from hdf so it has to use our new file
-  pickDetailedO2Library(parameters).computePO2(vesselgroup, tumorgroup, parameters, parameters.get('calcflow'), gdst)
-  #r = pickDetailedO2Library(parameters).computePO2(vesselgroup, tumorgroup, parameters, parameters.get('calcflow'), gdst)
-  #return r
+
+
+def batchKey_(parameters):
+  '''parameter sets with equal keys have the same grid and blood flow, so they can be computed in one batch'''
+  return myutils.checksum(*[ parameters.get(k) for k in ('calcflow', 'grid_lattice_const', 'safety_layer_size', 'grid_lattice_size') ])
+
+
+def computePO2Batch_(gdsts, vesselgroups, tumorgroup, parameters_list, initial_state = None, warm_start = True):
+  '''
+    computePO2_ for several parameter sets, which must have the same
+    batchKey_, on one vessel network, writing to the groups gdsts.
+    vesselgroups are copies of the same network, one per result, to which
+    the results link; the first one is used for the computation. The
+    network, grid and tissue are set up once, and the tissue diffusion
+    matrix and preconditioner are reused. With warm_start, each
+    computation starts from the result of the previous one, the first
+    one from initial_state (if given).
+  '''
+  assert len(set(batchKey_(p) for p in parameters_list)) <= 1
+  initial_state = openInitialState_(initial_state)
+  previous = initial_state
+  for gdst, vesselgroup, parameters in zip(gdsts, vesselgroups, parameters_list):
+    prepareOutputGroup_(gdst, vesselgroup, tumorgroup, parameters, previous)
+    previous = gdst if warm_start else None
+  initial = readInitialState(initial_state) if initial_state else None
+  parameters = parameters_list[0]
+  pickDetailedO2Library(parameters).computePO2Batch(vesselgroups[0], tumorgroup, list(parameters_list), parameters.get('calcflow'), list(gdsts), initial, warm_start)
 
 
 def readParameters(po2group):
@@ -205,52 +274,133 @@ def CopyInputFileInfo_(fdst, fsrc):
       fdst.attrs[n2] = fsrc['parameters'].attrs[n1]
 
 
-def computePO2(f, group_path, parameters, cachelocation):
-  if not isinstance(f, h5py.File):
-    f = h5files.open(f, 'r+', search = False)  # we open with r+ because the cachelocation might be this file so we need to be able to write to it
-    return computePO2(f, group_path, parameters, cachelocation) # recurse
-
-  #==== is this from a tumor sim, or just a vessel network? get hdf group objects =====#
+def sourceGroups_(f, group_path):
+  '''is this from a tumor sim, or just a vessel network? returns (group, vesselgroup, tumorgroup)'''
   group = f[group_path]
   tumorgroup = None
-  vesselgroup1 = group
+  vesselgroup = group
   if 'vessels' in group:
-    vesselgroup1 = group['vessels']
+    vesselgroup = group['vessels']
     if 'tumor' in group:
       tumorgroup = group['tumor']
+  return group, vesselgroup, tumorgroup
+
+
+def readRef_(gmeasure, name):
+  gmeasure = gmeasure[name]
+  return myutils.H5FileReference(gmeasure.file.filename, gmeasure.name)
 
-  #====  this is for recomputing flow =====#
-  def read1(gmeasure, name):
-    gmeasure = gmeasure[name]
-    return myutils.H5FileReference(gmeasure.file.filename, gmeasure.name)
 
+def recomputedFlow_(fm, vesselgroup, parameters, cachelocation, computed = None):
+  '''
+    copy of vesselgroup with recomputed blood flow, cached in fm. If
+    computed (such a copy elsewhere) is given, it is copied instead of
+    computing the flow again.
+  '''
   def write1(gmeasure, name):
+    if computed is not None:
+      gmeasure.copy(computed, name)
+      return
     gdst = gmeasure.create_group(name)
-    copyVesselnetworkAndComputeFlow(gdst, vesselgroup1, parameters.get("calcflow"))
+    copyVesselnetworkAndComputeFlow(gdst, vesselgroup, parameters.get("calcflow"))
+
+  new_flow_data_ref = myutils.hdf_data_caching(readRef_, write1, fm, ('recomputed_flow', cachelocation[1]), (0, 1))
+  fv = h5files.open(new_flow_data_ref.fn,'r+', search = False)
+  return fv[new_flow_data_ref.path]
+
+
+def computePO2(f, group_path, parameters, cachelocation, initial_state = None):
+  if not isinstance(f, h5py.File):
+    f = h5files.open(f, 'r+', search = False)  # we open with r+ because the cachelocation might be this file so we need to be able to write to it
+    return computePO2(f, group_path, parameters, cachelocation, initial_state) # recurse
+
+  group, vesselgroup1, tumorgroup = sourceGroups_(f, group_path)
 
   #==== execute reading or computing and writing =====#
   fm = h5files.open(cachelocation[0], 'a', search = False) # this is the file where o2 stuff is stored
   CopyInputFileInfo_(fm, f)
-  new_flow_data_ref = myutils.hdf_data_caching(read1, write1, fm, ('recomputed_flow', cachelocation[1]), (0, 1))
-  fv = h5files.open(new_flow_data_ref.fn,'r+', search = False)
-  vesselgroup2 = fv[new_flow_data_ref.path]
+  vesselgroup2 = recomputedFlow_(fm, vesselgroup1, parameters, cachelocation)
 
   #====  this is for po2 =====#
-  def read2(gmeasure, name):
-    gmeasure = gmeasure[name]
-    return myutils.H5FileReference(gmeasure.file.filename, gmeasure.name)
-
   def write2(gmeasure, name):
     gdst = gmeasure.create_group(name)
     myutils.buildLink(gdst, 'SOURCE', group)
-    computePO2_(gdst, vesselgroup2, tumorgroup, parameters)
+    computePO2_(gdst, vesselgroup2, tumorgroup, parameters, initial_state)
 
   #==== execute reading or computing and writing =====#
-  o2data_ref = myutils.hdf_data_caching(read2, write2, fm, ('po2',cachelocation[1]), (1,1))
+  o2data_ref = myutils.hdf_data_caching(readRef_, write2, fm, ('po2',cachelocation[1]), (1,1))
   #=== return filename and path to po2 data ====#
   return o2data_ref
 
 
+class NotCached_(Exception):
+  pass
+
+
+def isCachedPO2_(fm, cachelocation):
+  '''True if computePO2 would find its result in fm. Invalid results are removed.'''
+  def write(gmeasure, name):
+    raise NotCached_()
+  try:
+    myutils.hdf_data_caching(readRef_, write, fm, ('po2',cachelocation[1]), (1,1))
+  except NotCached_:
+    return False
+  return True
+
+
+def computePO2Batch(f, group_path, parameter_sets, cachelocations, initial_state = None, warm_start = True):
+  '''
+    computePO2 for several parameter sets (list of (parameters, name)) on
+    the same group. cachelocations are given per parameter set. Results
+    which are not present yet are computed by computePO2Batch_. Each
+    batch has the same grid and blood flow. The flow is recomputed once
+    per batch and copied to the file of every result of the batch.
+    Results are marked valid (VERSION) only after their batch succeeded,
+    so an interrupted batch is computed again by the next run.
+    Returns a list of H5FileReference.
+  '''
+  if not isinstance(f, h5py.File):
+    f = h5files.open(f, 'r+', search = False)
+  group, vesselgroup1, tumorgroup = sourceGroups_(f, group_path)
+
+  pending = []
+  for (parameters, _), cachelocation in zip(parameter_sets, cachelocations):
+    fm = h5files.open(cachelocation[0], 'a', search = False)
+    CopyInputFileInfo_(fm, f)
+    if not isCachedPO2_(fm, cachelocation):
+      pending.append((fm, parameters, cachelocation))
+
+  batches = collections.OrderedDict()
+  for item in pending:
+    batches.setdefault(batchKey_(item[1]), []).append(item)
+  for items in batches.values():
+    gdsts = []
+    try:
+      vesselgroups = []
+      for fm, parameters, cachelocation in items:
+        vesselgroups.append(recomputedFlow_(fm, vesselgroup1, parameters, cachelocation, vesselgroups[0] if vesselgroups else None))
+        gdst = fm['po2'].create_group(myutils.sanitize_posixpath(cachelocation[1]))
+        gdsts.append(gdst)
+        myutils.buildLink(gdst, 'SOURCE', group)
+      _, parameters_list, _ = zip(*items)
+      computePO2Batch_(gdsts, vesselgroups, tumorgroup, parameters_list, initial_state, warm_start)
+    except:
+      for gdst in gdsts:
+        if gdst.name in gdst.file:
+          del gdst.file[gdst.name]
+      raise
+    for gdst in gdsts:
+      gdst.attrs['VERSION'] = 1
+      gdst.file.flush()
+    if warm_start:
+      initial_state = gdsts[-1]
+
+  refs = []
+  for fm, cachelocation in zip([ h5files.open(c[0], 'a', search = False) for c in cachelocations ], cachelocations):
+    refs.append(myutils.hdf_data_caching(readRef_, None, fm, ('po2',cachelocation[1]), (1,1)))
+  return refs
+
+
 ##############################################################################
 
 
@@ -260,20 +410,82 @@ def DiffRadiusToConsCoeff(rd, kd):
 chb_of_rbcs = 340./64458. # in mol/l, entspricht 34 g/dl
 
 
-def doit(fn, pattern, (parameters, parameters_name)):
+def parameterDistance_(a, b):
+  '''
+    how different two parameter sets are: sum of relative differences of
+    numbers, plus one for every other differing entry
+  '''
+  d = 0.
+  for k in set(a.keys()) | set(b.keys()):
+    if k in ('name', 'num_threads'):
+      continue
+    x, y = a.get(k), b.get(k)
+    if isinstance(x, dict) and isinstance(y, dict):
+      d += parameterDistance_(x, y)
+    elif isinstance(x, (int, float)) and isinstance(y, (int, float)) and not isinstance(x, bool):
+      d += abs(x-y)/max(abs(x), abs(y), 1.e-30)
+    elif x != y:
+      d += 1.
+  return d
+
+
+def orderForWarmStart(parameter_sets):
+  '''
+    indices of parameter_sets (list of (parameters, name)) in an order where
+    consecutive sets are similar, so each computation can start from the
+    result of the previous one. Greedy nearest neighbor, starting with the first.
+  '''
+  order = [0] if parameter_sets else []
+  todo = range(1, len(parameter_sets))
+  while todo:
+    last = parameter_sets[order[-1]][0]
+    i = min(todo, key = lambda i: parameterDistance_(last, parameter_sets[i][0]))
+    todo.remove(i)
+    order.append(i)
+  return order
+
+
+def computePO2Sweep(fn, pattern, parameter_sets, warm_start = True):
+  '''
+    computes po2 for all groups in fn matching pattern (e.g. the snapshots
+    of a tumor simulation) and all parameter_sets, a list of (parameters, name).
+    The runs are ordered such that consecutive runs are similar: parameter
+    sets in the order of orderForWarmStart, back and forth for consecutive
+    groups. The parameter sets of a group are computed as one batch, see
+    computePO2Batch; a single parameter set goes through computePO2. With warm_start, each run starts from the result of
+    the previous one. Results already present are reused, like in computePO2.
+    Returns a list of (group_path, name, H5FileReference) in the order of computation.
+  '''
   #fnpath = dirname(fn)
   fnbase = basename(fn).rsplit('.h5')[0]
   #outfn_no_ext = join(fnpath, fnbase+'_detailedpo2')
 
   output_links = []
+  order = orderForWarmStart(parameter_sets)
+  previous = None
 
   f = h5files.open(fn, 'r')
   dirs = myutils.walkh5(f['.'], pattern)
-  for group_path in dirs:
+  for i, group_path in enumerate(dirs):
+    sets = [ parameter_sets[k] for k in (order if i % 2 == 0 else order[::-1]) ]
     #cachelocation = (outfn_no_ext+'.h5', group_path+'_'+parameters_name)
-    cachelocation = ('o2_' + fnbase+'_'+parameters_name+'.h5', group_path)
-    ref = computePO2(f, group_path, parameters, cachelocation)
-    print 'computed po2 stored in:', ref
-    output_links.append(ref)
+    cachelocations = [ ('o2_' + fnbase+'_'+parameters_name+'.h5', group_path) for _, parameters_name in sets ]
+    if len(sets) == 1: # no batch needed
+      refs = [ computePO2(f, group_path, sets[0][0], cachelocations[0], previous if warm_start else None) ]
+    else:
+      refs = computePO2Batch(f, group_path, sets, cachelocations, previous if warm_start else None, warm_start)
+    for (_, parameters_name), ref in zip(sets, refs):
+      print 'computed po2 stored in:', ref
+      output_links.append((group_path, parameters_name, ref))
+    previous = refs[-1]
   return output_links
 
+
+def doit(fn, pattern, (parameters, parameters_name), warm_start = False):
+  '''
+    po2 for all groups in fn matching pattern. Returns a list of H5FileReference.
+    Each group is computed from scratch unless warm_start is requested, see
+    computePO2Sweep.
+  '''
+  return [ ref for _, _, ref in computePO2Sweep(fn, pattern, [(parameters, parameters_name)], warm_start) ]
+
@@ -258,33 +258,37 @@ class DataDetailedPO2(object):
         bins = bins_spec.arange()
         gmeasure = gmeasure.create_group(name)
 
+        binning_smpl = myutils.Binning(bins, dist_smpl, weight_smpl)
+        binning_field = myutils.Binning(bins, distmap)
+
         for name in ['po2','extpo2','jtv','sat','gtv','dS_dx']:
           smpl = dataman.obtain_data('detailedPO2_samples', name, po2group, sample_length, None, samplelocation)
-          myutils.MeanValueArray.fromHistogram1d(bins, dist_smpl, smpl[mask], w = weight_smpl).write(gmeasure, name)
+          binning_smpl.meanValueArray(smpl[mask]).write(gmeasure, name)
         del smpl
 
         _, po2ld, po2field, parameters = dataman.obtain_data('detailedPO2', po2group)
         po2field = krebsutils.resample_field(np.asarray(po2field), po2ld.worldBox, tumor_ld.shape, tumor_ld.worldBox, order=1, mode='nearest')
-        myutils.MeanValueArray.fromHistogram1d(bins, distmap.ravel(), po2field.ravel()).write(gmeasure, 'po2_tissue')
+        binning_field.meanValueArray(po2field).write(gmeasure, 'po2_tissue')
         del po2field
 
         uptakefield = detailedo2.computeO2Uptake(po2group, gtumor)
         uptakefield = krebsutils.resample_field(uptakefield, po2ld.worldBox, tumor_ld.shape, tumor_ld.worldBox, order=1, mode='nearest')
-        myutils.MeanValueArray.fromHistogram1d(bins, distmap.ravel(), uptakefield.ravel()).write(gmeasure, 'mro2')
+        binning_field.meanValueArray(uptakefield).write(gmeasure, 'mro2')
         del uptakefield
 
         hema = dataman.obtain_data('basic_vessel_samples', 'hematocrit', gvessels, sample_length)[mask]
         sat  = dataman.obtain_data('detailedPO2_samples' , 'sat', po2group, sample_length, None, samplelocation)[mask]
         rad  = dataman.obtain_data('basic_vessel_samples', 'radius', gvessels, sample_length)[mask]
         hbvolume = weight_smpl*rad*rad*math.pi*hema
-        vol_per_bin = myutils.MeanValueArray.fromHistogram1d(bins, distmap.ravel(), np.ones_like(distmap.ravel())).cnt*(tumor_ld.scale**3)
-        tmp = myutils.MeanValueArray.fromHistogram1d(bins, dist_smpl, hbvolume*sat)
+        vol_per_bin = binning_field.cnt*(tumor_ld.scale**3)
+        binning_smpl = myutils.Binning(bins, dist_smpl)
+        tmp = binning_smpl.meanValueArray(hbvolume*sat)
         tmp.cnt = vol_per_bin.copy()
         tmp.write(gmeasure, 'vfhb_oxy')
-        tmp = myutils.MeanValueArray.fromHistogram1d(bins, dist_smpl, hbvolume*(1.-sat))
+        tmp = binning_smpl.meanValueArray(hbvolume*(1.-sat))
         tmp.cnt = vol_per_bin.copy()
         tmp.write(gmeasure, 'vfhb_deoxy')
-        del tmp, hbvolume, vol_per_bin
+        del tmp, hbvolume, vol_per_bin, binning_smpl, binning_field
 
       version = getuuid_(po2group)
       ret = analyzeGeneral.HdfCacheRadialDistribution((read, write), 'po2', bins_spec, distance_distribution_name, cachelocation, version)
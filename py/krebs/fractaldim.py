@@ -162,6 +162,61 @@ def calcVesselBoxCounts(graph, spacing, spacing_max):
 
 
 
+def aggregateBlocks_(coords, values):
+  """
+    sums values with equal coords (int (n,3) arrays, >= 0).
+    returns the distinct coords and the sums.
+  """
+  if not len(coords):
+    return coords, values
+  coords = np.asarray(coords, dtype=np.int64)
+  n = np.amax(coords, axis=0) + 1
+  keys = (coords[:,0]*n[1] + coords[:,1])*n[2] + coords[:,2]
+  keys, idx, inv = np.unique(keys, return_index=True, return_inverse=True)
+  return coords[idx], np.bincount(inv, weights=values)
+
+
+def boxcountSparse(coords, volume, boxsize, max_boxsize, area = 5.**2):
+  """
+    boxcounting of a sparse vessel volume distribution, for the box sizes
+    boxsize*2**k up to max_boxsize. coords are the lattice indices of the
+    occupied sites, volume the vessel volume within them. A box of size s
+    is occupied if it contains more than area*s volume, as in
+    calcVesselBoxCounts. Counts for boxes larger than one site are averaged
+    over the 8 shifts of the box grid by half a box. Each box size is
+    computed from the boxes of the previous one, so the whole sequence
+    takes one pass over the sites.
+  """
+  blocks, vol = aggregateBlocks_(coords, volume)
+  res = [(boxsize, np.count_nonzero(vol > area*boxsize))]
+  while len(blocks) and boxsize*2. < max_boxsize:
+    boxsize *= 2.
+    cnt = 0
+    for offset in np.ndindex((2,2,2)):
+      _, v = aggregateBlocks_((blocks + offset) >> 1, vol)
+      cnt += np.count_nonzero(v > area*boxsize)
+    res.append((boxsize, cnt/8.))
+    blocks, vol = aggregateBlocks_(blocks >> 1, vol)
+  return np.asarray(res, dtype=np.double).transpose()
+
+
+def calcVesselBoxCountsSparse(graph, spacing, spacing_max):
+  """
+    like calcVesselBoxCounts, but the vessel volume is rasterized only
+    twice, with lattice spacings spacing and spacing*sqrt(2), and stored
+    sparsely. Larger boxes are counted with boxcountSparse.
+  """
+  res = []
+  for s in (spacing, spacing*math.sqrt(2.)):
+    ld = makeLd(graph, s, np.zeros(3))
+    print 'boxcounting spacing=%f, gridsize=%i (sparse)' % (ld.scale, max(ld.GetBox()))
+    coords, vf = krebsutils.make_vessel_volume_fraction_sparse(graph.nodes['position'], graph.edgelist, graph.edges['radius'], ld, 10)
+    res.append(boxcountSparse(coords, vf*ld.scale**3, ld.scale, spacing_max))
+  res = np.hstack(res)
+  return res[:,np.argsort(res[0])]
+
+
+
 def calcBoxCounts(data, vesselgroup, dataId, opts):
     """
       boxcounting for various configurations
@@ -199,7 +254,10 @@ def calcBoxCounts(data, vesselgroup, dataId, opts):
           #do boxcounting
           spacing = opts.spacing
           max_spacing = max(krebsutils.LatticeDataGetWorldSize(makeLd(graph, spacing, 0.)))
-          bs, bc = calcVesselBoxCounts(subgraph, spacing, max_spacing)
+          if getattr(opts, 'dense', False):
+            bs, bc = calcVesselBoxCounts(subgraph, spacing, max_spacing)
+          else:
+            bs, bc = calcVesselBoxCountsSparse(subgraph, spacing, max_spacing)
           data[dataId] = dict(bs = bs, bc = bc)
 
 
@@ -283,6 +341,7 @@ if __name__=='__main__':
   #parser.add_argument('--group', default='vessels')
   parser.add_argument('--prefix', default='fractaldim_')  
   parser.add_argument('--spacing', type=float, default=8.)
+  parser.add_argument('--dense', action='store_true', default=False, help='rasterize the vessels anew for each box size instead of boxcounting a sparse volume distribution')
   
   parser.add_argument('files', nargs='+', type=str, help='files to calculate')
   parser.add_argument('grp_pattern',help='Where to find the data in the file')  
@@ -28,6 +28,7 @@ import os, sys
 from os.path import join, basename, dirname, splitext
 import krebsutils
 import extractVtkFields
+import vesselLOD
 import pprint
 import numpy as np
 import h5py
@@ -72,11 +73,7 @@ def ConvertMyHdfVesselsToVTKPolydata(graph, newflag_for_backward_compatibility,
   num_edges = len(edges)
   print( "v %i e %i" % (num_verts, num_edges))
 
-  pts = vtkPoints()
-  pts.SetNumberOfPoints(len(pos))
-  for i,(x,y,z) in enumerate(pos):
-    pts.SetPoint(i, (float(x), float(y), float(z)))
-
+  pts = asVtkPoints(pos)
   cells = asVtkCellArray(edges)
 
   polydata = vtkPolyData()
@@ -87,14 +84,7 @@ def ConvertMyHdfVesselsToVTKPolydata(graph, newflag_for_backward_compatibility,
     #radius
     polydata.GetCellData().AddArray(asVtkArray(rad, "radius", vtkFloatArray))
     #nodes
-    node_rad = np.zeros(num_verts)
-    node_n   = np.zeros(num_verts)
-    for r,(a,b) in itertools.izip(rad,edges): # itertools, or it will blow up in yr face cuz ultra slow python lists and shit will be created
-      node_rad[a] += r
-      node_rad[b] += r
-      node_n[a] += 1.
-      node_n[b] += 1.
-    node_rad /= np.maximum(1, node_n)
+    node_rad = graph.edge_to_node_property(np.asarray(rad, dtype=np.float32), 'avg')
     polydata.GetPointData().AddArray(asVtkArray(node_rad, "point_radius", vtkFloatArray))
     
   if 1:
@@ -225,8 +215,8 @@ def writeFields_(graph, options):
   e.write(options.outfn % 'fields')
   del e
 
-def writeVessels_(graph, options):  
-  polydata = ConvertMyHdfVesselsToVTKPolydata(graph, new, goodArguments);
+def writeVessels_(graph, options, new = False):
+  polydata = ConvertMyHdfVesselsToVTKPolydata(graph, new, options);
   writer = vtkPolyDataWriter()
   print("use vtkVersion: %s" % vtkVersion.GetVTKVersion())
   if(int(vtkVersion.GetVTKVersion()[0])>5):
@@ -238,19 +228,73 @@ def writeVessels_(graph, options):
   writer.Write()
 
 
-def hdftumor2vtk(graph, options ):
+def hdftumor2vtk(graph, options, new = False):
   if options.writeFields:
     writeFields_(graph, options)
   if options.writeVessels:
-    writeVessels_(graph, options)
+    writeVessels_(graph, options, new)
+
+
+def read_graph_(vesselgroup, datalist, options, new = False):
+  if new:
+    graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce','nodeflags','edge_boundary'] + datalist, return_graph=True)
+  else:
+    graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce'] + datalist, return_graph=True)
+  if options.filteruncirculated:
+    graph = graph.get_filtered(edge_indices = myutils.bbitwise_and(graph['flags'], krebsutils.CIRCULATED))
+  max_segments = getattr(options, 'max_segments', None)
+  if max_segments:
+    graph = vesselLOD.decimate(graph, max_segments = max_segments, vesselgroup = vesselgroup)
+  return graph
+
+
+def convert_file(fn, pattern, datalist, options):
+  '''
+    converts all groups in file fn matching pattern. With options.batch all
+    time step groups (out*) are converted. If more than one group is
+    converted, the group name becomes part of the output file names.
+  '''
+  fn, _ = myutils.splitH5PathsFromFilename(fn)
+  new = False
+  with h5py.File(fn, 'r') as f:
+    if options.batch:
+      dirs = [ g.name.lstrip('/') for g in myutils.getTimeSortedGroups(f['.'], 'out') ]
+    else:
+      dirs = sorted(myutils.walkh5(f['/'], pattern))
+    user_outfn = options.outfn
+    if user_outfn:
+      print("you chose: %s as outfilename" % user_outfn)
+      outfn = user_outfn
+    else:
+      outfn = "%s-%%s.vtk" % (os.path.splitext(os.path.basename(fn))[0])
+    try:
+      for d in dirs:
+        if len(dirs) > 1:
+          stem, ext = os.path.splitext(outfn)
+          options.outfn = '%s-%s%s' % (stem, d.strip('/').replace('/', '_'), ext)
+        else:
+          options.outfn = outfn
+        if 'vessels' in d:
+          graph = read_graph_(f[join('/',d)]['.'], datalist, options, new)
+          writeVessels_(graph, options, new)
+        elif 'out' in d:
+          graph = read_graph_(f[join('/',d+'/vessels')]['.'], datalist, options, new)
+          hdftumor2vtk(graph, options, new)
+        else:
+          continue
+        del graph
+    finally:
+      options.outfn = user_outfn
 
 
 if __name__ == '__main__':
 
   import argparse
   parser = argparse.ArgumentParser(description='Export hdf data to ParaView.')  
-  parser.add_argument('vesselFileNames', nargs='*', type=argparse.FileType('r'), default=sys.stdin)
-  parser.add_argument('grp_pattern')
+  # the file names take all positionals, the pattern is split off after
+  # parsing. With --batch it is not used and may be omitted.
+  parser.add_argument('vesselFileNames', nargs='*')
+  parser.add_argument('grp_pattern', nargs='?', default=None)
   parser.add_argument("-d","--data", dest="datalist", help="which data (pressure, flow, shearforce, hematocrit) as comma separated list", default='pressure', action="store")
   parser.add_argument("-f","--filter-uncirculated", dest="filteruncirculated", help="filter uncirculated vessels", default=False, action="store_true")
   parser.add_argument("--filter-radius-high-pass", dest="filterradiushighpass", type=float, default=-1.0)
@@ -259,10 +303,23 @@ if __name__ == '__main__':
   parser.add_argument("--format", dest="format", default=None, action="store")
   parser.add_argument("-n", dest="out_nl", default = False, action="store") 
   parser.add_argument("--outFilename", dest="outfn", default= None)
+  parser.add_argument("--max-segments", dest="max_segments", type=int, default=None, help="coarsen capillaries until at most about this many vessel segments remain (for viewing large networks)")
+  parser.add_argument("--batch", help="convert all time step groups (out*) of each file, grp_pattern is ignored and may be omitted", default=False, action="store_true")
   '''this option come from the tumor side'''
   parser.add_argument("--writeVessels", help="when doing the tumor, export vesesls", default=True, action="store_true")  
   parser.add_argument("--writeFields", help="when doing the tumor, export Fields", default=True, action="store_true")  
   goodArguments, otherArguments = parser.parse_known_args()
+  names = goodArguments.vesselFileNames
+  if names and goodArguments.grp_pattern is None and not (goodArguments.batch and os.path.isfile(names[-1])):
+    goodArguments.grp_pattern = names.pop()
+  if goodArguments.grp_pattern is None and not goodArguments.batch:
+    parser.error('too few arguments')
+  if not names:
+    parser.error('no input files')
+  try:
+    goodArguments.vesselFileNames = map(argparse.FileType('r'), names)
+  except argparse.ArgumentTypeError, e:
+    parser.error(str(e))
   #create filename due to former standards
   filenames=[]
   for fn in goodArguments.vesselFileNames:
@@ -277,10 +334,12 @@ if __name__ == '__main__':
     for fn in goodArguments.vesselFileNames:
       if not os.path.isfile(fn.name):
         raise AssertionError('The file %s is not present!'%fn)
+      if goodArguments.batch:
+        continue
       with h5py.File(fn.name, 'r') as f:
         d = myutils.walkh5(f, goodArguments.grp_pattern)
         if not len(d)>0:
-          raise AssertionError('pattern "%s" not found in "%s"!' % (grp_pattern, fn))
+          raise AssertionError('pattern "%s" not found in "%s"!' % (pattern, fn))
         else:
           dirs = set.union(dirs,d)
   except Exception, e:
@@ -288,33 +347,4 @@ if __name__ == '__main__':
     sys.exit(-1)
 
   for fn in filenames:
-    fn, _ = myutils.splitH5PathsFromFilename(fn)
-    f = h5py.File(fn, 'r')
-    dirs = myutils.walkh5(f['/'], pattern)
-    if goodArguments.outfn:
-      print("you chose: %s as outfilename" % goodArguments.outfn)
-    else:
-      goodArguments.outfn = outfn = "%s-%%s.vtk" % (os.path.splitext(os.path.basename(fn))[0])
-    for d in dirs:
-      if 'vessels' in d:
-        vesselgroup = f[join('/',d)]['.']
-        new = False
-        if new:
-          graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce','nodeflags','edge_boundary'] + datalist, return_graph=True)
-        else:
-          graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce'] + datalist, return_graph=True)
-        if goodArguments.filteruncirculated:
-          graph = graph.get_filtered(edge_indices = myutils.bbitwise_and(graph['flags'], krebsutils.CIRCULATED))      
-        writeVessels_(graph, goodArguments)
-
-      elif 'out' in d:
-        vesselgroup = f[join('/',d+'/vessels')]['.']
-        new = False
-        if new:
-          graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce','nodeflags','edge_boundary'] + datalist, return_graph=True)
-        else:
-          graph = krebsutils.read_vessels_from_hdf(vesselgroup, ['position', 'radius', 'hematocrit', 'pressure', 'flow', 'flags','shearforce'] + datalist, return_graph=True)
-        if goodArguments.filteruncirculated:
-          graph = graph.get_filtered(edge_indices = myutils.bbitwise_and(graph['flags'], krebsutils.CIRCULATED))
-        hdftumor2vtk(graph, goodArguments)
-        
\ No newline at end of file
+    convert_file(fn, pattern, datalist, goodArguments)
@@ -0,0 +1,220 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+'''
+  Writes a XDMF index for the lattice fields of all time steps of a
+  simulation output file, for viewing in ParaView. The index refers to
+  the datasets in the simulation output; nothing is copied. Only the
+  node coordinates of the lattices are written, once, to a separate
+  geometry file (<xdmf file>-geometry.h5).
+
+  The fields are stored with the x axis varying slowest, while implicit
+  XDMF grids (CoRectMesh) assume x varies fastest. Therefore the grid
+  is given as structured mesh with explicit node coordinates. This way
+  positions and vector components come out right without transposing
+  the data.
+
+  Running it again on a file which has grown, or calling
+  XdmfTimeSeries.add_snapshot from a simulation, appends the new time
+  steps to an existing index.
+
+  usage: hdf2xdmf.py file.h5 [file2.h5 ...] [-o out.xdmf] [-p pattern]
+'''
+if __name__ == '__main__':
+  import os.path, sys
+  sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)),'..'))
+
+import os, sys
+import posixpath
+import numpy as np
+import h5py
+import xml.etree.ElementTree as ET
+
+import myutils
+import krebsutils
+import extractVtkFields
+
+
+def numbertype_(dtype):
+  kinds = { 'f' : 'Float', 'i' : 'Int', 'u' : 'UInt' }
+  if dtype.kind not in kinds:
+    return None
+  if dtype.kind == 'u' and dtype.itemsize == 1:
+    return 'UChar', 1
+  if dtype.kind == 'i' and dtype.itemsize == 1:
+    return 'Char', 1
+  return kinds[dtype.kind], dtype.itemsize
+
+
+def dataitem_(parent, shape, dtype, path):
+  '''path is "file.h5:/path/to/dataset"'''
+  nt, precision = numbertype_(dtype)
+  e = ET.SubElement(parent, 'DataItem', Dimensions = ' '.join(map(str, shape)),
+                    NumberType = nt, Precision = str(precision), Format = 'HDF')
+  e.text = path
+  return e
+
+
+def indent_(elem, level = 0):
+  i = '\n' + level*'  '
+  if len(elem):
+    if not elem.text or not elem.text.strip():
+      elem.text = i + '  '
+    for child in elem:
+      indent_(child, level+1)
+    if not child.tail or not child.tail.strip():
+      child.tail = i
+  if level and (not elem.tail or not elem.tail.strip()):
+    elem.tail = i
+
+
+def lattice_name_(ldpath):
+  return ldpath.strip('/').replace('/', '_') or 'lattice'
+
+
+class XdmfTimeSeries(object):
+  '''
+    A XDMF file with one temporal collection per lattice. Snapshots are
+    added with add_snapshot and the file is (re)written by write.
+    An existing file is read first, so snapshots can be appended.
+  '''
+  def __init__(self, filename):
+    self.filename = os.path.abspath(filename)
+    self.geometry_filename = os.path.splitext(self.filename)[0]+'-geometry.h5'
+    if os.path.isfile(self.filename):
+      self.root = ET.parse(self.filename).getroot()
+      self.domain = self.root.find('Domain')
+    else:
+      self.root = ET.Element('Xdmf', Version = '2.0')
+      self.domain = ET.SubElement(self.root, 'Domain')
+
+  def relpath_(self, fn):
+    return os.path.relpath(os.path.abspath(fn), os.path.dirname(self.filename))
+
+  def collection_(self, name):
+    for g in self.domain.findall('Grid'):
+      if g.get('Name') == name:
+        return g
+    return ET.SubElement(self.domain, 'Grid', Name = name, GridType = 'Collection', CollectionType = 'Temporal')
+
+  def snapshot_names(self):
+    return set(g.get('Name') for c in self.domain.findall('Grid') for g in c.findall('Grid'))
+
+  def geometry_(self, ldgroup):
+    '''node coordinates of the lattice, written to the geometry file if not there yet'''
+    name = lattice_name_(ldgroup.name)
+    ld = krebsutils.read_lattice_data_from_hdf(ldgroup)
+    shape = tuple(np.asarray(ld.shape)+1)
+    origin = np.asarray(ld.worldBox[[0, 2, 4]])
+    coords = [ (origin[i] + ld.scale*np.arange(shape[i])).astype(np.float32) for i in range(3) ]
+    with h5py.File(self.geometry_filename, 'a') as f:
+      ds = f.get(name, None)
+      if ds is None or ds.shape != shape+(3,) or not np.allclose(ds.attrs['origin'], origin) or ds.attrs['scale'] != ld.scale:
+        if ds is not None:
+          del f[name]
+        ds = f.create_dataset(name, shape+(3,), dtype = np.float32, chunks = (1,)+shape[1:]+(3,))
+        ds.attrs['origin'] = origin
+        ds.attrs['scale'] = ld.scale
+        plane = np.empty(shape[1:]+(3,), dtype = np.float32)
+        plane[...,1] = coords[1][:,None]
+        plane[...,2] = coords[2][None,:]
+        for i, x in enumerate(coords[0]):
+          plane[...,0] = x
+          ds[i] = plane
+    return shape, '%s:/%s' % (self.relpath_(self.geometry_filename), name)
+
+  def add_snapshot(self, group, time = None, name = None):
+    '''
+      adds all lattice fields found in the h5 group, one grid per lattice.
+      time defaults to the 'time' attribute of the group.
+    '''
+    if time is None:
+      time = group.attrs.get('time', len(self.snapshot_names()))
+    if name is None:
+      name = group.name
+    e = extractVtkFields.Extractor(group, ['.'], recursive = True)
+    h5path = self.relpath_(group.file.filename)
+    for ldpath, datasets in e.data.iteritems():
+      if ldpath is extractVtkFields.VtkFiles:
+        continue
+      nodeshape, geompath = self.geometry_(group.file[ldpath])
+      cellshape = tuple(n-1 for n in nodeshape)
+      grid = ET.SubElement(self.collection_(lattice_name_(ldpath)), 'Grid', Name = name, GridType = 'Uniform')
+      ET.SubElement(grid, 'Time', Value = repr(float(time)))
+      ET.SubElement(grid, 'Topology', TopologyType = '3DSMesh', Dimensions = ' '.join(map(str, nodeshape)))
+      dataitem_(ET.SubElement(grid, 'Geometry', GeometryType = 'XYZ'), nodeshape+(3,), np.dtype(np.float32), geompath)
+      for ds in datasets:
+        if numbertype_(ds.dtype) is None:
+          continue
+        if ds.shape == cellshape:
+          kind = 'Scalar'
+        elif ds.shape == cellshape+(3,):
+          kind = 'Vector'
+        else:
+          print 'hdf2xdmf: skipping %s with shape %s' % (ds.name, ds.shape)
+          continue
+        a = ET.SubElement(grid, 'Attribute', Name = posixpath.basename(ds.name), AttributeType = kind, Center = 'Cell')
+        dataitem_(a, ds.shape, ds.dtype, '%s:%s' % (h5path, ds.name))
+
+  def write(self):
+    indent_(self.root)
+    tmpfn = self.filename+'.tmp'
+    with open(tmpfn, 'w') as f:
+      f.write('<?xml version="1.0" ?>\n')
+      f.write('<!DOCTYPE Xdmf SYSTEM "Xdmf.dtd" []>\n')
+      f.write(ET.tostring(self.root))
+    os.rename(tmpfn, self.filename)
+
+
+def hdf2xdmf(fn, outfn = None, pattern = 'out'):
+  '''
+    index the time step groups (names starting with pattern) of fn in
+    outfn (default: fn with extension .xdmf). Time steps already in
+    outfn are kept and not added again. Returns the number of new snapshots.
+  '''
+  if outfn is None:
+    outfn = os.path.splitext(fn)[0]+'.xdmf'
+  series = XdmfTimeSeries(outfn)
+  known = series.snapshot_names()
+  num_new = 0
+  with h5py.File(fn, 'r') as f:
+    for g in myutils.getTimeSortedGroups(f['.'], pattern):
+      if g.name in known:
+        continue
+      series.add_snapshot(g)
+      num_new += 1
+  if num_new:
+    series.write()
+  return num_new
+
+
+if __name__ == '__main__':
+  import argparse
+  parser = argparse.ArgumentParser(description='Write (or extend) a XDMF time series index of the lattice fields in simulation output files.')
+  parser.add_argument('filenames', nargs='+')
+  parser.add_argument('-o', '--output', dest='outfn', default=None, help='xdmf file name, only with a single input file')
+  parser.add_argument('-p', '--pattern', default='out', help='prefix of the time step groups')
+  args = parser.parse_args()
+  if args.outfn and len(args.filenames) > 1:
+    parser.error('--output works only with a single input file')
+  for fn in args.filenames:
+    n = hdf2xdmf(fn, args.outfn, args.pattern)
+    print '%s: %i new time steps' % (fn, n)
@@ -48,10 +48,7 @@ def ConvertMyHdfVesselsToVTKPolydata(h5file, grpname):
   num_edges = len(edges)
   print "v %i e %i" % (num_verts, num_edges)
 
-  pts = vtkPoints()
-  pts.SetNumberOfPoints(len(pos))
-  for i,(x,y,z) in enumerate(pos):
-    pts.SetPoint(i, (x,y,z))
+  pts = asVtkPoints(pos)
 
   cells = asVtkCellArray(edges)
 
@@ -63,14 +60,7 @@ def ConvertMyHdfVesselsToVTKPolydata(h5file, grpname):
     #radius
     polydata.GetCellData().AddArray(asVtkArray(rad, "radius", vtkFloatArray))
     #nodes
-    node_rad = np.zeros(num_verts)
-    node_n   = np.zeros(num_verts)
-    for r,(a,b) in itertools.izip(rad,edges): # itertools, or it will blow up in yr face cuz ultra slow python lists and shit will be created
-      node_rad[a] += r
-      node_rad[b] += r
-      node_n[a] += 1.
-      node_n[b] += 1.
-    node_rad /= np.maximum(1, node_n)
+    node_rad = krebsutils.GraphAdjacency(num_verts, edges).edge_to_node_property(np.asarray(rad, dtype=np.float32), 'avg')
     polydata.GetPointData().AddArray(asVtkArray(node_rad, "point_radius", vtkFloatArray))
 
   if 1:
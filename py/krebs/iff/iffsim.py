@@ -39,6 +39,14 @@ def centerslice(a):
   return a[:,:,a.shape[2]/2]
 
 class Measure(object):
+  """
+    Callback for the drug simulation which records AUC, maximal concentration
+    and exposure times. The metrics are accumulated in memory and written to
+    measurements/drug_local_integral in the output file every flushintervall
+    (in simulation time, counted from the first callback, default 10 minutes)
+    and by flush(), which run_iffsim calls at the end. flushintervall = 0
+    writes at every callback, None only at the end.
+  """
   @staticmethod
   def obtain_dataset(f, name, shape):
     try:
@@ -58,7 +66,46 @@ class Measure(object):
     self.movieintervall = params.pop('movieintervall', None)
     self.nextmovie_t = 0
     self.movie_out_number = 0
-
+    self.flushintervall = params.pop('flushintervall', 10. * 60.)
+    self.nextflush_t = None
+    self.accumulators = None # dataset name -> array
+    self.tmp = None
+
+  def dataset_names_(self):
+    for in_ex in ['ex','in']:
+      yield 'auc_'+in_ex
+      yield 'c_max_'+in_ex
+    for i, in_ex in enumerate(['ex','in']):
+      for j, _ in enumerate(self.exposure_thresholds[i]):
+        yield 'exposure_time_%02i_%s' % (j,in_ex)
+
+  def init_accumulators_(self, shape):
+    # continue with data which is already in the file
+    self.accumulators = {}
+    with h5py.File(self.outfilename, 'r') as f:
+      g = f.get('measurements/drug_local_integral', {})
+      for name in self.dataset_names_():
+        if name in g:
+          self.accumulators[name] = np.asarray(g[name], dtype = np.float32)
+        else:
+          self.accumulators[name] = np.zeros(shape, dtype = np.float32)
+    self.tmp = np.empty(shape, dtype = np.float32)
+
+  def flush(self):
+    if self.accumulators is None:
+      return
+    with h5py.File(self.outfilename, 'r+') as f:
+      shape = self.tmp.shape
+      g = f.require_group('measurements').require_group('drug_local_integral')
+      for name in self.dataset_names_():
+        ds = Measure.obtain_dataset(g, name, shape)
+        ds[...] = self.accumulators[name]
+      for i, in_ex in enumerate(['ex','in']):
+        for j, exposure_conc in enumerate(self.exposure_thresholds[i]):
+          ds = g['exposure_time_%02i_%s' % (j,in_ex)]
+          ds.attrs['exposure_conc'] = exposure_conc
+          ds.attrs['exposure_conc_num'] = j
+      g.attrs['tend'] = self.lastt
 
   def __call__(self, *args, **kwargs):
     (t, _), conc = args
@@ -76,21 +123,26 @@ class Measure(object):
     # this code is for recording integral and other metrics at short intervalls
     dt = t - self.lastt
     self.lastt = t
-    with h5py.File(self.outfilename, 'r+') as f:
-      shape = conc[0].shape
-      g = f.require_group('measurements').require_group('drug_local_integral')
-      for i, in_ex in enumerate(['ex','in']):
-        ds = Measure.obtain_dataset(g, 'auc_'+in_ex, shape)
-        ds[:] = np.asarray(ds) + dt * conc[i] # numerical integration as step function -> AUC metric
-        ds = Measure.obtain_dataset(g, 'c_max_'+in_ex, shape)
-        ds[:] = np.maximum(np.asarray(ds), conc[i]) # maximal conc. metric
-      for i, in_ex in enumerate(['ex','in']):
-        for j, exposure_conc in enumerate(self.exposure_thresholds[i]):
-          ds = Measure.obtain_dataset(g, 'exposure_time_%02i_%s' % (j,in_ex), shape)
-          ds[:] = np.asarray(ds) + dt * (conc[i] > exposure_conc)
-          ds.attrs['exposure_conc'] = exposure_conc
-          ds.attrs['exposure_conc_num'] = j
-      g.attrs['tend'] = t
+    if self.accumulators is None:
+      self.init_accumulators_(conc[0].shape)
+    acc, tmp = self.accumulators, self.tmp
+    for i, in_ex in enumerate(['ex','in']):
+      np.multiply(conc[i], dt, out = tmp)
+      acc['auc_'+in_ex] += tmp # numerical integration as step function -> AUC metric
+      np.maximum(acc['c_max_'+in_ex], conc[i], out = acc['c_max_'+in_ex]) # maximal conc. metric
+      for j, exposure_conc in enumerate(self.exposure_thresholds[i]):
+        np.greater(conc[i], exposure_conc, out = tmp)
+        tmp *= dt
+        acc['exposure_time_%02i_%s' % (j,in_ex)] += tmp
+    if self.flushintervall is not None:
+      if not self.flushintervall:
+        self.flush()
+      elif self.nextflush_t is None:
+        self.nextflush_t = t + self.flushintervall
+      elif t - self.nextflush_t >= -0.1*dt:
+        while t - self.nextflush_t >= -0.1*dt:
+          self.nextflush_t += self.flushintervall
+        self.flush()
     # this code is for recording slices through the conc. distributions at short intervalls
     if self.moviefilename and self.movieintervall and (t - self.nextmovie_t >=  -0.1*dt):
       self.nextmovie_t += self.movieintervall
@@ -113,7 +165,11 @@ def run_iffsim(params):
   measure_params = params.pop('ift_measure', dict())
 
   krebsutils.set_num_threads(params.pop('num_threads', 1))
-  krebsutils.run_iffsim(dicttoinfo.dicttoinfo(params), str(outfilename.encode('utf-8')), Measure(outfilename, measure_params))
+  measure = Measure(outfilename, measure_params)
+  try:
+    krebsutils.run_iffsim(dicttoinfo.dicttoinfo(params), str(outfilename.encode('utf-8')), measure)
+  finally:
+    measure.flush()
 
 
 if __name__ == '__main__':
@@ -74,15 +74,37 @@ def get_tumld(tumorgroup):
   #tum_ld = krebsutils.read_lattice_data_from_hdf(tumorgroup.file[tumorgroup['conc'].attrs['LATTICE_PATH']])  
   return tum_ld
 
-def calc_distmap(tumorgroup):
+def calc_distmap(tumorgroup, slab_size = None):
+  '''
+    signed distance from the tumor boundary (float32). The levelset is
+    read in slabs of slab_size planes, but flood fill and distance
+    transform need the whole lattice.
+  '''
   ld = get_tumld(tumorgroup)
-  distmap = np.asarray(tumorgroup['ls']) > 0
+  ls = tumorgroup['ls']
+  if not slab_size:
+    slab_size = ls.shape[0]
+  distmap = np.empty(ls.shape, dtype = np.uint8)
+  for i in xrange(0, ls.shape[0], slab_size):
+    sl = slice(i, min(i+slab_size, ls.shape[0]))
+    distmap[sl] = np.asarray(ls[sl]) > 0
   distmap = krebsutils.flood_fill(distmap, (0,0,0))
   distmap = np.logical_not(distmap)
-  distmap = krebsutils.distancemap(distmap)*ld.scale
+  distmap = krebsutils.distancemap(distmap)
+  distmap *= ld.scale
   return distmap
 
 
+def distmap_dataset_(tumorgroup, dstgroup, slab_size):
+  '''the distance map, stored once in dstgroup as float32 dataset chunked by slabs'''
+  def write(gmeasure, name):
+    distmap = calc_distmap(tumorgroup, slab_size)
+    gmeasure.create_dataset(name, data = distmap, dtype = np.float32, chunks = (min(slab_size, distmap.shape[0]),)+distmap.shape[1:])
+  def read(gmeasure, name):
+    return gmeasure[name]
+  return myutils.hdf_data_caching(read, write, dstgroup, ('distmap',), (1,))
+
+
 def integrate_surface(vtkds):
   surface = vtkcommon.vtkScaleDataSet(vtkds, 1)
   surface.GetCellData().SetActiveScalars('ls')
@@ -94,14 +116,169 @@ def integrate_surface(vtkds):
 
 
 
-def generate_data(statedata, dstgroup):
+def write_geometry_data_(statedata, dstgroup, tum_ld, vol, radius):
+  time = statedata.attrs['time']
+  vtkds, = extractVtkFields.Extractor(statedata['tumor'], ['ls']).asVtkDataSets()
+  area = integrate_surface(vtkds)
+  del vtkds
+  sphere_equiv_radius = math.pow(vol*3./(4.*math.pi), 1./3.)
+  sphere_equiv_area = 4.*math.pi*(sphere_equiv_radius ** 2)
+  sphericity = sphere_equiv_area / area if area > 0. else float('nan')
+  #cylinder vol = pi r^2 h
+  cylinder_equiv_radius = math.sqrt(vol / tum_ld.GetWorldSize()[2]  / math.pi)
+  cylinder_equiv_area = 2.*math.pi*cylinder_equiv_radius*tum_ld.GetWorldSize()[2]
+  cylindericity = cylinder_equiv_area / area if area > 0. else float('nan')
+
+  d = dict(time = time, area = area, volume = vol,
+           radius=radius, sphericity = sphericity, cylindericity = cylindericity,
+           sphere_equiv_radius = sphere_equiv_radius, sphere_equiv_area = sphere_equiv_area,
+           cylinder_equiv_radius = cylinder_equiv_radius, cylinder_equiv_area = cylinder_equiv_area
+           )
+  pprint(d)
+
+  print 'geometry data for %s/%s' % (statedata.file.filename, statedata.name)
+  g = dstgroup.recreate_group('geometry')
+  myutils.hdf_write_dict_hierarchy(g,'.',d)
+
+
+def lattice_axes_(ld):
+  '''world coordinates of the sites along each axis of a lattice'''
+  b = ld.box.reshape(3,2)
+  axes = []
+  for ax in range(3):
+    p = list(b[:,0])
+    coords = []
+    for i in xrange(b[ax,0], b[ax,1]+1):
+      p[ax] = i
+      coords.append(ld.LatticeToWorld(tuple(p))[ax])
+    axes.append(np.asarray(coords, dtype = np.float32))
+  return axes
+
+
+def generate_data_streaming(statedata, dstgroup, slab_size):
+  """
+    Does the same measurements as generate_data but runs over the lattice
+    fields in slabs of slab_size planes along the first axis, accumulating
+    all radial profiles in one pass. The radial distance and the radial
+    velocity component are computed analytically per slab.
+
+    The peak memory is NOT bounded by the slab size: the distance from
+    the tumor boundary needs a flood fill and distance transform over
+    the whole lattice. It is computed once, stored as float32 dataset
+    'distmap' in dstgroup and read back slab-wise. Sampling it at the
+    vessel positions still reads it in full, so the peak is one float32
+    lattice field, plus two uint8 ones when the distance map is computed.
+  """
+  print statedata.file.filename, statedata.name, '(streaming, slab size %i)' % slab_size
+
+  tum_grp = statedata['tumor']
+  tum_ld  = get_tumld(tum_grp)
+  cellvol = tum_ld.scale**3
+  shape = tuple(tum_grp['ptc'].shape)
+  axes = lattice_axes_(tum_ld)
+  wbox = tum_ld.worldBox.reshape(3,2)
+
+  print 'regenerating radial for %s/%s' % (statedata.file.filename, statedata.name)
+  dstdata = dstgroup.recreate_group('radial')
+  dstdata.recreate_group('vs_r').create_dataset('bins', data = np.average((bins_rad[:-1],bins_rad[1:]), axis=0))
+  dstdata.recreate_group('vs_dr').create_dataset('bins', data = np.average((bins_dist[:-1],bins_dist[1:]), axis=0))
+
+  ## radial data; vessels
+  vessels = krebsutils.read_vesselgraph(statedata['vessels'], ['position',  'flags', 'shearforce', 'radius', 'flow', 'maturation'])
+  vessels = vessels.get_filtered(edge_indices = (vessels.edges['flags'] & krebsutils.CIRCULATED != 0))
+  sample_length = 50.
+  far = 1.e10
+
+  ds_distmap = distmap_dataset_(tum_grp, dstgroup, slab_size)
+  names = ['shearforce', 'radius', 'flow', 'maturation' ]
+  smpl = krebsutils.sample_graph(vessels, names, sample_length)
+  s = smpl.pop('position')
+  dist = krebsutils.sample_field(s, np.asarray(ds_distmap), tum_ld, linear_interpolation=True, extrapolation_value = far)
+  rad = np.sqrt(np.sum(np.square(s), axis=1))
+  rad[np.any((s < wbox[:,0]) | (s > wbox[:,1]), axis=1)] = far
+  num_smpl = len(s)
+  del s
+  binning_smpl = dict(vs_r = myutils.Binning(bins_rad, rad), vs_dr = myutils.Binning(bins_dist, dist))
+  del rad, dist
+  for name in names:
+    s = smpl.pop(name)
+    for flavor in ['vs_r', 'vs_dr']:
+      binning_smpl[flavor].meanValueArray(s).write(dstdata[flavor], name)
+  mvd = dict((flavor, b.meanValueArray(np.ones(num_smpl))) for flavor, b in binning_smpl.iteritems())
+  del vessels, binning_smpl
+
+  def slab_fields(sl, pos, radialmap):
+    ptc  = np.asarray(tum_grp['ptc'][sl])
+    conc = np.asarray(tum_grp['conc'][sl])
+    yield 'ptc', ptc
+    yield 'conc', conc
+    yield 'phi_tumor', ptc*conc
+    del ptc, conc
+    for name in ['sources', 'press']:
+      yield name, np.asarray(tum_grp[name][sl])
+    # velocities, projected radially outward
+    vel = np.asarray(tum_grp['vel'][sl])
+    vnorm = vel[...,0]*pos[0]
+    vnorm += vel[...,1]*pos[1]
+    vnorm += vel[...,2]*pos[2]
+    del vel
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+      vnorm /= radialmap
+    vnorm[radialmap == 0.] = 0.
+    yield 'vel', vnorm
+    del vnorm
+    yield 'oxy', np.asarray(statedata['fieldOxy'][sl])
+    yield 'gf', np.asarray(statedata['fieldGf'][sl])
+
+  result = defaultdict(myutils.MeanValueArray.empty)
+  vol_cnt = dict(vs_r = 0., vs_dr = 0.)
+  tumor_sites, rim_radius_sum, rim_sites = 0., 0., 0
+  for i in xrange(0, shape[0], slab_size):
+    sl = slice(i, min(i+slab_size, shape[0]))
+    pos = (axes[0][sl,None,None], axes[1][None,:,None], axes[2][None,None,:])
+    radialmap = np.sqrt(np.square(pos[0]) + np.square(pos[1]) + np.square(pos[2]))
+    distmap = ds_distmap[sl]
+    rim = np.logical_and(distmap>-2*tum_ld.scale, distmap<2*tum_ld.scale)
+    rim_radius_sum += np.sum(radialmap[rim])
+    rim_sites += np.count_nonzero(rim)
+    del rim
+    binning_field = dict(vs_r = myutils.Binning(bins_rad, radialmap), vs_dr = myutils.Binning(bins_dist, distmap))
+    del distmap
+    for flavor in ['vs_r', 'vs_dr']:
+      vol_cnt[flavor] += binning_field[flavor].cnt
+    for name, field in slab_fields(sl, pos, radialmap):
+      if name == 'ptc':
+        tumor_sites += np.sum(field)
+      for flavor in ['vs_r', 'vs_dr']:
+        result[flavor, name] += binning_field[flavor].meanValueArray(field)
+    del binning_field, radialmap
+
+  for (flavor, name), a in result.iteritems():
+    a.write(dstdata[flavor], name)
+  for flavor, a in mvd.iteritems():
+    a.cnt = vol_cnt[flavor].copy()
+    a.sum *= sample_length/cellvol
+    a.sqr *= a.sum**2
+    a.write(dstdata[flavor], 'mvd')
+
+  # like np.average in generate_data, nan if there is no tumor rim
+  rim_radius = rim_radius_sum/rim_sites if rim_sites else float('nan')
+  write_geometry_data_(statedata, dstgroup, tum_ld, tumor_sites*cellvol, rim_radius)
+
+
+def generate_data(statedata, dstgroup, slab_size = None):
   """
     main routine that does all the measurement. 
     Enable Individual parts. Computed date overwrites old data.
+    With slab_size > 0 (default: env. var. MEASURE_SLAB_SIZE) the
+    lattice fields are processed slab-wise by generate_data_streaming.
   """
+  if slab_size is None:
+    slab_size = int(os.environ.get('MEASURE_SLAB_SIZE', 0))
+  if slab_size > 0:
+    return generate_data_streaming(statedata, dstgroup, slab_size)
   print statedata.file.filename, statedata.name
 
-  time = statedata.attrs['time']
   tum_grp = statedata['tumor']
   tum_ld  = get_tumld(tum_grp)
   cellvol = tum_ld.scale**3
@@ -112,29 +289,9 @@ def generate_data(statedata, dstgroup):
 
   if 1:
     ## shape data: rim surface area, volume
-    vtkds, = extractVtkFields.Extractor(statedata['tumor'], ['ls']).asVtkDataSets()
-    area = integrate_surface(vtkds)
-    del vtkds
     vol = np.sum(ptc)*cellvol
     radius = np.average(radialmap[np.nonzero(np.logical_and(distmap>-2*tum_ld.scale, distmap<2*tum_ld.scale))])
-    sphere_equiv_radius = math.pow(vol*3./(4.*math.pi), 1./3.)
-    sphere_equiv_area = 4.*math.pi*(sphere_equiv_radius ** 2)
-    sphericity = sphere_equiv_area / area
-    #cylinder vol = pi r^2 h
-    cylinder_equiv_radius = math.sqrt(vol / tum_ld.GetWorldSize()[2]  / math.pi)
-    cylinder_equiv_area = 2.*math.pi*cylinder_equiv_radius*tum_ld.GetWorldSize()[2]
-    cylindericity = cylinder_equiv_area / area
-
-    d = dict(time = time, area = area, volume = vol,
-             radius=radius, sphericity = sphericity, cylindericity = cylindericity,
-             sphere_equiv_radius = sphere_equiv_radius, sphere_equiv_area = sphere_equiv_area,
-             cylinder_equiv_radius = cylinder_equiv_radius, cylinder_equiv_area = cylinder_equiv_area
-             )
-    pprint(d)
-
-    print 'geometry data for %s/%s' % (statedata.file.filename, statedata.name)
-    g = dstgroup.recreate_group('geometry')
-    myutils.hdf_write_dict_hierarchy(g,'.',d)
+    write_geometry_data_(statedata, dstgroup, tum_ld, vol, radius)
 
 
   if 1:
@@ -148,7 +305,9 @@ def generate_data(statedata, dstgroup):
 
     far = 1.e10
 
-    s = plotVessels.generate_samples(vessels, 'position', 'nodes', sample_length)
+    names = ['shearforce', 'radius', 'flow', 'maturation' ]
+    smpl = krebsutils.sample_graph(vessels, names, sample_length)
+    s = smpl.pop('position')
     dist = krebsutils.sample_field(s, distmap, tum_ld, linear_interpolation=True, extrapolation_value = far)
     rad = krebsutils.sample_field(s, radialmap, tum_ld, linear_interpolation=True, extrapolation_value = far)
     del s
@@ -161,19 +320,22 @@ def generate_data(statedata, dstgroup):
 #    def add_histogram_data(dst, name, (s_avg, s_std, s_sqr)):
 #      dst[name] = dict(avg = s_avg, std = s_std, sqr = s_sqr)
 
-    for name in ['shearforce', 'radius', 'flow', 'maturation' ]:
-      s = plotVessels.generate_samples(vessels, name, 'edges', sample_length)
-      myutils.MeanValueArray.fromHistogram1d(bins_rad, rad, s).write(dstdata['vs_r'], name)
-      myutils.MeanValueArray.fromHistogram1d(bins_dist, dist, s).write(dstdata['vs_dr'], name)
+    # bin indices of samples and lattice sites are computed once and reused for all quantities
+    binning_smpl = dict(vs_r = myutils.Binning(bins_rad, rad), vs_dr = myutils.Binning(bins_dist, dist))
+    binning_field = dict(vs_r = myutils.Binning(bins_rad, radialmap), vs_dr = myutils.Binning(bins_dist, distmap))
+
+    for name in names:
+      s = smpl.pop(name)
+      for flavor in ['vs_r', 'vs_dr']:
+        binning_smpl[flavor].meanValueArray(s).write(dstdata[flavor], name)
 #      d = myutils.scatter_histogram(rad, s, bins_rad, 1.)
 #      add_histogram_data(dstdata['vs_r'], name, d)
 #      d = myutils.scatter_histogram(dist, s, bins_dist, 1.)
 #      add_histogram_data(dstdata['vs_dr'], name, d)
 
     def make_mvd(flavor, s, bins, smap, mask_bound):
-      a = myutils.MeanValueArray.fromHistogram1d(bins, s, np.ones_like(s))
-      b = myutils.MeanValueArray.fromHistogram1d(bins, smap.ravel(), np.ones_like(smap.ravel()))
-      a.cnt = b.cnt.copy()
+      a = binning_smpl[flavor].meanValueArray(np.ones_like(s))
+      a.cnt = binning_field[flavor].cnt.copy()
       a.sum *= sample_length/cellvol
       a.sqr *= a.sum**2
       a.write(dstdata[flavor], 'mvd')
@@ -196,8 +358,8 @@ def generate_data(statedata, dstgroup):
 
     for name in ['conc', 'sources', 'ptc', 'press']:
       a = np.ravel(np.asarray(tum_grp[name]))
-      myutils.MeanValueArray.fromHistogram1d(bins_rad, np.ravel(radialmap), a).write(dstdata['vs_r'], name)
-      myutils.MeanValueArray.fromHistogram1d(bins_dist, np.ravel(distmap), a).write(dstdata['vs_dr'], name)
+      for flavor in ['vs_r', 'vs_dr']:
+        binning_field[flavor].meanValueArray(a).write(dstdata[flavor], name)
 #      d = myutils.scatter_histogram(np.ravel(distmap), np.ravel(np.asarray(tum_grp[name])), bins_dist, 1.)
 #      add_histogram_data(dstdata['vs_dr'], name, d)
 #      d = myutils.scatter_histogram(np.ravel(radialmap), np.ravel(np.asarray(tum_grp[name])), bins_rad, 1.)
@@ -222,8 +384,8 @@ def generate_data(statedata, dstgroup):
                         ('oxy', oxy),
                         ('gf', gf)]:
       a = np.ravel(field)
-      myutils.MeanValueArray.fromHistogram1d(bins_rad, np.ravel(radialmap), a).write(dstdata['vs_r'], name)
-      myutils.MeanValueArray.fromHistogram1d(bins_dist, np.ravel(distmap), a).write(dstdata['vs_dr'], name)
+      for flavor in ['vs_r', 'vs_dr']:
+        binning_field[flavor].meanValueArray(a).write(dstdata[flavor], name)
 
 #      d = myutils.scatter_histogram(np.ravel(distmap), np.ravel(field), bins_dist, 1.)
 #      add_histogram_data(dstdata['vs_dr'], name, d)
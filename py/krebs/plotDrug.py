@@ -226,7 +226,8 @@ class DataDrugSingle(object):
                                                     bins_per_unit=2,
                                                     return_raw_data = True,
                                                     subtract_avg = dataname.endswith('minus_avg'),
-                                                    mask = mask)
+                                                    mask = mask,
+                                                    method = 'auto')
         r *= ld.scale
         corr = myutils.MeanValueArray(n, c, c2)
         corr.write(gmeasure, group)
@@ -561,10 +561,13 @@ class DataRadialIff(object):
       distmap = obtain_data('tumor_composition')['dist_tumor']
       map_r = dict(vs_r = radialmap, vs_dr = distmap)
       #
-      smpl_pos  = plotVessels.generate_samples(vessels, 'position', 'nodes', sample_length)
+      smpl = krebsutils.sample_graph(vessels, ['pressure', 'wall_conductivity', 'radius', 'conductivity', 'flow'], sample_length)
+      smpl_pos  = smpl['position']
       smpl_dist = krebsutils.sample_field(smpl_pos, distmap, ld, linear_interpolation=True, extrapolation_value = far)
       smpl_rad  = krebsutils.sample_field(smpl_pos, radialmap, ld, linear_interpolation=True, extrapolation_value = far)
       smpl_r = dict(vs_r = smpl_rad, vs_dr = smpl_dist)
+      binning_smpl  = dict((flavor, myutils.Binning(bins_r[flavor], smpl_r[flavor])) for flavor in ['vs_r', 'vs_dr'])
+      binning_field = dict((flavor, myutils.Binning(bins_r[flavor], map_r[flavor])) for flavor in ['vs_r', 'vs_dr'])
 
       gmeasure.require_group('radial').require_group('vs_r').create_dataset('bins', data = np.average((bins_rad[:-1],bins_rad[1:]), axis=0))
       gmeasure.require_group('radial').require_group('vs_dr').create_dataset('bins', data = np.average((bins_dist[:-1],bins_dist[1:]), axis=0))
@@ -590,17 +593,17 @@ class DataRadialIff(object):
         for flavor in ['vs_r', 'vs_dr']:
           #d = myutils.scatter_histogram(smpl_r[flavor], samples, bins_r[flavor], 1.)
           #store_histogram_data(flavor, name, d)
-          d = myutils.MeanValueArray.fromHistogram1d(bins_r[flavor], smpl_r[flavor], samples)
+          d = binning_smpl[flavor].meanValueArray(samples)
           store_histogram_data(flavor, name, d)
         store_samples(name, samples)
 
       def store_fielddata(name, samples, mask = None):
         for flavor in ['vs_r', 'vs_dr']:
-          x, y = map_r[flavor], samples
           if mask is not None:
-            x, y = x[mask], y[mask]
+            d = myutils.MeanValueArray.fromHistogram1d(bins_r[flavor], map_r[flavor][mask], samples[mask])
+          else:
+            d = binning_field[flavor].meanValueArray(samples)
           #d = myutils.scatter_histogram(x.ravel(), y.ravel(), bins_r[flavor], 1.)
-          d = myutils.MeanValueArray.fromHistogram1d(bins_r[flavor], x.ravel(), y.ravel())
           store_histogram_data(flavor, name, d)
 
       g = f['iff']
@@ -615,17 +618,17 @@ class DataRadialIff(object):
       store_fielddata('iff_sources_vess_in', np.asarray(g['iff_sources_vess_in']))
       store_fielddata('iff_sources_lymph_out', np.asarray(g['iff_sources_lymph_out']))
 
-      smpl_pressure = plotVessels.generate_samples(vessels, 'pressure', 'nodes', sample_length)
+      smpl_pressure = smpl['pressure']
       store_vesseldata('ivp', smpl_pressure)
 
       store_vesseldata('ivp_minus_ifp', smpl_pressure - smpl_ifp)
       #del smpl_pressure, smpl_ifp, smpl_pos
 
-      smpl_vess_wcond = plotVessels.generate_samples(vessels, 'wall_conductivity', 'edges', sample_length)
-      smpl_vess_radii = plotVessels.generate_samples(vessels, 'radius', 'edges', sample_length)
+      smpl_vess_wcond = smpl['wall_conductivity']
+      smpl_vess_radii = smpl['radius']
       smpl_vess_wcond *= math.pi*2.*smpl_vess_radii
-      smpl_vess_cond = plotVessels.generate_samples(vessels, 'conductivity', 'edges', sample_length)
-      smpl_vess_flow = plotVessels.generate_samples(vessels, 'flow', 'edges', sample_length)
+      smpl_vess_cond = smpl['conductivity']
+      smpl_vess_flow = smpl['flow']
       smpl_vess_outflux = smpl_vess_wcond*(smpl_pressure-smpl_ifp)
       smpl_outflux_per_flow = smpl_vess_outflux / smpl_vess_flow
       smpl_vess_lambda = np.sqrt(smpl_vess_cond / smpl_vess_wcond)
@@ -173,6 +173,8 @@ def getMultiScatter(scale, vesselgroups):
   for f in vesselgroups:
     #ld = krebsutils.read_lattice_data_from_hdf(krebsutils.find_lattice_group_(f['vessels']))
 
+    # no vesselLOD decimation here: merged capillaries would bias the samples.
+    # The number of scatter points is bounded by the sample length instead.
     graph = analyzeGeneral.read_vessels_data(f, ['position', 'flags', 'radius', 'pressure', 'flow', 'shearforce'])
 
 #    dd = krebsutils.calc_vessel_hydrodynamics(f['vessels'])
@@ -196,10 +198,11 @@ def getMultiScatter(scale, vesselgroups):
     mydata = {}
     for subgroup in ['art', 'vein', 'capi']:
       subgraph = graph.get_filtered(edge_indices=indices[subgroup])
-      mydata[('pressure', subgroup)] = generate_samples(subgraph, 'pressure', 'nodes', scale)
-      mydata[('flow', subgroup)] = q = generate_samples(subgraph, 'flow', 'edges', scale)
-      mydata[('shearforce', subgroup)] = generate_samples(subgraph, 'shearforce', 'edges', scale)
-      mydata[('radius', subgroup)] = r = generate_samples(subgraph, 'radius', 'edges', scale)
+      smpl = krebsutils.sample_graph(subgraph, ['pressure', 'flow', 'shearforce', 'radius'], scale)
+      mydata[('pressure', subgroup)] = smpl['pressure']
+      mydata[('flow', subgroup)] = q = smpl['flow']
+      mydata[('shearforce', subgroup)] = smpl['shearforce']
+      mydata[('radius', subgroup)] = r = smpl['radius']
       mydata[('velocity', subgroup)] = q/(r*r*math.pi)
     r = mydata[('radius', 'capi')]
     r *= np.sign(np.random.random_sample(r.shape)-0.5)
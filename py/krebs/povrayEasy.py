@@ -24,6 +24,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from vec import Vec3
 
 import os
+import time
+import atexit
+import shutil
+import hashlib
+import tempfile
+import subprocess
 import mkstemp
 import krebsutils
 import povray as pv
@@ -167,6 +173,123 @@ class VolumeData(object):
 
 
 
+##############################################################################
+def content_hash(*items):
+  '''sha1 hex digest of numpy arrays, (nested) tuples and anything with a stable repr'''
+  h = hashlib.sha1()
+  for item in items:
+    if isinstance(item, np.ndarray):
+      item = np.ascontiguousarray(item)
+      h.update('%s%s' % (item.dtype.str, item.shape))
+      h.update(item.data)
+    elif isinstance(item, (tuple, list)):
+      h.update(content_hash(*item))
+    else:
+      h.update(repr(item))
+  return h.hexdigest()
+
+
+class ExportCache(object):
+  '''
+    Keeps files which are expensive to generate, i.e. vessel include files
+    and df3 volumes, under the hash of their content. Renderings of the same
+    data with a different camera, lights or overlay thus reuse the exports.
+    Without a directory, a temporary one is used which is removed when the
+    process exits.
+    Like myutils.DiskCache, the least recently used entries are deleted when
+    the total size exceeds maxbytes (default: env. var. POVRAY_CACHE_SIZE_GB,
+    or 10 GB).
+  '''
+  def __init__(self, directory = None, maxbytes = None):
+    self.directory = directory
+    if maxbytes is None:
+      maxbytes = int(float(os.environ.get('POVRAY_CACHE_SIZE_GB', 10.)) * 1024**3)
+    self.maxbytes = maxbytes
+    self.nbytes = None # estimated size of the directory, see get
+
+  def dir_(self):
+    if self.directory is None:
+      self.directory = tempfile.mkdtemp(prefix='mwpov_cache')
+      atexit.register(shutil.rmtree, self.directory, True)
+    elif not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError: # created concurrently
+        pass
+    return self.directory
+
+  def get(self, key, suffix, writer):
+    '''
+      filename of the cache entry. If it does not exist writer(filename)
+      is called to create it. Entries appear atomically so concurrent
+      renderings can share the directory.
+    '''
+    fn = os.path.join(self.dir_(), key+suffix)
+    if os.path.isfile(fn):
+      try:
+        os.utime(fn, None) # mark as recently used
+      except OSError:
+        pass
+    else:
+      fd, tmpfn = tempfile.mkstemp(suffix=suffix, prefix='tmp', dir=self.directory)
+      os.close(fd)
+      try:
+        writer(tmpfn)
+        size = os.path.getsize(tmpfn)
+        os.rename(tmpfn, fn)
+      except:
+        os.unlink(tmpfn)
+        raise
+      if self.nbytes is None:
+        self.evict_(fn)
+      else:
+        self.nbytes += size
+        if self.nbytes > self.maxbytes:
+          self.evict_(fn)
+    return fn
+
+  def evict_(self, keep):
+    '''delete least recently used entries, except keep, until the total size is within maxbytes'''
+    entries = []
+    now = time.time()
+    for name in os.listdir(self.directory):
+      fn = os.path.join(self.directory, name)
+      try:
+        st = os.stat(fn)
+      except OSError: # deleted by a concurrent process
+        continue
+      if not name.startswith('tmp'):
+        entries.append((st.st_mtime, st.st_size, fn))
+      elif now - st.st_mtime > 24*3600.: # left over from killed jobs
+        entries.append((0., st.st_size, fn))
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, fn in entries:
+      if total <= self.maxbytes:
+        break
+      if fn == keep:
+        continue
+      try:
+        os.remove(fn)
+      except OSError:
+        pass
+      total -= size
+    self.nbytes = total
+
+
+export_caches_ = {}
+
+def getExportCache(directory = None):
+  '''one cache per directory. The default is env. var. POVRAY_CACHE_DIR, or a temporary directory.'''
+  if directory is None:
+    directory = os.environ.get('POVRAY_CACHE_DIR', None)
+  if directory is not None:
+    directory = os.path.abspath(directory)
+  if directory not in export_caches_:
+    export_caches_[directory] = ExportCache(directory)
+  return export_caches_[directory]
+
+
 class EasyPovRayRender(object):
   '''
     Simplifying wrapper around the povray module.
@@ -196,6 +319,7 @@ class EasyPovRayRender(object):
       self.tempfiledir = params.temp_file_dir
     else:
       self.tempfiledir = None
+    self.cache = getExportCache(params.cache_dir if 'cache_dir' in params else None)
     self.tempfiles = []
     tf = self.makeTmpFile()
     self.f = open(tf.filename, 'w')
@@ -210,13 +334,10 @@ class EasyPovRayRender(object):
     #self.pvfile.write("""sky_sphere { pigment {color rgb <1,1,1> } }""")
 
 
-  def render(self, imgfn):
-    # write
-    #tf = mkstemp.File(suffix='.pov',prefix='mwpov_main',dir='.',text=True)
-    #self.write(tf.filename)
+  def command_(self, imgfn):
+    '''closes the scene file. Returns the povray command line and the actual image filename.'''
     scenefilename = self.f.name
     self.f.close()
-    # call povray
     povray = 'povray %s'
     if 'aa' in self.params:
       aa = self.params.aa
@@ -227,12 +348,17 @@ class EasyPovRayRender(object):
       alpha = "+UA"
     else:
       alpha = ""
-    num_threads = self.params.num_threads
+    num_threads = int(self.params.num_threads)
     num_threads = ("+WT%i" % num_threads) if num_threads>1 else ""
     res = self.params.res
     res = '+W%i +H%i' % res
     imgfn = imgfn.replace('=',r'-') # povray does not like = in filenames
     cmd = povray % ('%s +FN8 %s %s -D %s +O"%s" "%s"' % (res,alpha,num_threads,aa,imgfn, scenefilename))
+    return cmd, imgfn
+
+
+  def render(self, imgfn):
+    cmd, imgfn = self.command_(imgfn)
     print cmd
     os.system(cmd)
     self.clear()
@@ -293,11 +419,21 @@ class EasyPovRayRender(object):
 #    ).write(self.pvfile)
 
 
-  def addVesselTree(self, edges, pos, rad, style_object, clip_object, clip_style_object):
-    tf = self.makeTmpFile()
-    krebsutils.export_network_for_povray(
-      edges, pos, rad, style_object, clip_style_object, clip_object, tf.filename)
-    self.pvfile.write("#include \"%s\"" % tf.filename)
+  def addVesselTree(self, edges, pos, rad, style_object, clip_object, clip_style_object, cache_key = None):
+    '''
+      cache_key must identify the output of the style objects, e.g. the colors
+      they use. If given, the export is taken from / stored in the cache.
+    '''
+    def export(filename):
+      krebsutils.export_network_for_povray(
+        edges, pos, rad, style_object, clip_style_object, clip_object, filename)
+    if cache_key is None:
+      filename = self.makeTmpFile().filename
+      export(filename)
+    else:
+      key = content_hash('vessels', edges, pos, rad, clip_object, cache_key)
+      filename = self.cache.get(key, '.inc', export)
+    self.pvfile.write("#include \"%s\"" % filename)
 
 
   def declareVolumeData(self, data, worldbox, ld = None):
@@ -319,12 +455,11 @@ class EasyPovRayRender(object):
       data = np.resize(data, (x, y, 2*z)) # replicate data into two z-layers. The two-dimensional image plane where the volume dataset is cut lies in-between.
     wb = worldbox.reshape((3,2))
     vd = VolumeData(self, data, wb)
-    # writing of the volume data takes place here
-    tf = self.makeTmpFile(suffix='.df3') # create and register a temporary file which holds the data
-    vd.filename = tf.filename # assign the filename
-    pv.writeArrayAsDensityFile(vd.filename, vd.data, vd.value_bounds)
+    # writing of the volume data takes place here, unless the same data was written before
+    key = content_hash('df3', vd.data, vd.value_bounds)
+    vd.filename = self.cache.get(key, '.df3', lambda fn: pv.writeArrayAsDensityFile(fn, vd.data, vd.value_bounds))
     # declare a function which references the data
-    vd.name = os.path.splitext(os.path.basename(vd.filename))[0].upper()
+    vd.name = 'DF3_'+key[:16].upper()
     pv.Declare(vd.name, pv.Function(
         pv.Pattern(
         'density_file df3 "%s"' % vd.filename,
@@ -404,6 +539,70 @@ class EasyPovRayRender(object):
     #open(fn, 'w').write(self.f.getvalue())
 
 
+class PovrayBatch(object):
+  '''
+    Runs several povray processes concurrently. Scenes are handed over by
+    add, which starts povray as soon as a slot is free. The scene files of
+    an EasyPovRayRender are deleted once its process has finished, then the
+    optional callback is called with the image filename. So do not use the
+    EasyPovRayRender in a with statement here.
+    max_procs defaults to env. var. POVRAY_MAX_PROCS or the number of cores
+    divided by the threads per povray process.
+  '''
+  poll_interval = 0.2
+
+  def __init__(self, max_procs = None, num_threads = 1):
+    if max_procs is None:
+      max_procs = os.environ.get('POVRAY_MAX_PROCS', None)
+    if not max_procs:
+      import multiprocessing
+      max_procs = multiprocessing.cpu_count() // max(1, int(num_threads))
+    self.max_procs = max(1, int(max_procs))
+    self.running = []
+    self.failed = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, type, value, traceback):
+    self.wait()
+
+  def poll_(self):
+    still_running = []
+    for item in self.running:
+      process, epv, imgfn, callback = item
+      if process.poll() is None:
+        still_running.append(item)
+        continue
+      epv.clear()
+      if process.returncode != 0:
+        print 'povray failed with exit code %i for %s' % (process.returncode, imgfn)
+        self.failed.append(imgfn)
+      elif callback:
+        callback(imgfn)
+    self.running = still_running
+
+  def add(self, epv, imgfn, callback = None):
+    '''returns the image filename as povray will write it'''
+    cmd, imgfn = epv.command_(imgfn)
+    while True:
+      self.poll_()
+      if len(self.running) < self.max_procs:
+        break
+      time.sleep(self.poll_interval)
+    print cmd
+    self.running.append((subprocess.Popen(cmd, shell=True), epv, imgfn, callback))
+    return imgfn
+
+  def wait(self):
+    '''waits for all processes. Returns the list of images which failed.'''
+    while self.running:
+      self.poll_()
+      if self.running:
+        time.sleep(self.poll_interval)
+    return self.failed
+
+
 ##############################################################################
 ## We want to clip away some parts of the scene i.e. in order to produce the
 ## "slice" renderings or the "pie" renderings. For this, i use objects which
@@ -538,8 +737,15 @@ def OverwriteImageWithColorbar(options,image_fn, cm, label, output_filename):
   fig.savefig(output_filename, dpi=dpi, bbox_inches=None ) # overwrite the original
 
 
-def RenderImageWithOverlay(epv, imagefn, colormap, label, options):
+def RenderImageWithOverlay(epv, imagefn, colormap, label, options, batch = None):
+  '''with a PovrayBatch the overlay is drawn when povray has finished'''
   tf = mkstemp.File(suffix='.png', prefix='mwpov_', text=False, keep=True) 
+  if batch is not None:
+    def overlay(fn):
+      OverwriteImageWithColorbar(options, fn, colormap, label, output_filename = imagefn)
+      os.remove(fn)
+    batch.add(epv, tf.filename, overlay)
+    return
   epv.render(tf.filename)
   #plotsettings = dict(myutils.iterate_items(kwargs, ['dpi','fontcolor','wbbox'], skip=True))    
   OverwriteImageWithColorbar(options,tf.filename, colormap, label, output_filename = imagefn)
@@ -36,6 +36,7 @@ import copy
 
 import povray as pv
 from krebs.povrayEasy import *
+from krebs import vesselLOD
 
 #see http://assorted-experience.blogspot.com/2007/07/custom-colormaps.html
 cm_redblue = matplotlib.colors.LinearSegmentedColormap('redblue', {
@@ -233,6 +234,13 @@ def make_any_color_arrays(vesselgraph, data_name):
 
 
 def addVesselTree(epv, vesselgraph, trafo, options):
+    lod, max_segments = getattr(options, 'lod', False), getattr(options, 'max_segments', None)
+    if lod or max_segments:
+      # detail below the size of a pixel and/or beyond the segment budget is dropped
+      pixel_size = None
+      if lod:
+        pixel_size = vesselLOD.pixelSize(options.wbbox if 'wbbox' in options else ComputeBoundingBox(None, vesselgraph), options.res)
+      vesselgraph = vesselLOD.decimate(vesselgraph, max_segments, pixel_size)
     edges = vesselgraph.edgelist
     pos = vesselgraph['position']
     rad = vesselgraph.edges['radius']
@@ -291,17 +299,18 @@ def addVesselTree(epv, vesselgraph, trafo, options):
     epv.addVesselTree(np.asarray(edges, dtype=np.int32),
                       np.asarray(pos, dtype=np.float32),
                       np.asarray(rad, dtype=np.float32),
-                      Styler, clip, ClipStyler)
+                      Styler, clip, ClipStyler,
+                      cache_key = (edgecolors, nodecolors, ClipStyler is Styler, defaultCrossSectionColor))
     #del Styler; del ClipStyler
     #print 'write time: ', time.time(
 
 
 def ComputeBoundingBox(vesselgroup, vesselgraph):
-  if 'lattice' in vesselgroup:
+  if vesselgroup is not None and 'lattice' in vesselgroup:
     vess_ldgroup = vesselgroup['lattice']
     wbbox = krebsutils.read_lattice_data_from_hdf(vess_ldgroup).worldBox
   else:
-    pos = graph['position']
+    pos = vesselgraph['position']
     minval = np.amin(pos, axis=0)
     maxval = np.amax(pos, axis=0)
     wbbox = np.vstack((minval, maxval)).transpose().ravel()  # xmin ,xmax, ymin, ymax, zmin ,zmax ...
@@ -371,8 +380,8 @@ def CreateScene2(vesselgroup, epv, graph, imagefn, options):
     num_samples_small_light = 3
     epv.addLight(10*Vec3(0.7,1.,0.9), 0.8, area=(1., 1., num_samples_small_light, num_samples_small_light), jitter=True)
     epv.addLight(10*Vec3(0.5,0.5,0.5), 0.6, area=(5., 5., num_samples_large_light, num_samples_large_light), jitter=True)
-    kwargs.update(vessel_clip = ('pie', 0.),
-                  tumor_clip = ('pie', -20*trafo.w))
+    options.vessel_clip = ('pie', 0.)
+    options.tumor_clip = ('pie', -20*trafo.w)
   addVesselTree(epv, graph, trafo = trafo, options=options )
 
 def render_different_data_types( vesselgroup, options):
@@ -398,6 +407,10 @@ def render_different_data_types( vesselgroup, options):
     print("lowpass filter activated:")
     graph = graph.get_filtered(edge_indices = graph['radius']< filterradiuslowpass)
     filenamepostfix = '_rlp'
+  # several camera modes can be given as comma separated list. All images
+  # are rendered concurrently; the vessel export is shared between cameras.
+  cams = options.cam.split(',') if isinstance(options.cam, basestring) else list(options.cam)
+  batch = PovrayBatch(options.max_procs if 'max_procs' in options else None, options.num_threads)
   for data_name in options.datalist:
     if 'colorfactory' in options:
       colors_factory = options.colorfactory
@@ -405,10 +418,14 @@ def render_different_data_types( vesselgroup, options):
     
     cm, (datamin, datamax) = make_any_color_arrays(graph, data_name)
     fn = vesselgroup.file.filename
-    imagefn = splitext(basename(fn))[0]+'_'+ myutils.sanitize_posixpath(vesselgroup.name).replace('/','-')+'_'+data_name+filenamepostfix+'.'+ options.format
-    with EasyPovRayRender(options) as epv:
-      CreateScene2(vesselgroup,epv, graph, imagefn, options)
+    for cam in cams:
+      view_options = copy.copy(options)
+      view_options.cam = cam
+      imagefn = splitext(basename(fn))[0]+'_'+ myutils.sanitize_posixpath(vesselgroup.name).replace('/','-')+'_'+data_name+filenamepostfix+(('_'+cam) if len(cams)>1 else '')+'.'+ options.format
+      epv = EasyPovRayRender(view_options)
+      CreateScene2(vesselgroup,epv, graph, imagefn, view_options)
       if options.overlay:
-        RenderImageWithOverlay(epv, imagefn, cm, labels[data_name], options)
+        RenderImageWithOverlay(epv, imagefn, cm, labels[data_name], view_options, batch)
       else:
-        epv.render(imagefn)
\ No newline at end of file
+        batch.add(epv, imagefn)
+  batch.wait()
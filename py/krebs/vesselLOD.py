@@ -0,0 +1,259 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+'''
+  Levels of detail of vessel networks for rendering.
+
+  Most capillaries of a large network are smaller than a pixel of the
+  image. A level with tolerance t (in world units, i.e. the size of a
+  pixel) is obtained by
+    - merging chains of degree 2 nodes into single segments, as long as a
+      segment deviates by less than t from the nodes it replaces and the
+      radii along the chain are similar,
+    - dropping segments which are shorter and thinner than t.
+  Arteries and veins are kept as they are. Not meant for analysis; the
+  topology of the capillary bed changes.
+
+  usage:
+    graph = vesselLOD.decimate(graph, max_segments = 100000)
+    graph = vesselLOD.decimate(graph, pixel_size = vesselLOD.pixelSize(wbbox, (1024, 1024)))
+'''
+import hashlib
+import logging
+import numpy as np
+import krebsutils
+import myutils
+
+log = logging.getLogger(__name__)
+
+
+def segment_distance_(p, a, b):
+  '''distance of the points p from the line segments a-b'''
+  ab = b - a
+  t = np.sum((p - a)*ab, axis=1) / np.maximum(np.sum(ab*ab, axis=1), 1.e-30)
+  t = np.clip(t, 0., 1.)
+  return np.linalg.norm(p - (a + t[:,None]*ab), axis=1)
+
+
+def pixelSize(wbbox, res):
+  '''world size of a pixel if the box (xmin,xmax,ymin,ymax,...) fills an image of res = (w,h) pixels'''
+  return max((wbbox[1]-wbbox[0])/float(res[0]), (wbbox[3]-wbbox[2])/float(res[1]))
+
+
+class Level(object):
+  '''
+    segments of one level. edgelist refers to node indices of the original
+    graph, rep to the original edge from which the segment takes its
+    properties. err bounds the distance of removed nodes from the segment.
+  '''
+  def __init__(self, tolerance, edgelist, rep, radius, length, err):
+    self.tolerance = tolerance
+    self.edgelist = edgelist
+    self.rep = rep
+    self.radius = radius
+    self.length = length
+    self.err = err
+
+  def select_(self, mask):
+    return Level(self.tolerance, self.edgelist[mask], self.rep[mask], self.radius[mask], self.length[mask], self.err[mask])
+
+  @property
+  def num_segments(self):
+    return len(self.edgelist)
+
+
+class VesselLOD(object):
+  '''
+    Level 0 is the original graph. Level k > 0 is made from level k-1 with
+    tolerance base_tolerance*2**(k-1). Levels are built on demand. They only
+    store which original nodes and edges make up the segments, so they can
+    be applied to any graph with the same edges, e.g. after computing colors
+    for another quantity (see apply).
+    base_tolerance defaults to the median edge length.
+  '''
+  max_levels = 24
+
+  def __init__(self, graph, base_tolerance = None, radius_tolerance = 0.2, protected_flags = krebsutils.ARTERY | krebsutils.VEIN):
+    edgelist = np.asarray(graph.edgelist, dtype = np.int32).reshape((-1,2))
+    self.position = np.asarray(graph.nodes['position'], dtype = np.float64)
+    self.flags = np.asarray(graph.edges['flags'])
+    self.num_nodes = len(self.position)
+    self.num_edges = len(edgelist)
+    self.radius_tolerance = radius_tolerance
+    self.protected = ((self.flags & protected_flags) != 0) & ((self.flags & krebsutils.CAPILLARY) == 0)
+    self.keep_node = np.zeros((self.num_nodes,), dtype = np.bool)
+    if graph.roots is not None:
+      self.keep_node[np.asarray(graph.roots, dtype = np.int64)] = True
+    if 'nodeflags' in graph.nodes:
+      self.keep_node |= (np.asarray(graph.nodes['nodeflags']) & krebsutils.BOUNDARY) != 0
+    # random but reproducible order in which chain nodes are removed
+    self.priority = np.random.RandomState(0).permutation(self.num_nodes)
+    pos = self.position
+    length = np.linalg.norm(pos[edgelist[:,1]] - pos[edgelist[:,0]], axis=1)
+    if base_tolerance is None:
+      base_tolerance = np.median(length) if len(length) else 1.
+    self.base_tolerance = base_tolerance
+    self.max_tolerance = 2.*np.linalg.norm(np.ptp(pos, axis=0)) if len(pos) else 0.
+    self.levels = [ Level(0., edgelist, np.arange(self.num_edges), np.asarray(graph.edges['radius'], dtype = np.float64), length, np.zeros_like(length)) ]
+
+  def merge_chains_(self, lv, tol):
+    pos, rep = self.position, None
+    while True:
+      rep = lv.rep
+      adj = krebsutils.GraphAdjacency(self.num_nodes, lv.edgelist)
+      v = np.nonzero((adj.degree() == 2) & ~self.keep_node)[0]
+      if not len(v):
+        break
+      o = adj.offsets[v]
+      e1, e2 = adj.incident_edges[o], adj.incident_edges[o+1]
+      a, b = adj.neighbors[o], adj.neighbors[o+1]
+      r1, r2 = lv.radius[e1], lv.radius[e2]
+      err = np.maximum(lv.err[e1], lv.err[e2]) + segment_distance_(pos[v], pos[a], pos[b])
+      ok = (e1 != e2) & (a != b)
+      ok &= ~self.protected[rep[e1]] & ~self.protected[rep[e2]]
+      ok &= self.flags[rep[e1]] == self.flags[rep[e2]]
+      ok &= np.abs(r1 - r2) <= self.radius_tolerance*np.maximum(r1, r2)
+      ok &= err <= tol
+      # remove only nodes which are not adjacent to each other in one round
+      mergeable = np.zeros((self.num_nodes,), dtype = np.bool)
+      mergeable[v[ok]] = True
+      p = self.priority
+      sel = ok & (~mergeable[a] | (p[v] < p[a])) & (~mergeable[b] | (p[v] < p[b]))
+      if not np.any(sel):
+        break
+      e1, e2, a, b, r1, r2, err = e1[sel], e2[sel], a[sel], b[sel], r1[sel], r2[sel], err[sel]
+      l1, l2 = lv.length[e1], lv.length[e2]
+      lv.edgelist[e1,0] = a
+      lv.edgelist[e1,1] = b
+      lv.radius[e1] = (r1*l1 + r2*l2) / np.maximum(l1 + l2, 1.e-30)
+      lv.length[e1] = l1 + l2
+      lv.err[e1] = err
+      keep = np.ones((lv.num_segments,), dtype = np.bool)
+      keep[e2] = False
+      lv = lv.select_(keep)
+    return lv
+
+  def drop_small_(self, lv, tol):
+    small = ~self.protected[lv.rep] & (lv.length < tol) & (2.*lv.radius < tol)
+    return lv.select_(~small)
+
+  def coarsen_(self, prev, tol):
+    lv = Level(tol, prev.edgelist.copy(), prev.rep.copy(), prev.radius.copy(), prev.length.copy(), prev.err.copy())
+    lv = self.merge_chains_(lv, tol)
+    lv = self.drop_small_(lv, tol)
+    lv = self.merge_chains_(lv, tol)
+    return lv
+
+  def can_refine_(self):
+    return len(self.levels) < self.max_levels and self.levels[-1].tolerance < self.max_tolerance
+
+  def level(self, k):
+    while len(self.levels) <= k and self.can_refine_():
+      tol = self.base_tolerance * 2.**(len(self.levels)-1)
+      self.levels.append(self.coarsen_(self.levels[-1], tol))
+    return self.levels[min(k, len(self.levels)-1)]
+
+  def level_for_tolerance(self, tol):
+    '''index of the coarsest level with tolerance <= tol'''
+    if tol < self.base_tolerance:
+      return 0
+    return min(int(np.log2(tol / self.base_tolerance)) + 1, self.max_levels - 1)
+
+  def level_for_budget(self, max_segments):
+    '''index of the finest level with at most max_segments segments, or the coarsest level'''
+    k = 0
+    while self.level(k).num_segments > max_segments:
+      if k+1 >= len(self.levels) and not self.can_refine_():
+        break
+      k += 1
+    return min(k, len(self.levels)-1)
+
+  def apply(self, graph, k):
+    '''
+      returns a krebsutils.Graph with the segments of level k. Node properties
+      and edge properties are taken from graph, except for radius and length.
+    '''
+    assert len(graph.edgelist) == self.num_edges
+    if k == 0:
+      return graph
+    lv = self.level(k)
+    used = np.unique(np.concatenate((lv.edgelist.ravel(), np.nonzero(self.keep_node)[0])))
+    g = krebsutils.Graph(np.asarray(np.searchsorted(used, lv.edgelist), dtype = np.int32))
+    for name, value in graph.nodes.items():
+      g.nodes[name] = np.asarray(value)[used,...]
+    for name, value in graph.edges.items():
+      g.edges[name] = np.asarray(value)[lv.rep,...]
+    g.edges['radius'] = np.asarray(lv.radius, dtype = np.asarray(graph.edges['radius']).dtype)
+    if 'length' in g.edges:
+      g.edges['length'] = np.asarray(lv.length, dtype = g.edges['length'].dtype)
+    if graph.roots is not None:
+      g.roots = np.searchsorted(used, graph.roots)
+    log.info('level %i (tolerance %f) has %i of %i segments', k, lv.tolerance, lv.num_segments, self.num_edges)
+    return g
+
+
+def graphHash_(graph):
+  '''sha1 of everything VesselLOD reads from graph'''
+  h = hashlib.sha1()
+  arrays = [graph.edgelist, graph.nodes['position'], graph.edges['radius'], graph.edges['flags']]
+  if graph.roots is not None:
+    arrays.append(graph.roots)
+  if 'nodeflags' in graph.nodes:
+    arrays.append(graph.nodes['nodeflags'])
+  for a in arrays:
+    a = np.ascontiguousarray(a)
+    h.update(str((a.dtype.str, a.shape)))
+    h.update(a.data)
+  return h.hexdigest()
+
+
+def makeVesselLOD_(key, graph, kwargs):
+  return VesselLOD(graph, **kwargs)
+
+lod_cache_ = myutils.LRU_Cache(makeVesselLOD_, maxsize = 4, key = lambda arg: arg[0])
+
+def getVesselLOD(graph, vesselgroup = None, **kwargs):
+  '''
+    VesselLOD for graph, cached by the contents of graph (and vesselgroup,
+    if given), so repeated renderings of the same network reuse the levels
+    built so far. Only the few most recently used networks are kept.
+    kwargs go to VesselLOD.
+  '''
+  key = (graphHash_(graph), tuple(sorted(kwargs.items())))
+  if vesselgroup is not None:
+    key = (vesselgroup.file.filename, vesselgroup.name) + key
+  return lod_cache_(key, graph, kwargs)
+
+
+def decimate(graph, max_segments = None, pixel_size = None, vesselgroup = None):
+  '''
+    returns graph with detail below pixel_size removed, coarsened further
+    until at most max_segments segments remain. Both are optional.
+  '''
+  if not max_segments and not pixel_size:
+    return graph
+  lod = getVesselLOD(graph, vesselgroup)
+  k = 0
+  if pixel_size:
+    k = lod.level_for_tolerance(pixel_size)
+  if max_segments:
+    k = max(k, lod.level_for_budget(max_segments))
+  return lod.apply(graph, k)
@@ -33,6 +33,10 @@ if identifycluster.getname()=='snowden':
   import pyvtk as vtk
 else:
   import vtk
+try:
+  from vtk.util import numpy_support
+except ImportError:
+  numpy_support = None
 
 
 def vtkArrayFactory(dtype):
@@ -61,13 +65,23 @@ def vtkArrayFactory(dtype):
 
 
 def asVtkArray(data, name = None, vtk_array_type = None):
-  """convert numpy array to vtk array"""
+  """convert numpy array to vtk array.
+     Numeric arrays are handed to vtk without copying if their
+     element type matches the vtk array type."""
+  data = np.asarray(data)
   if vtk_array_type == None:
     vtk_array_type = vtkArrayFactory(data.dtype)
   if len(data.shape) < 2:
     data = np.reshape(data, data.shape+(1,))
   n, nc = data.shape
   a = vtk_array_type()
+  if numpy_support is not None and isinstance(a, vtk.vtkDataArray):
+    data = np.ascontiguousarray(data, dtype = numpy_support.get_vtk_to_numpy_typemap()[a.GetDataType()])
+    a = numpy_support.numpy_to_vtk(data, deep = 0, array_type = a.GetDataType())
+    if not hasattr(a, '_numpy_reference'): # old vtk versions don't keep the numpy array alive
+      a = numpy_support.numpy_to_vtk(data, deep = 1, array_type = a.GetDataType())
+    a.SetName(name)
+    return a
   a.SetName(name)
   a.SetNumberOfComponents(nc)
   a.SetNumberOfTuples(n)
@@ -91,6 +105,8 @@ def fromVtkArray(a):
     'unsigned char' : np.uint8,
     'unsigned int' : np.uint32,
   }
+  if numpy_support is not None:
+    return np.array(numpy_support.vtk_to_numpy(a))
   s = a.GetDataTypeAsString()
   dtype = typedict[s]
   nc = a.GetNumberOfComponents()
@@ -111,6 +127,13 @@ def fromVtkArray(a):
   return r
 
 
+def asVtkPoints(data):
+  """convert (n,3) numpy array to vtkPoints"""
+  pts = vtk.vtkPoints()
+  pts.SetData(asVtkArray(np.asarray(data).reshape((-1,3)), None, vtk.vtkFloatArray))
+  return pts
+
+
 def fromVtkPoints(pts):
   a = pts.GetData()
   a = fromVtkArray(a)
@@ -154,6 +177,13 @@ def asVtkCellArray(data):
   data = np.atleast_2d(data)
   n, nc = data.shape
   cells = vtk.vtkCellArray()
+  if numpy_support is not None:
+    # legacy layout: number of points followed by the point ids, for each cell
+    conn = np.empty((n, nc+1), dtype = numpy_support.get_vtk_to_numpy_typemap()[vtk.VTK_ID_TYPE])
+    conn[:,0] = nc
+    conn[:,1:] = data
+    cells.SetCells(n, numpy_support.numpy_to_vtkIdTypeArray(conn.ravel(), deep = 1))
+    return cells
   for q in data:
     cells.InsertNextCell(nc)
     for r in q:
@@ -30,6 +30,7 @@ import myutils
 import h5py
 import h5files
 import itertools
+import collections
 import copy
 
 from krebs import detailedo2
@@ -50,6 +51,19 @@ def worker_on_client(fn, pattern, o2params):
   h5files.closeall() # just to be sure
 
 
+def worker_batch_on_client(fn, pattern, o2params_list):
+  '''several parameter sets in one process, see detailedo2.computePO2Sweep'''
+  print 'detailedo2 batch of %s on %s / %s' % (','.join(p['name'] for p in o2params_list), fn, pattern)
+  h5files.search_paths = [dirname(fn)]
+  num_threads = max(p.pop('num_threads') for p in o2params_list)
+  krebsutils.set_num_threads(num_threads)
+  o2_refs = detailedo2.computePO2Sweep(fn, pattern, [ (p, p['name']) for p in o2params_list ])
+  for _, _, ref in o2_refs:
+    po2group = h5files.open(ref.fn)[ref.path]
+    detailedo2Analysis.WriteSamplesToDisk(po2group)
+  h5files.closeall() # just to be sure
+
+
 def worker_plots_for_paper(filenames, pattern):
   from krebs.detailedo2Analysis import plotsForPaper
   import h5files
@@ -82,9 +96,35 @@ def prepareParametersWithNumThreads(o2params, numThreadsOverride):
   return o2params, num_threads
 
 
+def run_batch(parameter_set_names, filenames, grp_pattern, systemsize):
+  '''one job per file which computes all the parameter sets, sharing the network, flow and tissue setup'''
+  print 'submitting batch ...', ','.join(parameter_set_names)
+  o2params_list, num_threads = [], 1
+  for name in parameter_set_names:
+    o2params = getattr(parameterSetsO2, name)
+    if callable(o2params):
+      raise AssertionError('parameter set %s depends on the file, cannot be used in a batch' % name)
+    o2params = copy.deepcopy(o2params)
+    o2params['name'] = name
+    o2params, n = prepareParametersWithNumThreads(o2params, systemsize)
+    num_threads = max(num_threads, n)
+    o2params_list.append(o2params)
+  jobs = [ qsub.func(worker_batch_on_client, fn, grp_pattern, o2params_list) for fn in filenames ]
+  qsub.submit(jobs,
+                name = 'job_o2_batch_'+parameter_set_names[0],
+                num_cpus = num_threads,
+                days = 5,
+                mem = '%iMB' % (2000*num_threads),
+                change_cwd = True)
+
+
 def run(parameter_set_name, filenames, grp_pattern, systemsize):
+  if ',' in parameter_set_name:
+    return run_batch(parameter_set_name.split(','), filenames, grp_pattern, systemsize)
   print 'submitting ...', parameter_set_name
-  print dicttoinfo.dicttoinfo(getattr(parameterSetsO2, parameter_set_name))
+  o2params = getattr(parameterSetsO2, parameter_set_name)
+  if not callable(o2params):
+    print dicttoinfo.dicttoinfo(o2params)
   print 'for files', filenames
 
   dirs = set()
@@ -95,17 +135,26 @@ def run(parameter_set_name, filenames, grp_pattern, systemsize):
       dirs =set.union(dirs, d)
   print 'and resolved groups therein: %s' % ','.join(dirs)
 
-  o2params = getattr(parameterSetsO2, parameter_set_name)
-  o2params['name'] = parameter_set_name
-  if callable(o2params):
+  if callable(o2params): # a list of parameters, one per file
     o2paramsList = o2params(len(filenames))
   else:
+    o2params['name'] = parameter_set_name
     o2paramsList = itertools.repeat(o2params)
 
+  # files which need the same resources are submitted together as one array job
+  groups = collections.OrderedDict()
   for (o2params, fn) in zip(o2paramsList, filenames):
     o2params, num_threads = prepareParametersWithNumThreads(copy.deepcopy(o2params), systemsize)
-    qsub.submit(qsub.func(worker_on_client, fn, grp_pattern, o2params),
-                  name = 'job_o2_'+parameter_set_name+'_'+basename(fn),
+    groups.setdefault(num_threads, []).append((fn, qsub.func(worker_on_client, fn, grp_pattern, o2params)))
+  for num_threads, group in groups.iteritems():
+    if len(group) == 1:
+      (fn, job), = group
+      name = 'job_o2_'+parameter_set_name+'_'+basename(fn)
+    else:
+      job = [ job for _, job in group ]
+      name = 'job_o2_'+parameter_set_name+('_%ithreads' % num_threads if len(groups) > 1 else '')
+    qsub.submit(job,
+                  name = name,
                   num_cpus = num_threads,
                   days = 5,  # about one day per thread, the idea being that number of threads is proportional to systems size and runtime is 
                   mem = '%iMB' % (2000*num_threads),
@@ -115,7 +164,7 @@ def run(parameter_set_name, filenames, grp_pattern, systemsize):
 if not qsub.is_client and __name__=='__main__':
   import argparse
   parser = argparse.ArgumentParser(description='Compute po2 distributions and analyze them. In normal mode it takes arguments: parameter set name, filenames, h5 group pattern. In analysis mode -a, it takes arguments: filenames, h5 group pattern.')  
-  parser.add_argument('o2params', help = 'choose the parameter for the simulation. found at /py/krebsjobs/parameters/parameterSetsO2.py')  
+  parser.add_argument('o2params', help = 'choose the parameter for the simulation. found at /py/krebsjobs/parameters/parameterSetsO2.py. Several comma separated names are computed in one batch per file.')  
   parser.add_argument('vesselFileNames', nargs='*', type=argparse.FileType('r'), default=sys.stdin, help='Vessel file to calculate')   
   parser.add_argument('grp_pattern',help='Where to find the vessel group in the file')  
   parser.add_argument('-a', '--analyze', help = 'loop through all files analyze data and make plot', default=False, action='store_true')
@@ -161,8 +210,9 @@ if not qsub.is_client and __name__=='__main__':
   if not goodArguments.analyze and not goodArguments.render:
     try:
       systemsize = goodArguments.systemsize
-      if not goodArguments.o2params in dir(parameterSetsO2):
-        raise AssertionError('Unknown parameter set %s!' % goodArguments.o2params)
+      for name in goodArguments.o2params.split(','):
+        if not name in dir(parameterSetsO2):
+          raise AssertionError('Unknown parameter set %s!' % name)
       for fn in filenames:
           if not os.path.isfile(fn):
               raise AssertionError('The file %s is not present!'%fn)
@@ -144,12 +144,16 @@ if __name__ == '__main__':
   #parser.add_argument("--only_overlay", default = False, action="store_true")  
   parser.add_argument("--dpi", help='dpi for the rendering', default=300.)
   parser.add_argument("--format", help='output format of image', default='png', action="store")
-  parser.add_argument("-c","--cam", help="camera mode: topdown, pie, topdown_slice", default='topdown_slice', action="store", type=str)
+  parser.add_argument("-c","--cam", help="camera mode: topdown, pie, topdown_slice, or a comma separated list of them", default='topdown_slice', action="store", type=str)
   parser.add_argument("-u","--plot_auc", help="for area under curve, we have only a single timepoint", default=False, action="store_true")
   parser.add_argument("-a","--auto_colorscale", help=" ", default=False, action="store_true")  
   parser.add_argument("--fontcolor", help='fontcolor in overlay, use mpl style colors', default='black')  
   parser.add_argument("--temp_file_dir", help='dir for temp povray scene', default=None)
   parser.add_argument("--keep_files", help='keep tmp file?', default=False, action="store_true")
+  parser.add_argument("--cache_dir", help='dir for vessel and volume exports shared between renderings, default is env. var. POVRAY_CACHE_DIR or a temporary dir', default=None)
+  parser.add_argument("--lod", help='leave out vessel detail smaller than a pixel (except arteries and veins)', default=False, action="store_true")
+  parser.add_argument("--max_segments", help='render at most about this many vessel segments, coarsening capillaries as needed', default=None, type=int)
+  parser.add_argument("--max_procs", help='number of povray processes running at once within a job', default=1, type=int)
   parser.add_argument("--assumed_gamma", help=" ", default=1.0)
   parser.add_argument("--background", help=" ", default=1.0)
   parser.add_argument("--ambient_color", help=" ", default=(0.1, 0, 0))
@@ -217,6 +221,6 @@ if __name__ == '__main__':
     qsub.submit(
       qsub.func(clientfunc, job, os.getcwd()),
       name='job_render_'+basename(job.imageFilename),
-      num_cpus=job.params.threads,
+      num_cpus=job.params.threads*job.params.max_procs,
       mem=('%iMB' % m),
       days=t/24.)
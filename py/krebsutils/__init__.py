@@ -73,7 +73,8 @@ locals().update( (f,getattr(libkrebs, f)) for f in imports_)
     #DetailedO2Parameters, \
     #AllocateDetailedO2ParametersFromDict, \
 
-imports_ = [ f.strip() for f in 'testCalcOxy, testCalcOxy2, testCalcOxy3, testCalcOxy4, testCalcOxy5'.split(',') ]
+# optional, not present in every build of libkrebs_
+imports_ = [ f.strip() for f in 'testCalcOxy, testCalcOxy2, testCalcOxy3, testCalcOxy4, testCalcOxy5, FlowSystem'.split(',') ]
 imports_ = [ f for f in imports_ if hasattr(libkrebs, f) ]
 locals().update( (f,getattr(libkrebs, f)) for f in imports_)
 
@@ -266,7 +267,7 @@ def filter_graph_byedge2( edges, edge_data, node_data, indices, return_indices=F
     return ret
 
 
-def read_graph_(grp, *prop_names):
+def read_graph_(grp, *prop_names, **kwargs):
     """
     read graph structure:
         edges\
@@ -278,19 +279,31 @@ def read_graph_(grp, *prop_names):
             node properties: array
             ...
     return a tuple with first the edge->node indices as nx2 int array, then properties in the order of input names
+    kwargs:
+      lazy -> if True, properties are read when they are accessed first (see LazyColumn)
+      mmap -> if True, lazy properties are memory mapped where the hdf layout permits
     """
+    lazy = kwargs.pop('lazy', False)
+    mmap = kwargs.pop('mmap', False)
+    assert not kwargs, 'unknown arguments %s' % kwargs.keys()
     ge = grp['edges']
     gn = grp['nodes']
     node_a = asarray(ge['node_a_index'], dtype=np.int32)
     node_b = asarray(ge['node_b_index'], dtype=np.int32)
     nodes = np.column_stack((node_a,node_b))
-    g = Graph(edgelist = nodes)
+    g = Graph(edgelist = nodes, lazy = lazy)
     not_found = set()
     for prop_name in prop_names:
         if prop_name in gn:
-            g.nodes[prop_name] = asarray(gn[prop_name])
+            if lazy:
+                g.nodes.set_lazy(prop_name, LazyColumn.from_dataset(gn[prop_name], mmap))
+            else:
+                g.nodes[prop_name] = asarray(gn[prop_name])
         elif prop_name in ge:
-            g.edges[prop_name] = asarray(ge[prop_name])
+            if lazy:
+                g.edges.set_lazy(prop_name, LazyColumn.from_dataset(ge[prop_name], mmap))
+            else:
+                g.edges[prop_name] = asarray(ge[prop_name])
         else:
             not_found.add(prop_name)
     return g, not_found
@@ -313,13 +326,202 @@ def read_graph_(grp, *prop_names):
 #    return filter_graph_byedge2(edges, edge_data, node_data, indices, return_indices)
 
 
+class LazyColumn(object):
+  """
+    placeholder for a graph property which is not loaded yet.
+    loader is called without arguments to obtain the array.
+  """
+  def __init__(self, loader):
+    self.loader = loader
+
+  def load(self):
+    return self.loader()
+
+  @staticmethod
+  def from_dataset(ds, mmap = False):
+    """
+      read the h5py dataset ds on demand. With mmap = True, contiguous
+      uncompressed datasets are memory mapped (copy on write) instead of read.
+    """
+    if mmap and ds.chunks is None and ds.compression is None and ds.size > 0:
+      offset = ds.id.get_offset()
+      if offset is not None:
+        filename, dtype, shape = ds.file.filename, ds.dtype, ds.shape
+        return LazyColumn(lambda : np.memmap(filename, mode = 'c', dtype = dtype, shape = shape, offset = offset))
+    return LazyColumn(lambda : asarray(ds))
+
+  @staticmethod
+  def take(source, name, indices):
+    """load by selecting items from source[name], where source may be another LazyPropertyDict"""
+    return LazyColumn(lambda : source[name][indices,...])
+
+
+class LazyPropertyDict(dict):
+  """
+    dict of graph properties where items can be LazyColumns. These are loaded
+    by the first access and then kept (pinned). release() drops loaded arrays
+    again so that they are reloaded from their source when needed.
+  """
+  def __init__(self, *args, **kwargs):
+    dict.__init__(self, *args, **kwargs)
+    self.columns_ = {}
+
+  def set_lazy(self, name, column):
+    self.columns_[name] = column
+    dict.__setitem__(self, name, column)
+
+  def __getitem__(self, name):
+    value = dict.__getitem__(self, name)
+    if isinstance(value, LazyColumn):
+      value = value.load()
+      dict.__setitem__(self, name, value)
+    return value
+
+  def __setitem__(self, name, value):
+    self.columns_.pop(name, None) # explicitly assigned data cannot be released
+    dict.__setitem__(self, name, value)
+
+  def __delitem__(self, name):
+    self.columns_.pop(name, None)
+    dict.__delitem__(self, name)
+
+  def get(self, name, default = None):
+    return self[name] if name in self else default
+
+  def itervalues(self):
+    for k in self.iterkeys():
+      yield self[k]
+
+  def iteritems(self):
+    for k in self.iterkeys():
+      yield k, self[k]
+
+  def values(self):
+    return list(self.itervalues())
+
+  def items(self):
+    return list(self.iteritems())
+
+  def is_loaded(self, name):
+    return not isinstance(dict.__getitem__(self, name), LazyColumn)
+
+  def release(self, *names):
+    """forget loaded data of the given lazy properties, or all if no names are given"""
+    for name in (names or self.columns_.keys()):
+      if name in self.columns_:
+        dict.__setitem__(self, name, self.columns_[name])
+
+  def __reduce__(self):
+    # the loaders are closures over hdf objects
+    raise TypeError('%s cannot be pickled' % self.__class__.__name__)
+
+
+class GraphAdjacency(object):
+  """
+    compressed row representation of the undirected graph given by an edgelist.
+    Python equivalent of CompressedRows in mwlib/compressed_row_undirected_graph.h.
+    The incident edges of node i are incident_edges[offsets[i]:offsets[i+1]] and
+    the nodes at the other ends are neighbors[offsets[i]:offsets[i+1]].
+  """
+  def __init__(self, num_nodes, edgelist):
+    edgelist = np.asarray(edgelist, dtype = np.int32).reshape((-1,2))
+    num_edges = len(edgelist)
+    self.num_nodes = num_nodes
+    self.num_edges = num_edges
+    ends = edgelist.ravel()
+    order = np.argsort(ends, kind = 'mergesort')
+    counts = np.bincount(ends, minlength = num_nodes)
+    self.offsets = np.zeros((num_nodes+1,), dtype = np.int64)
+    np.cumsum(counts, out = self.offsets[1:])
+    self.incident_edges = np.asarray(order // 2, dtype = np.int32)
+    self.neighbors = edgelist[:,::-1].ravel()[order]
+
+  def degree(self):
+    return np.diff(self.offsets)
+
+  def edges_of(self, node):
+    return self.incident_edges[self.offsets[node]:self.offsets[node+1]]
+
+  def neighbors_of(self, node):
+    return self.neighbors[self.offsets[node]:self.offsets[node+1]]
+
+  def gather_(self, nodes):
+    """indices into incident_edges/neighbors of all the entries of the given nodes"""
+    starts = self.offsets[nodes]
+    counts = self.offsets[np.asarray(nodes)+1] - starts
+    total = np.sum(counts)
+    if total == 0:
+      return np.zeros((0,), dtype = np.int64)
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(total)
+
+  def as_sparse_matrix(self, weights = None):
+    """node-node adjacency as scipy.sparse.csr_matrix, entries are 1 or weights[edge]"""
+    import scipy.sparse
+    data = np.ones(len(self.neighbors)) if weights is None else np.asarray(weights)[self.incident_edges]
+    return scipy.sparse.csr_matrix((data, self.neighbors, self.offsets), shape = (self.num_nodes, self.num_nodes))
+
+  def connected_components(self):
+    """returns (number of components, component label of each node)"""
+    import scipy.sparse.csgraph
+    return scipy.sparse.csgraph.connected_components(self.as_sparse_matrix(), directed = False)
+
+  def bfs_distance(self, sources):
+    """number of edges on the shortest path from any of the source nodes, -1 for unreachable nodes"""
+    dist = -np.ones((self.num_nodes,), dtype = np.int32)
+    frontier = np.unique(np.atleast_1d(np.asarray(sources, dtype = np.int64)))
+    dist[frontier] = 0
+    level = 0
+    while len(frontier):
+      level += 1
+      nb = self.neighbors[self.gather_(frontier)]
+      nb = np.unique(nb[dist[nb] < 0])
+      dist[nb] = level
+      frontier = nb
+    return dist
+
+  def edge_to_node_property(self, prop, combinefunc):
+    """
+      vectorized counterpart of krebsutils.edge_to_node_property.
+      combinefunc is one of 'max', 'min', 'and', 'or', 'avg', 'sum'.
+      Nodes without edges get 0.
+    """
+    prop = np.asarray(prop)
+    ufunc = {
+      'max' : np.maximum,
+      'min' : np.minimum,
+      'and' : np.logical_and if prop.dtype == np.bool else np.bitwise_and,
+      'or'  : np.logical_or if prop.dtype == np.bool else np.bitwise_or,
+      'avg' : np.add,
+      'sum' : np.add,
+    }[combinefunc]
+    deg = self.degree()
+    res = np.zeros((self.num_nodes,)+prop.shape[1:], dtype = np.float64 if combinefunc == 'avg' else prop.dtype)
+    nz = np.nonzero(deg)[0]
+    if len(nz):
+      values = prop[self.incident_edges,...]
+      res[nz] = ufunc.reduceat(values, self.offsets[nz], axis = 0)
+    if combinefunc == 'avg':
+      res[nz] /= deg[nz].reshape((-1,)+(1,)*(prop.ndim-1))
+      res = np.asarray(res, dtype = prop.dtype if prop.dtype.kind == 'f' else np.float64)
+    return res
+
+
 class Graph(object):
-  def __init__(self, edgelist = []):
-    self.nodes = {}
-    self.edges = {}
+  """
+    Vessel graph with edgelist and property dicts nodes and edges.
+    If lazy is True, nodes and edges are LazyPropertyDicts, so properties
+    can be loaded on first access (see read_graph_) and released again.
+    The adjacency structure (GraphAdjacency) is built on demand and cached.
+  """
+  def __init__(self, edgelist = [], lazy = False):
+    self.lazy = lazy
+    self.nodes = LazyPropertyDict() if lazy else {}
+    self.edges = LazyPropertyDict() if lazy else {}
     self.edgelist = edgelist
     self.roots = None
     self.from_fn = None
+    self.adjacency_ = None
   def __getitem__(self, name):
     if name == 'edgelist':
       item = self.edgelist
@@ -339,7 +541,65 @@ class Graph(object):
     return self.nodes.values()+self.edges.values()
   def items(self):
     return self.nodes.items()+self.edges.items()
-  def get_filtered(self, edge_indices=None):
+  @property
+  def num_nodes(self):
+    """from the length of node data if available, else from the edgelist"""
+    for v in dict.itervalues(self.nodes): # without loading lazy properties
+      if isinstance(v, np.ndarray):
+        return len(v)
+    return int(np.amax(self.edgelist))+1 if len(self.edgelist) else 0
+
+  @property
+  def adjacency(self):
+    a = self.adjacency_
+    if a is None or a[0] is not self.edgelist: # rebuild if the edgelist was replaced
+      self.adjacency_ = a = (self.edgelist, GraphAdjacency(self.num_nodes, self.edgelist))
+    return a[1]
+
+  def degree(self):
+    return self.adjacency.degree()
+
+  def neighbors(self, node):
+    return self.adjacency.neighbors_of(node)
+
+  def incident_edges(self, node):
+    return self.adjacency.edges_of(node)
+
+  def connected_components(self):
+    return self.adjacency.connected_components()
+
+  def bfs_distance(self, sources):
+    return self.adjacency.bfs_distance(sources)
+
+  def edge_to_node_property(self, prop, combinefunc):
+    """prop is an array or the name of an edge property"""
+    if isinstance(prop, str):
+      prop = self.edges[prop]
+    return self.adjacency.edge_to_node_property(prop, combinefunc)
+
+  def release(self, *names):
+    """forget loaded lazy properties, see LazyPropertyDict.release"""
+    for d in (self.nodes, self.edges):
+      if not isinstance(d, LazyPropertyDict):
+        continue
+      if not names:
+        d.release()
+      else:
+        d.release(*[n for n in names if n in d])
+
+  def filtered_roots_(self, toNewNode):
+    """roots which are still in the graph after filtering, in new node indices"""
+    if self.roots is None:
+      return None
+    roots = np.take(toNewNode, self.roots)
+    return roots[roots >= 0]
+
+  def get_filtered(self, edge_indices=None, lazy=None):
+    """
+      return the sub graph of the given edges. If lazy (default: self.lazy),
+      the properties of the returned graph are only selected from this graph
+      when they are accessed.
+    """
     #assert not self.roots, 'implement filtering of roots'
     if self.roots is not None:
       print 'WARNING: test Graph.get_filtered for tree roots (untested)!'
@@ -351,12 +611,22 @@ class Graph(object):
       if tmp.dtype == np.bool and tmp.shape[0] == self.edgelist.shape[0]:
         edge_indices = np.nonzero(tmp)[0]
     el = self.edgelist
+    if lazy is None:
+      lazy = self.lazy
+    if lazy:
+      new_el, _, _, edge_indices, toOldNode, toNewNode = filter_graph_byedge2(el, (), (), edge_indices, True)
+      g = Graph(edgelist = new_el, lazy = True)
+      g.roots = self.filtered_roots_(toNewNode)
+      for name in self.nodes.keys():
+        g.nodes.set_lazy(name, LazyColumn.take(self.nodes, name, toOldNode))
+      for name in self.edges.keys():
+        g.edges.set_lazy(name, LazyColumn.take(self.edges, name, edge_indices))
+      return g
     nnames, nprop = zip(*self.nodes.items()) if self.nodes else ([], [])
     enames, eprop = zip(*self.edges.items()) if self.edges else ([], [])
     new_el, new_eprop, new_nprop, _, toOldNode, toNewNode = filter_graph_byedge2(el, eprop, nprop, edge_indices, True)
-    if self.roots is not None:
-      self.roots = np.take(toNewNode, self.roots)
     g = Graph(edgelist = new_el)
+    g.roots = self.filtered_roots_(toNewNode)
     g.nodes = dict(zip(nnames,new_nprop))
     g.edges = dict(zip(enames,new_eprop))
     return g
@@ -469,16 +739,17 @@ def vessels_require_(vesselgroup, g, name):
 
 
 
-def read_vessels_from_hdf(f, prop_names, return_graph=False, return_not_found=False, compute_not_found=True):
+def read_vessels_from_hdf(f, prop_names, return_graph=False, return_not_found=False, compute_not_found=True, lazy=False, mmap=False):
   """
     This is the main routine to load a vessel graph and associate data
     prop_names  -    is a list of data names
     f           -   is a hdf5 group where the vessel data is found
+    lazy, mmap  -   see read_graph_. Computed properties are always evaluated right away.
     return : a Graph object
   """
   assert isinstance(f, (h5py.File, h5py.Group)), "read_vessels_from_hdf needs a h5py.File or h5py.Group instance"
   vesselgroup = f#f[posixpath.join(grpname,'vessels')]
-  g, not_found = read_graph_(vesselgroup, *prop_names)
+  g, not_found = read_graph_(vesselgroup, *prop_names, lazy = lazy, mmap = mmap)
 
   roots = np.asarray(vesselgroup['nodes/roots'])
   g.roots = roots  
@@ -542,6 +813,108 @@ def calc_vessel_conductivities(rad, length, hema, bloodflowparams = dict()):
   return CalcConductivities(rad, length, visc)
 
 
+def read_flow_boundary_conditions(vesselgroup):
+  """
+    returns (bc_node_index, bc_type, bc_value, bc_conductivity_value) like
+    calcflow sees them: the boundary conditions stored in the nodes group,
+    and pressure boundary conditions at the remaining roots.
+  """
+  gnodes = vesselgroup['nodes']
+  names = ['bc_node_index', 'bc_type', 'bc_value', 'bc_conductivity_value']
+  roots = np.asarray(gnodes['roots'], dtype = np.int32)
+  if all(name in gnodes for name in names):
+    bcs = [ np.asarray(gnodes[name]) for name in names ]
+    roots = np.setdiff1d(roots, bcs[0])
+  else:
+    bcs = [ np.zeros((0,)) for name in names ]
+  if len(roots):
+    pressure = np.asarray(gnodes['pressure'])[roots]
+    bcs = [ np.concatenate((a, b)) for a, b in zip(bcs, (roots, np.full(len(roots), FLOWBC_PIN), pressure, np.zeros(len(roots)))) ]
+  return (np.asarray(bcs[0], dtype = np.int32), np.asarray(bcs[1], dtype = np.int32),
+          np.asarray(bcs[2], dtype = np.float64), np.asarray(bcs[3], dtype = np.float64))
+
+
+class FlowNetwork(object):
+  """
+    Blood flow in a vessel graph held in memory, for repeated computations
+    with changed radii or hematocrit without going through hdf files.
+    Like calcflow only circulated vessels are included, but without phase
+    separation; the hematocrit is used as given. The linear system
+    (FlowSystem) is set up once and each solve starts from the last pressure.
+
+    graph needs edges 'flags', 'radius' and either edges 'length' or nodes
+    'position'. The hematocrit is bloodflowparams['inletHematocrit'] if
+    given, else edges 'hematocrit'. bcs is (bc_node_index, bc_type,
+    bc_value, bc_conductivity_value), see read_flow_boundary_conditions.
+
+    usage:
+      net = FlowNetwork(graph, read_flow_boundary_conditions(vesselgroup), bloodflowparams)
+      pressure, flow, shearforce = net.solve(radius = graph['radius']*1.1)
+  """
+  def __init__(self, graph, bcs, bloodflowparams = dict()):
+    self.bloodflowparams = dict(bloodflowparams)
+    edgelist = np.asarray(graph.edgelist, dtype = np.int32).reshape((-1,2))
+    self.num_nodes = graph.num_nodes
+    self.num_edges = len(edgelist)
+    if 'length' in graph.edges:
+      length = np.asarray(graph.edges['length'], dtype = np.float64)
+    else:
+      pos = np.asarray(graph.nodes['position'], dtype = np.float64)
+      length = np.linalg.norm(pos[edgelist[:,1]] - pos[edgelist[:,0]], axis=1)
+    # like GetFlowNetwork: circulated vessels of nonzero length, the nodes of them renumbered
+    flags = np.asarray(graph.edges['flags'])
+    self.used_edges = np.nonzero(((flags & CIRCULATED) != 0) & (length > 0.))[0]
+    errormsg_(hasattr(libkrebs, 'FlowSystem'), "FlowNetwork: libkrebs_ is too old, it has no FlowSystem")
+    errormsg_(len(self.used_edges) > 0, "FlowNetwork: no circulated vessels")
+    self.used_nodes, local_edges = np.unique(edgelist[self.used_edges], return_inverse = True)
+    self.local_edges = np.asarray(local_edges, dtype = np.int32).reshape((-1,2))
+    self.length = length[self.used_edges]
+    # boundary conditions of nodes which are not in the network are dropped
+    bc_node_index = np.asarray(bcs[0], dtype = np.int64)
+    local = np.minimum(np.searchsorted(self.used_nodes, bc_node_index), len(self.used_nodes)-1)
+    ok = self.used_nodes[local] == bc_node_index
+    self.bcs = (np.asarray(local[ok], dtype = np.int32), np.asarray(bcs[1], dtype = np.int32)[ok],
+                np.asarray(bcs[2], dtype = np.float64)[ok], np.asarray(bcs[3], dtype = np.float64)[ok])
+    errormsg_(len(self.bcs[0]) > 0, "FlowNetwork: no boundary conditions in the network")
+    self.radius = np.array(graph.edges['radius'], dtype = np.float64)
+    if 'inletHematocrit' in self.bloodflowparams:
+      self.hematocrit = np.full(self.num_edges, self.bloodflowparams['inletHematocrit'], dtype = np.float64)
+    else:
+      self.hematocrit = np.array(graph.edges['hematocrit'], dtype = np.float64)
+    # nodes outside the network keep their pressure
+    if 'pressure' in graph.nodes:
+      self.pressure = np.array(graph.nodes['pressure'], dtype = np.float64)
+    else:
+      self.pressure = np.zeros(self.num_nodes, dtype = np.float64)
+    self.flowsystem = FlowSystem(len(self.used_nodes), self.local_edges, self.bloodflowparams)
+
+  def solve(self, radius = None, hematocrit = None):
+    """
+      computes the flow with the given radius and hematocrit (arrays over
+      all edges of the graph; None keeps the last ones). Returns (pressure,
+      flow, shearforce) for all nodes and edges of the graph. Vessels which
+      are not part of the network have zero flow and shearforce.
+    """
+    if radius is not None:
+      errormsg_(len(radius) == self.num_edges, "FlowNetwork: radius must have one value per edge")
+      self.radius = np.array(radius, dtype = np.float64)
+    if hematocrit is not None:
+      errormsg_(len(hematocrit) == self.num_edges, "FlowNetwork: hematocrit must have one value per edge")
+      self.hematocrit = np.array(hematocrit, dtype = np.float64)
+    e = self.used_edges
+    rad = self.radius[e]
+    cond = calc_vessel_conductivities(rad, self.length, self.hematocrit[e], self.bloodflowparams)
+    press = self.flowsystem.solve(cond, *self.bcs)
+    a, b = self.local_edges[:,0], self.local_edges[:,1]
+    q = cond * np.abs(press[a] - press[b])
+    self.pressure[self.used_nodes] = press
+    flow = np.zeros(self.num_edges, dtype = np.float64)
+    shearforce = np.zeros(self.num_edges, dtype = np.float64)
+    flow[e] = q
+    shearforce[e] = 0.5 * rad / (cond * self.length) * q # CalcShearFromFlowAndCond
+    return self.pressure.copy(), flow, shearforce
+
+
 
 def read_vessel_positions_from_hdf(vesselgroup):
   """
@@ -622,6 +995,99 @@ def sample_edges(pos, edges, data, sample_len, mode_flags):
   return res
 
 
+def sample_edges_plan(pos, edges, sample_len):
+  """
+    sample locations on all edges, the same as those of sample_edges.
+    Returns (edge index, axial coordinate in [0,1], weight) per sample.
+  """
+  pos = np.asarray(pos, dtype=np.float32)
+  edges = np.asarray(edges, dtype=np.int32)
+  errormsg_(pos.shape[1] == 3, "pos array shape[1] must be 3")
+  errormsg_(edges.shape[1] == 2, "edges array shape[1] must be 2")
+  return libkrebs.sample_edges_plan(pos, edges, sample_len)
+
+
+def interpolate_edge_samples(plan, edges, data, mode_flags):
+  """
+    data at the samples of plan (from sample_edges_plan). mode_flags has
+    the same meaning as for sample_edges, which gives the same result.
+  """
+  smpl_edge, f, _ = plan
+  data = np.asarray(data)
+  if mode_flags & VesselSamplingFlags.DATA_PER_NODE:
+    edges = np.asarray(edges)
+    a, b = data[edges[smpl_edge,0],...], data[edges[smpl_edge,1],...]
+  elif mode_flags & VesselSamplingFlags.DATA_LINEAR:
+    a, b = data[smpl_edge,...,0], data[smpl_edge,...,1]
+  else:
+    return data[smpl_edge,...]
+  f = f.reshape((-1,)+(1,)*(a.ndim-1))
+  res = (1.-f)*a + f*b
+  return np.asarray(res, dtype=data.dtype)
+
+
+def sample_edges_multi(pos, edges, data, sample_len):
+  """
+    samples many properties in one go. The sample locations are generated
+    once (see sample_edges_plan) and all properties are interpolated there.
+    data - dict of name -> (array, mode_flags), see sample_edges
+    Returns a dict with the samples of each property, plus 'position' and
+    'weight' of the samples.
+  """
+  plan = sample_edges_plan(pos, edges, sample_len)
+  res = dict((name, interpolate_edge_samples(plan, edges, d, mode)) for name, (d, mode) in data.iteritems())
+  res['position'] = interpolate_edge_samples(plan, edges, np.asarray(pos, dtype=np.float32), VesselSamplingFlags.DATA_PER_NODE | VesselSamplingFlags.DATA_LINEAR)
+  res['weight'] = plan[2]
+  return res
+
+
+def sample_graph(graph, names, sample_len, edge_mode = 'avg'):
+  """
+    sample_edges_multi for properties of graph. Node properties are
+    interpolated linearly along the edges. Edge properties depend on
+    edge_mode: with 'avg' (default, like plotVessels.generate_samples) they
+    are first averaged onto the nodes and then interpolated linearly, with
+    'const' each sample takes the value of its edge.
+  """
+  assert edge_mode in ('avg', 'const')
+  edges = graph.edgelist
+  data = {}
+  for name in names:
+    if name in graph.edges:
+      if edge_mode == 'const' or not len(edges):
+        data[name] = (graph.edges[name], VesselSamplingFlags.DATA_CONST)
+      else:
+        data[name] = (edge_to_node_property(int(np.amax(edges)+1), edges, graph.edges[name], 'avg'), VesselSamplingFlags.DATA_PER_NODE | VesselSamplingFlags.DATA_LINEAR)
+    else:
+      data[name] = (graph.nodes[name], VesselSamplingFlags.DATA_PER_NODE | VesselSamplingFlags.DATA_LINEAR)
+  return sample_edges_multi(graph.nodes['position'], edges, data, sample_len)
+
+
+def make_vessel_volume_fraction_sparse(pos, edges, radius, ld, samples_per_cell = 5, threshold = 0.):
+  """
+    sparse version of make_vessel_volume_fraction_field. Returns
+    (coords, values) of the lattice sites where the volume fraction is
+    above threshold; coords is a (n,3) array of lattice indices.
+    Use sparse_to_dense to obtain the full field.
+  """
+  pos = np.asarray(pos, dtype=np.float32)
+  edges = np.asarray(edges, dtype=np.int32)
+  radius = np.asarray(radius, dtype=np.float32)
+  errormsg_(pos.shape[1] == 3, "pos array shape[1] must be 3")
+  errormsg_(edges.shape[1] == 2, "edges array shape[1] must be 2")
+  return libkrebs.make_vessel_volume_fraction_sparse(pos, edges, radius, ld, samples_per_cell, threshold)
+
+
+def sparse_to_dense(coords, values, shape, dtype = np.float32):
+  """
+    field of given shape with values at coords, zero elsewhere
+  """
+  res = np.zeros(shape, dtype = dtype)
+  coords = np.asarray(coords)
+  if len(coords):
+    res[tuple(coords.T)] = values
+  return res
+
 def sample_field(pos, field, ld, linear_interpolation=True, extrapolation_value = None):
   assert type(pos) is np.ndarray and len(pos.shape) == 2 and pos.shape[1]==3
   #assert pos.dtype == field.dtype
@@ -688,7 +1154,72 @@ def field_gradient(field, spacing=1.):
   return res
 
 
-def radial_correlation(field1, field2, distance, bins_per_unit=2, return_raw_data = False, subtract_avg = True, mask = None):
+def correlate_fft_(a, b, shape, window):
+  """
+    sum_p a(p)*b(p-dp) for all dp in window (a tuple of index arrays),
+    by FFT on arrays zero padded to shape
+  """
+  fa = np.fft.rfftn(a, shape)
+  fb = np.fft.rfftn(b, shape) if b is not a else fa
+  return np.fft.irfftn(fa * np.conj(fb), shape)[window]
+
+
+def radial_correlation_fft_(f1, f2, distance, bins_per_unit, subtract_avg, mask, num_jitter = 16):
+  """
+    same result as the c++ radial_correlation, computed from the sums over
+    all pairs of sites with a given displacement, which are obtained by FFT.
+    The c++ code bins each pair at its distance plus a random offset in
+    [-1,1]^3. Here the sums for each displacement are spread over the bins
+    of num_jitter such offsets instead.
+  """
+  f1 = np.asarray(f1, dtype = np.float64)
+  f2 = np.asarray(f2, dtype = np.float64)
+  if subtract_avg:
+    f1 = f1 - np.average(f1)
+    f2 = f2 - np.average(f2)
+  shape = tuple(n + d for n, d in zip(f1.shape, distance))
+  offsets = [ np.arange(-d, d+1) for d in distance ]
+  window = np.ix_(*[ o % n for o, n in zip(offsets, shape) ])
+  if mask is not None:
+    m = np.asarray(np.asarray(mask) != 0, dtype = np.float64) # the c++ code tests mask != 0
+    f1, f2 = f1*m, f2*m
+    n = correlate_fft_(m, m, shape, window)
+  else:
+    # number of pairs is the size of the overlap of the field with its shifted copy
+    n = reduce(np.multiply, np.ix_(*[ size - np.abs(o) for o, size in zip(offsets, f1.shape) ]))
+  c = correlate_fft_(f1, f2, shape, window)
+  s = correlate_fft_(f1*f1, f2*f2, shape, window)
+  # the FFT leaves round-off noise where there are no pairs
+  n = np.round(n)
+  c[n <= 0.] = 0.
+  s[n <= 0.] = 0.
+
+  num_bins = max(distance)*bins_per_unit
+  dp = np.broadcast_arrays(*np.ix_(*offsets))
+  rnd = np.random.RandomState(0)
+  res_n, res_c, res_s = np.zeros(num_bins), np.zeros(num_bins), np.zeros(num_bins)
+  for k in xrange(num_jitter):
+    jitter = rnd.uniform(-1., 1., 3)
+    r = np.sqrt(sum(np.square(x + j) for x, j in zip(dp, jitter)))
+    index = np.asarray(np.floor(r*bins_per_unit + 0.5), dtype = np.int64).ravel()
+    sel = index < num_bins
+    index = index[sel]
+    res_n += np.bincount(index, weights = n.ravel()[sel], minlength = num_bins)
+    res_c += np.bincount(index, weights = c.ravel()[sel], minlength = num_bins)
+    res_s += np.bincount(index, weights = s.ravel()[sel], minlength = num_bins)
+  r = np.arange(num_bins, dtype = np.float64)/bins_per_unit
+  return r, res_n/num_jitter, res_c/num_jitter, res_s/num_jitter
+
+
+def radial_correlation(field1, field2, distance, bins_per_unit=2, return_raw_data = False, subtract_avg = True, mask = None, method = 'direct'):
+  """
+    correlation <a(x)*b(x+r)> binned by |r| up to distance (in lattice units).
+    method 'direct' (default) sums over all pairs in c++. Its cost is the size
+    of the field times the volume of the window of displacements. 'fft' uses
+    FFTs on the whole field and costs about the size of the field times its
+    logarithm. 'auto' takes whatever is cheaper. The methods bin with
+    different random offsets, so only their statistics agree.
+  """
   typesize = { np.dtype(np.float32): 1,
                np.dtype(np.float64): 2}
   if typesize[field1.dtype] > typesize[field2.dtype]:
@@ -704,7 +1235,15 @@ def radial_correlation(field1, field2, distance, bins_per_unit=2, return_raw_dat
   f1 = np.atleast_3d(field1)
   f2 = np.atleast_3d(field2)
   assert len(f1.shape)==3 and len(f2.shape)==3
-  r, n, c, s = func(f1, f2, distance, bins_per_unit, subtract_avg, mask)
+  if method == 'auto':
+    window_volume = np.prod([ 2*d+1 for d in distance ])
+    padded_volume = np.prod([ n + d for n, d in zip(f1.shape, distance) ])
+    # roughly 8 transforms of the padded field versus one pass per displacement
+    method = 'fft' if window_volume*f1.size > 8*padded_volume*np.log2(max(2, padded_volume)) else 'direct'
+  if method == 'fft':
+    r, n, c, s = radial_correlation_fft_(f1, f2, distance, bins_per_unit, subtract_avg, None if mask is None else np.atleast_3d(mask))
+  else:
+    r, n, c, s = func(f1, f2, distance, bins_per_unit, subtract_avg, mask)
   if return_raw_data == True:
     return r, n, c, s
   else:
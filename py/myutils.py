@@ -26,6 +26,7 @@ import h5py
 import h5files
 import numpy as np
 import collections
+import itertools
 import posixpath
 import fnmatch
 import posixpath
@@ -33,6 +34,9 @@ import md5
 import cPickle
 import uuid
 import decimal
+import tempfile
+import time
+import sys
 
 import identifycluster
 
@@ -130,81 +134,127 @@ def random_stratified(start, end, cnt):
   return a+r
 
 
-def processLargeDataset(ds, fun, reduction, blocksize = 1000000, depth=0):
-  ''' 
-    Circumvent floating point overfloat and accumulation of errors by
-    splitting the problem into smaller parts and processing each part
-    separately.
-    
-    Input:
-      ds: dataset
-      fun: compute some quantity from a subsection of the dataset
-      reduction: combine the result of two subsections of the dataset
-    Output:
-      final call of reduction
+def datasetBlockShape(ds, blocksize = 1000000):
+  '''
+    shape of blocks with about blocksize elements which are aligned to the
+    chunks of a hdf dataset. For contiguous datasets and numpy arrays whole
+    rows are preferred, i.e. blocks extend along the last axes first.
   '''
-  #print 'pLD'+('  '*depth)+str(ds)
   shape = ds.shape
-  if np.product(shape) <= blocksize:  # if the remaining dataset is relatively small
-    result = fun(ds)
+  chunks = getattr(ds, 'chunks', None) or (1,)*len(shape)
+  block = list(chunks)
+  for ax in reversed(range(len(shape))):
+    others = np.product(block) / block[ax]
+    n = max(1, blocksize // (others * chunks[ax]))
+    block[ax] = min(shape[ax], chunks[ax] * n)
+  return tuple(block)
+
+
+def iterateDatasetBlocks(ds, blocksize = 1000000):
+  '''yields index tuples of the blocks given by datasetBlockShape'''
+  shape = ds.shape
+  block = datasetBlockShape(ds, blocksize)
+  starts = [ xrange(0, n, b) for n, b in zip(shape, block) ]
+  for corner in itertools.product(*starts):
+    yield tuple(slice(c, min(c+b, n)) for c, b, n in zip(corner, block, shape))
+
+
+class StreamingStatistics(object):
+  '''
+    count, mean, variance, min, max and optionally a histogram of data which is
+    added block by block. Mean and variance are combined with the pairwise
+    update of Chan et al. (the block version of Welford's algorithm), so one pass
+    over the data suffices and there is no catastrophic cancellation.
+  '''
+  def __init__(self, bins = None):
+    self.bins = np.asarray(bins) if bins is not None else None
+    self.cnt = 0
+    self.mean = 0.
+    self.m2 = 0. # sum of squared deviations from the mean
+    self.min = np.inf
+    self.max = -np.inf
+    self.hist = np.zeros((len(self.bins)-1,), dtype = np.int64) if bins is not None else None
+
+  @staticmethod
+  def fromBlock(a, bins = None):
+    s = StreamingStatistics(bins)
+    a = np.ravel(np.asarray(a))
+    if a.size:
+      s.cnt = a.size
+      s.mean = np.mean(a, dtype = np.float64)
+      s.m2 = np.sum(np.square(a - s.mean, dtype = np.float64))
+      s.min = np.amin(a)
+      s.max = np.amax(a)
+      if bins is not None:
+        s.hist += np.histogram(a, bins = s.bins)[0]
+    return s
+
+  def merge(self, other):
+    n = self.cnt + other.cnt
+    if other.cnt:
+      delta = other.mean - self.mean
+      self.mean += delta * other.cnt / n
+      self.m2 += other.m2 + delta * delta * self.cnt * other.cnt / n
+      self.cnt = n
+      self.min = min(self.min, other.min)
+      self.max = max(self.max, other.max)
+      if self.hist is not None:
+        self.hist += other.hist
+    return self
+
+  @property
+  def var(self):
+    return self.m2 / self.cnt if self.cnt else np.nan
+
+  @property
+  def std(self):
+    return np.sqrt(self.var)
+
+
+def reduceLargeDataset(ds, bins = None, blocksize = 1000000, num_threads = 1):
+  '''
+    computes StreamingStatistics over a hdf dataset (or array) in a single pass,
+    reading blocks aligned to its chunk layout. With num_threads > 1, blocks are
+    processed by a thread pool. Reading is serialized by h5py, but decompression
+    of one block can overlap with the numpy reductions of others.
+  '''
+  def fun(idx):
+    return StreamingStatistics.fromBlock(ds[idx], bins)
+  blocks = iterateDatasetBlocks(ds, blocksize)
+  result = StreamingStatistics(bins)
+  if num_threads > 1:
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(num_threads)
+    try:
+      for s in pool.imap(fun, blocks):
+        result.merge(s)
+    finally:
+      pool.terminate()
   else:
-    # We split the dataset along the longest axis in half and process each piece separately.
-    longest_axis = np.argmax(shape)
-    l = shape[longest_axis]
-    idx = [slice(None)] * len(shape)
-    idx[longest_axis] = slice(0, l/2)
-    r1 = processLargeDataset(ds[tuple(idx)], fun, reduction, blocksize, depth+1) # h5py requires a tuple as index list (idx), numpy on the other hand also works with lists
-    idx[longest_axis] = slice(l/2, l)
-    r2 = processLargeDataset(ds[tuple(idx)], fun, reduction, blocksize, depth+1)
-    # 3rd and 4th argument give the fractional volume covered by each of the two sub-boxes
-    result = reduction(r1, r2, 1.*(l/2) / l, 1.*(l - l/2) / l)
+    for idx in blocks:
+      result.merge(fun(idx))
   return result
-  
+
+
 def largeDatasetAverage(ds, **kwargs):
-  def fun(ds):
-    return np.average(np.asarray(ds))
-  def reduction(a, b, wa, wb):
-    return a*wa + b*wb
-  return processLargeDataset(ds, fun, reduction, **kwargs)
+  return reduceLargeDataset(ds, **kwargs).mean
 
 def largeDatasetAverageAndStd(ds, **kwargs):
-  mu = largeDatasetAverage(ds, **kwargs)  
-  def fun(ds):
-    arr = np.asarray(ds)
-    arr = arr - mu
-    return np.average(np.square(arr))
-  def reduction(a, b, wa, wb):
-    return a*wa + b*wb  
-  var = processLargeDataset(ds, fun, reduction, **kwargs)
-  return mu, np.sqrt(var)
-
-
-
-def testProcessLargeDataset():
-  def fun(ds):
-    print 'fun on ',ds[...]
-    return np.average(ds), 1.*np.product(ds.shape)
-  
-  def reduction(a, b, wa, wb):
-    (a,Na),(b,Nb) = a, b
-    #wa = Na/(Na+Nb)
-    #wb = Nb/(Na+Nb)
-    return (a*wa + b*wb), (Na+Nb)
+  s = reduceLargeDataset(ds, **kwargs)
+  return s.mean, s.std
 
-  print 'test1'
-  a = np.arange(20)
-  result = processLargeDataset(a, fun, reduction, blocksize = 3)
-  print result, 'vs', np.average(a)
-  
-  print 'test2'
+
+
+def testReduceLargeDataset():
   a = np.arange(30).reshape((3,5,2))
-  result = processLargeDataset(a, fun, reduction, blocksize = 3)
-  print result, 'vs', np.average(a)
-  
-  print 'test3'
+  print 'test1'
   mu, sd = largeDatasetAverageAndStd(a, blocksize = 3)
   print mu, sd, 'vs', np.average(a), np.std(a)
 
+  print 'test2'
+  s = reduceLargeDataset(a, bins = [0, 10, 20, 30], blocksize = 4, num_threads = 2)
+  print s.mean, s.std, s.min, s.max, s.hist, 'vs', np.average(a), np.std(a), np.histogram(a, [0, 10, 20, 30])[0]
+
 
 def closest_items(seq, key, picks):
   """
@@ -488,24 +538,59 @@ def UsesDataManager(func):
     
 
 class DataManager(object):
-  def __init__(self, cachesize = 50, handlers = []):
+  '''
+    Looks up data by name via registered handlers and keeps the results in a
+    LRU_Cache. Optionally a DiskCache is used as second tier behind the LRU_Cache
+    so that results survive the process. If diskcache is None, a DiskCache is
+    created when the environment variable DATAMANAGER_CACHE_DIR is set. The size
+    limit can be given in GB by DATAMANAGER_CACHE_SIZE_GB. diskcache = False
+    disables the disk tier regardless of the environment.
+
+    Besides the number of entries (cachesize) the memory held by the cache can
+    be limited by maxbytes, which defaults to DATAMANAGER_MEMORY_GB if that is
+    set. Hits, misses, evictions and compute times are counted per data name.
+    Use print_stats to show them, e.g. atexit.register(dataman.print_stats).
+  '''
+  def __init__(self, cachesize = 50, handlers = [], diskcache = None, maxbytes = None):
     self.handlers_ = {}    
     for h in handlers:
       self.add_handler_(h)
 
+    if diskcache is None and os.environ.get('DATAMANAGER_CACHE_DIR', ''):
+      disk_maxbytes = int(float(os.environ.get('DATAMANAGER_CACHE_SIZE_GB', 10.)) * 1024**3)
+      diskcache = DiskCache(os.environ['DATAMANAGER_CACHE_DIR'], maxbytes = disk_maxbytes)
+    self.diskcache_ = diskcache if diskcache else None
+
     def arg2key_(args):
       return make_hashable(args)
 
     def obtain_data_for_cache_(dataname, *args, **kwargs):
       h = self.handlers_[dataname]
-      if DataManager.isDataClass(h):
-        return h.obtain_data(self, dataname, *args, **kwargs)
-      else:
-        return h(self, *args, **kwargs)
-
-    self.cache_ = LRU_Cache(obtain_data_for_cache_, maxsize = cachesize, key = arg2key_)
+      def compute():
+        if DataManager.isDataClass(h):
+          return h.obtain_data(self, dataname, *args, **kwargs)
+        else:
+          return h(self, *args, **kwargs)
+      if self.diskcache_ is None:
+        return compute()
+      return self.diskcache_(dataname, args, compute, h)
+
+    if maxbytes is None and os.environ.get('DATAMANAGER_MEMORY_GB', ''):
+      maxbytes = int(float(os.environ['DATAMANAGER_MEMORY_GB']) * 1024**3)
+
+    self.cache_ = LRU_Cache(obtain_data_for_cache_, maxsize = cachesize, key = arg2key_, maxbytes = maxbytes, category = lambda args: args[0])
+    self.pool_ = None # worker processes of obtain_data_ensemble
+    self.pool_config_ = None
   #### end of __init__  ###
 
+  @property
+  def statistics(self):
+    '''dict of CacheStatistics by data name'''
+    return self.cache_.statistics
+
+  def print_stats(self, out = None):
+    self.cache_.print_stats(out)
+
   def add_handler_(self, h):
     if DataManager.isDataClass(h):
       for k in h.keywords:
@@ -539,6 +624,77 @@ class DataManager(object):
   def isDataClass(h): # as opposed to function
     return hasattr(h, 'keywords') and hasattr(h, 'obtain_data')
 
+  def obtain_data_ensemble(self, dataname, arg_list, merge = None, num_workers = None):
+    '''
+      Calls obtain_data(dataname, *args) for each args in arg_list, distributed
+      over a pool of processes, one task per item. Typically each item refers
+      to a different input file. The list of results is passed to merge, which
+      defaults to merge_results.
+
+      Hdf objects in the arguments are sent to the workers as H5FileReference
+      and reopened there with the mode of the original file. Each worker has its
+      own DataManager with the handlers of this one, so handlers must be picklable.
+      Results are not put into the cache of this DataManager. The workers open
+      the files read only, and close them after each task. If a worker cannot
+      open a file, e.g. because this process holds it open for writing and
+      HDF5 file locking refuses a second opening, all items are computed in
+      this process instead. With num_workers = 1 no pool is used at all.
+
+      The pool is created on first use and reused by later calls with the same
+      handlers and number of workers. close_pool ends it.
+    '''
+    if num_workers is None:
+      num_workers = cluster_threads
+    num_workers = min(num_workers, len(arg_list))
+    if merge is None:
+      merge = merge_results
+    handlers = []
+    for h in self.handlers_.itervalues():
+      if not any(h is q for q in handlers):
+        handlers.append(h)
+    if num_workers > 1:
+      try:
+        cPickle.dumps(handlers, cPickle.HIGHEST_PROTOCOL)
+      except Exception, e:
+        print 'obtain_data_ensemble: cannot send handlers to worker processes (%s), running serially' % str(e)
+        num_workers = 1
+    if num_workers <= 1:
+      return merge([ self.obtain_data(dataname, *args) for args in arg_list ])
+
+    tasks = [ (dataname, to_h5_references_(tuple(args))) for args in arg_list ]
+    pool = self.get_pool_(handlers, num_workers)
+    try:
+      results = pool.map(ensemble_worker_, tasks, chunksize = 1)
+    except IOError, e:
+      print 'obtain_data_ensemble: worker failed to open a file (%s), running serially' % str(e)
+      results = [ self.obtain_data(dataname, *args) for args in arg_list ]
+    except:
+      self.close_pool(terminate = True)
+      raise
+    return merge(results)
+
+  def get_pool_(self, handlers, num_workers):
+    config = (tuple(id(h) for h in handlers), num_workers)
+    if self.pool_ is not None and self.pool_config_ != config:
+      self.close_pool()
+    if self.pool_ is None:
+      import multiprocessing
+      self.pool_ = multiprocessing.Pool(num_workers, ensemble_worker_init_, (handlers, self.cache_.maxsize, self.cache_.maxbytes))
+      self.pool_config_ = config
+    return self.pool_
+
+  def close_pool(self, terminate = False):
+    '''ends the worker processes of obtain_data_ensemble, if any'''
+    if self.pool_ is None:
+      return
+    if terminate:
+      self.pool_.terminate()
+    else:
+      self.pool_.close()
+    self.pool_.join()
+    self.pool_ = None
+    self.pool_config_ = None
+
 #  def __getattr__(self, key):
 #    try:
 #      return self.__dict__[key]
@@ -549,24 +705,377 @@ class DataManager(object):
 
 
 
+def linked_files_key_(a):
+  '''
+    identity (path, size, modification time) of the files referenced from hdf
+    object a or from the root of its file, by external links or by SOURCE and
+    *_FILE attributes (see buildLink, MeasurementFile).
+  '''
+  names = set()
+  for o in ([a.file, a] if a.name != '/' else [a.file]):
+    for k, v in o.attrs.iteritems():
+      if (k == 'SOURCE' or k.endswith('_FILE')) and isinstance(v, basestring) and v:
+        names.add(str(v))
+    if isinstance(o, h5py.Group):
+      for k in o.keys():
+        if o.id.links.get_info(k).type == h5py.h5l.TYPE_EXTERNAL:
+          names.add(o.id.links.get_val(k)[0])
+  res = []
+  basedir = dirname(os.path.realpath(a.file.filename))
+  for name in names:
+    fn = os.path.realpath(join(basedir, name))
+    try:
+      st = os.stat(fn)
+    except OSError:
+      res.append((name, None))
+    else:
+      res.append((fn, st.st_size, st.st_mtime))
+  return tuple(sorted(res))
+
+
+def handler_checksum_(h):
+  '''
+    md5 of the byte code of a DataManager handler, a function or a data class
+    (all methods of its class). Functions called by the handler are not included.
+  '''
+  import types
+  parts = []
+  def add(code):
+    parts.append((code.co_code, code.co_names))
+    for q in code.co_consts:
+      if isinstance(q, types.CodeType):
+        add(q)
+      else:
+        parts.append(repr(q))
+  if isinstance(h, types.FunctionType):
+    add(h.func_code)
+  else:
+    for cls in type(h).__mro__:
+      for name, v in sorted(cls.__dict__.items()):
+        if isinstance(v, (staticmethod, classmethod)):
+          v = v.__func__
+        if isinstance(v, types.FunctionType):
+          add(v.func_code)
+  return checksum(parts)
+
+
+def diskcache_key_(a):
+  '''
+    convert arguments of DataManager.obtain_data into something that can be
+    pickled deterministically. Hdf objects are replaced by the identity of
+    their file (path, inode, size, modification time), their path within the
+    file and the identity of the files linked from there (see linked_files_key_).
+  '''
+  if isinstance(a, (h5py.File, h5py.Group, h5py.Dataset)):
+    fn = os.path.realpath(a.file.filename)
+    st = os.stat(fn)
+    return ('H5', fn, st.st_ino, st.st_dev, st.st_size, st.st_mtime, a.name, linked_files_key_(a))
+  if isinstance(a, (list, tuple)):
+    return tuple(diskcache_key_(q) for q in a)
+  if isinstance(a, dict):
+    return ('DICT',) + tuple(sorted((k, diskcache_key_(q)) for k, q in a.iteritems()))
+  if isinstance(a, np.ndarray):
+    return ('NDARRAY', a.dtype.str, a.shape, md5.new(np.ascontiguousarray(a).tostring()).hexdigest())
+  if hasattr(a, 'GetWorldBoxRavel') and hasattr(a, 'GetBoxRavel'): # LatticeData, which cannot be pickled
+    return ('LD', tuple(a.GetBoxRavel()), tuple(a.GetWorldBoxRavel()), a.GetScale())
+  return a
+
+
+class DiskCache(object):
+  '''
+    Persistent cache tier for DataManager.
+
+    Each result is pickled into a file in directory. The file name is the md5
+    checksum of the data name, the arguments, the identity of all hdf files
+    referenced by the arguments and of the files linked from them (see
+    diskcache_key_), and the byte code of the handler. Therefore results are
+    recomputed when an input file or the handler is modified.
+
+    Files are first written to a temporary file and then renamed, which is atomic
+    on posix file systems. So several cluster jobs can share the directory.
+    When the total size exceeds maxbytes, the least recently used files are deleted.
+    The size is tracked by adding up what this process stores; the directory
+    is only scanned at the first store and when the sum exceeds maxbytes.
+
+    datanames -> if not None, only these data names are cached on disk.
+    version -> change this to invalidate everything stored so far.
+
+    Results which cannot be pickled, e.g. hdf datasets, are not stored, and so
+    are arguments which cannot be converted to a key.
+  '''
+  suffix = '.pickle'
+
+  def __init__(self, directory, maxbytes = 10*1024**3, datanames = None, version = 0):
+    self.directory = os.path.abspath(directory)
+    self.maxbytes = maxbytes
+    self.datanames = set(datanames) if datanames is not None else None
+    self.version = version
+    self.nbytes = None # estimated size of the directory, see store_
+    if not os.path.isdir(self.directory):
+      try:
+        os.makedirs(self.directory)
+      except OSError:
+        if not os.path.isdir(self.directory): # somebody else might have created it just now
+          raise
+
+  def makeKey_(self, dataname, args, handler = None):
+    if self.datanames is not None and dataname not in self.datanames:
+      return None
+    try:
+      code = handler_checksum_(handler) if handler is not None else None
+      return checksum(self.version, dataname, diskcache_key_(args), code)
+    except Exception: # unpicklable arguments raise various errors
+      return None
+
+  def filename_(self, key):
+    return join(self.directory, key+self.suffix)
+
+  def __call__(self, dataname, args, compute, handler = None):
+    '''return the cached value or compute() it and store it. handler is part of the key, see handler_checksum_'''
+    key = self.makeKey_(dataname, args, handler)
+    if key is None:
+      return compute()
+    fn = self.filename_(key)
+    try:
+      with open(fn, 'rb') as f:
+        value = cPickle.load(f)
+    except IOError:
+      pass # not cached
+    except Exception, e: # truncated or otherwise unreadable file
+      print 'DiskCache: cannot read %s (%s), recomputing' % (fn, str(e))
+    else:
+      try:
+        os.utime(fn, None) # mark as recently used
+      except OSError:
+        pass
+      return value
+    value = compute()
+    self.store_(fn, value)
+    return value
+
+  def store_(self, fn, value):
+    try:
+      data = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    except Exception: # boost python and h5py objects raise various errors
+      return
+    if len(data) > self.maxbytes:
+      return
+    fd, tmpname = tempfile.mkstemp(suffix = '.tmp', dir = self.directory)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+      os.rename(tmpname, fn)
+    except (IOError, OSError), e:
+      print 'DiskCache: cannot write %s (%s)' % (fn, str(e))
+      try:
+        os.remove(tmpname)
+      except OSError:
+        pass
+      return
+    if self.nbytes is None:
+      self.evict_()
+    else:
+      self.nbytes += len(data)
+      if self.nbytes > self.maxbytes:
+        self.evict_()
+
+  def evict_(self):
+    '''delete least recently used files until the total size is within maxbytes'''
+    entries = []
+    now = time.time()
+    for name in os.listdir(self.directory):
+      fn = join(self.directory, name)
+      try:
+        st = os.stat(fn)
+      except OSError: # deleted by a concurrent process
+        continue
+      if name.endswith(self.suffix):
+        entries.append((st.st_mtime, st.st_size, fn))
+      elif name.endswith('.tmp') and now - st.st_mtime > 24*3600.: # left over from killed jobs
+        entries.append((0., st.st_size, fn))
+    total = sum(size for _, size, _ in entries)
+    self.nbytes = total
+    if total <= self.maxbytes:
+      return
+    entries.sort()
+    for _, size, fn in entries:
+      try:
+        os.remove(fn)
+      except OSError:
+        pass
+      total -= size
+      self.nbytes = total
+      if total <= self.maxbytes:
+        break
+
+  def clear(self):
+    self.nbytes = None
+    for name in os.listdir(self.directory):
+      if name.endswith(self.suffix):
+        try:
+          os.remove(join(self.directory, name))
+        except OSError:
+          pass
+
+
+def nbytes_of(obj, _depth = 0):
+  '''
+    estimate the memory occupied by obj by summing up the nbytes of all
+    numpy arrays within it. Descends into tuples, lists, dicts and the
+    attributes of plain python objects (e.g. Graph, MeanValueArray).
+  '''
+  if _depth > 8:
+    return 0
+  if isinstance(obj, np.ndarray):
+    return obj.nbytes
+  if isinstance(obj, (list, tuple)):
+    return sum(nbytes_of(q, _depth+1) for q in obj)
+  if isinstance(obj, dict): # dict.itervalues does not trigger loading of lazy graph properties
+    return sum(nbytes_of(q, _depth+1) for q in dict.itervalues(obj))
+  if isinstance(obj, (h5py.File, h5py.Group, h5py.Dataset)):
+    return 0
+  if hasattr(obj, '__dict__'):
+    return nbytes_of(obj.__dict__, _depth+1)
+  return 0
+
+
+class CacheStatistics(object):
+  '''counters of LRU_Cache for one category of cached items'''
+  def __init__(self):
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.uncached = 0 # results too large to be stored
+    self.compute_time = 0. # excluding nested computations of other cached items
+    self.nbytes = 0 # currently held
+
+  def __str__(self):
+    return 'hits %i, misses %i, evictions %i, uncached %i, compute %s s, held %s MB' % (
+      self.hits, self.misses, self.evictions, self.uncached, f2s(self.compute_time), f2s(self.nbytes/1024.**2))
+
+
+H5WorkerReference_ = collections.namedtuple('H5WorkerReference_', ['fn','path'])
+
+
+def to_h5_references_(a):
+  '''
+    replace hdf objects in nested tuples/lists/dicts by references which can
+    be sent to other processes. Files open for writing are flushed so that
+    the other processes see their current content.
+  '''
+  if isinstance(a, (h5py.File, h5py.Group, h5py.Dataset)):
+    if a.file.mode != 'r':
+      a.file.flush()
+    return H5WorkerReference_(os.path.realpath(a.file.filename), a.name)
+  if isinstance(a, (list, tuple)):
+    return type(a)(to_h5_references_(q) for q in a)
+  if isinstance(a, dict):
+    return type(a)((k, to_h5_references_(q)) for k, q in a.iteritems())
+  return a
+
+
+def from_h5_references_(a, opened):
+  '''inverse of to_h5_references_, opening files read only with h5files. The files are appended to opened.'''
+  if isinstance(a, H5WorkerReference_):
+    f = h5files.open(a.fn, 'r')
+    opened.append(f)
+    return f[a.path]
+  if isinstance(a, (list, tuple)):
+    return type(a)(from_h5_references_(q, opened) for q in a)
+  if isinstance(a, dict):
+    return type(a)((k, from_h5_references_(q, opened)) for k, q in a.iteritems())
+  return a
+
+
+ensemble_worker_config_ = None
+
+def ensemble_worker_init_(handlers, cachesize, maxbytes):
+  global ensemble_worker_config_
+  # Forget the file handles inherited from the parent by fork. They must not
+  # be closed here because that would affect the files of the parent process.
+  h5files.h5files_.reset_after_fork()
+  ensemble_worker_config_ = (handlers, cachesize, maxbytes)
+
+def ensemble_worker_(task):
+  # The pool outlives a single obtain_data_ensemble call and the parent may
+  # modify the files in between, so neither files nor cached data are kept.
+  dataname, args = task
+  handlers, cachesize, maxbytes = ensemble_worker_config_
+  dataman = DataManager(cachesize, handlers, maxbytes = maxbytes)
+  opened = []
+  try:
+    args = from_h5_references_(args, opened)
+    return dataman.obtain_data(dataname, *args)
+  finally:
+    for f in opened:
+      h5files.close(f)
+
+
+def merge_results(results):
+  '''
+    combine results computed separately for each member of an ensemble:
+    MeanValueArrays are summed, arrays concatenated along the first axis and
+    tuples are merged element by element. Anything else is returned as list.
+  '''
+  if not len(results):
+    return results
+  if all(isinstance(r, MeanValueArray) for r in results):
+    return MeanValueArray.fromSummation(results)
+  if all(isinstance(r, np.ndarray) for r in results):
+    return np.concatenate(results)
+  if all(isinstance(r, tuple) for r in results) and len(set(len(r) for r in results)) == 1:
+    return tuple(merge_results(list(q)) for q in zip(*results))
+  return list(results)
+
+
 # http://stackoverflow.com/questions/4443920/python-building-a-lru-cache
 # by
 # http://stackoverflow.com/users/1001643/raymond-hettinger
 class LRU_Cache(object):
-  def __init__(self, original_function, maxsize=1000, key = (lambda x: x)):
+  '''
+    maxsize -> maximal number of entries
+    maxbytes -> if not None, maximal memory held by the entries as measured
+                by sizeof. Least recently used entries are evicted until the
+                new one fits. Results larger than maxbytes are returned but not stored.
+                Sizes are measured once when an entry is stored, so memory
+                which a cached object acquires later is not accounted for.
+    category -> maps the argument tuple to a name under which hits, misses etc.
+                are counted (see statistics and print_stats)
+  '''
+  def __init__(self, original_function, maxsize=1000, key = (lambda x: x), maxbytes = None, sizeof = nbytes_of, category = (lambda x: None)):
     self.original_function = original_function
     self.maxsize = maxsize
+    self.maxbytes = maxbytes
+    self.sizeof = sizeof
+    self.category = category
+    self.nbytes = 0
     self.mapping = {}
     self.arg2key = key
+    self.statistics = collections.defaultdict(CacheStatistics)
+    self.nested_time_ = [] # per active computation, the time spent in nested computations
 
-    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
-    self.head = [None, None, None, None]        # oldest
-    self.tail = [self.head, None, None, None]   # newest
+    PREV, NEXT, KEY, VALUE, SIZE, CAT = 0, 1, 2, 3, 4, 5
+    self.head = [None, None, None, None, 0, None]        # oldest
+    self.tail = [self.head, None, None, None, 0, None]   # newest
     self.head[NEXT] = self.tail
 
+  def evict_oldest_(self):
+    PREV, NEXT, KEY, VALUE, SIZE, CAT = 0, 1, 2, 3, 4, 5
+    head = self.head
+    oldest = head[NEXT]
+    next_oldest = oldest[NEXT]
+    head[NEXT] = next_oldest
+    next_oldest[PREV] = head
+    #print 'LRU discarded %s' % str(oldest[KEY])
+    del self.mapping[oldest[KEY]]
+    self.nbytes -= oldest[SIZE]
+    stats = self.statistics[oldest[CAT]]
+    stats.evictions += 1
+    stats.nbytes -= oldest[SIZE]
+
   def __call__(self, *arg):
   #def __call__(original_function, *arg)
-    PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+    PREV, NEXT, KEY, VALUE, SIZE, CAT = 0, 1, 2, 3, 4, 5
     mapping, head, tail, arg2key = self.mapping, self.head, self.tail, self.arg2key
     sentinel = object()
 
@@ -575,20 +1084,36 @@ class LRU_Cache(object):
     link = mapping.get(key, sentinel)
     if link is sentinel:
         #print 'LRU miss %s' % str(key)
-        value = self.original_function(*arg)
-        if len(mapping) >= self.maxsize:
-            oldest = head[NEXT]
-            next_oldest = oldest[NEXT]
-            head[NEXT] = next_oldest
-            next_oldest[PREV] = head
-            #print 'LRU discarded %s' % str(oldest[KEY])
-            del mapping[oldest[KEY]]
+        cat = self.category(arg)
+        stats = self.statistics[cat]
+        stats.misses += 1
+        # compute_time excludes misses of this cache while computing the value
+        self.nested_time_.append(0.)
+        t_ = time.time()
+        try:
+            value = self.original_function(*arg)
+        finally:
+            elapsed = time.time() - t_
+            nested = self.nested_time_.pop()
+            if self.nested_time_:
+                self.nested_time_[-1] += elapsed
+        stats.compute_time += elapsed - nested
+        size = self.sizeof(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            stats.uncached += 1
+            return value
+        while mapping and (len(mapping) >= self.maxsize or
+                           (self.maxbytes is not None and self.nbytes + size > self.maxbytes)):
+            self.evict_oldest_()
         last = tail[PREV]
-        link = [last, tail, key, value]
+        link = [last, tail, key, value, size, cat]
         mapping[key] = last[NEXT] = tail[PREV] = link
+        self.nbytes += size
+        stats.nbytes += size
     else:
         #print 'LRU hit %s' % str(key)
-        link_prev, link_next, key, value = link
+        link_prev, link_next, key, value, _, cat = link
+        self.statistics[cat].hits += 1
         link_prev[NEXT] = link_next
         link_next[PREV] = link_prev
         last = tail[PREV]
@@ -597,6 +1122,15 @@ class LRU_Cache(object):
         link[NEXT] = tail
     return value
 
+  def print_stats(self, out = None):
+    out = out if out is not None else sys.stdout
+    total = CacheStatistics()
+    for cat, stats in sorted(self.statistics.iteritems()):
+      print >>out, '%s: %s' % (cat, stats)
+      for name in ('hits', 'misses', 'evictions', 'uncached', 'compute_time', 'nbytes'):
+        setattr(total, name, getattr(total, name) + getattr(stats, name))
+    print >>out, 'total: %s' % total
+
 
 # see
 # https://docs.python.org/2/library/decimal.html
@@ -945,12 +1479,7 @@ class MeanValueArray(object):
 
   @staticmethod
   def fromHistogram1d(bins, x, y, w = 1.):
-    if isinstance(w, (float, int)):
-      w = w * np.ones(x.shape, dtype=np.float32)
-    cnt, _ = np.histogram(x, bins=bins, weights = w)
-    sum, _ = np.histogram(x, bins=bins, weights = w * y)
-    sqr, _ = np.histogram(x, bins=bins, weights = w * np.power(y, 2.))
-    return MeanValueArray(cnt, sum, sqr)
+    return Binning(bins, x, w).meanValueArray(y)
 
   @staticmethod
   def inOneBin(y):
@@ -976,6 +1505,67 @@ class MeanValueArray(object):
     return a
 
 
+class Binning(object):
+  '''
+    Sorts x into bins once, so that MeanValueArrays of many quantities y
+    given at the same x cost one np.bincount each instead of three
+    np.histogram calls. Follows np.histogram: the last bin includes its
+    right edge, values outside the bins are ignored.
+
+    x, y and the weights w are raveled. w can also be a number.
+  '''
+  def __init__(self, bins, x, w = 1.):
+    bins = np.asarray(bins)
+    x = np.ravel(x)
+    self.num_bins = len(bins)-1
+    index = np.searchsorted(bins, x, side = 'right')
+    index[x == bins[-1]] -= 1
+    index -= 1
+    valid = (index >= 0) & (index < self.num_bins)
+    if valid.all():
+      self.valid = None
+    else:
+      self.valid = valid
+      index = index[valid]
+    self.index = index
+    if isinstance(w, (float, int)):
+      self.w = float(w)
+      self.cnt = self.w * self.bincount_(None)
+    else:
+      self.w = self.select_(w)
+      self.cnt = self.bincount_(self.w)
+
+  def select_(self, y):
+    y = np.ravel(y)
+    return y if self.valid is None else y[self.valid]
+
+  def bincount_(self, weights):
+    return np.bincount(self.index, weights = weights, minlength = self.num_bins).astype(np.float64)
+
+  def meanValueArray(self, y):
+    y = self.select_(y)
+    wy = self.w * y
+    sum = self.bincount_(wy)
+    wy *= y
+    sqr = self.bincount_(wy)
+    return MeanValueArray(self.cnt.copy(), sum, sqr)
+
+
+def histogramFields1d(bins, x, ys, w = 1., blocksize = 1000000):
+  '''
+    MeanValueArrays of the fields in ys binned by x, like fromHistogram1d.
+    x, ys and w (unless it is a number) are hdf datasets or arrays of
+    equal shape. They are read block by block (see iterateDatasetBlocks),
+    so memory usage does not depend on the field size. Returns a list.
+  '''
+  result = [ MeanValueArray.empty() for _ in ys ]
+  for idx in iterateDatasetBlocks(x, blocksize):
+    binning = Binning(bins, x[idx], w if isinstance(w, (float, int)) else w[idx])
+    for r, y in zip(result, ys):
+      r += binning.meanValueArray(y[idx])
+  return result
+
+
 def UpdateHierarchical(d1, d2):
   for k2, v2 in d2.iteritems():
     if isinstance(v2, dict):
@@ -1073,7 +1663,7 @@ def printndarray(a):
 
 if __name__ == '__main__':
   if 1:
-    testProcessLargeDataset()
+    testReduceLargeDataset()
   if 0:
     TestUpdateHierarchical()
   if 0:
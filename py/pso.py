@@ -55,11 +55,59 @@ def _cons_ieqcons_wrapper(ieqcons, args, kwargs, x):
 
 def _cons_f_ieqcons_wrapper(f_ieqcons, args, kwargs, x):
     return np.array(f_ieqcons(x, *args, **kwargs))
+
+_state_names = ['x', 'v', 'p', 'fx', 'fs', 'fp', 'g', 'fg', 'it', 'lb', 'ub']
+
+def _save_state(checkpoint, state):
+    """
+    Write the swarm state and the state of numpy's random generator to
+    checkpoint, which is a h5py group or a file name.
+    """
+    import h5py
+    if isinstance(checkpoint, str):
+        with h5py.File(checkpoint, 'a') as f:
+            _save_state(f.require_group('pso_state'), state)
+        return
+    for name in _state_names + ['rng_keys']:
+        if name in checkpoint:
+            del checkpoint[name]
+    for name in _state_names:
+        checkpoint.create_dataset(name, data=state[name])
+    kind, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    checkpoint.create_dataset('rng_keys', data=keys)
+    checkpoint.attrs['rng_pos'] = pos
+    checkpoint.attrs['rng_has_gauss'] = has_gauss
+    checkpoint.attrs['rng_cached_gaussian'] = cached_gaussian
+    checkpoint.file.flush()
+
+def _load_state(checkpoint):
+    """
+    Counterpart of _save_state. Returns None if there is no saved state.
+    Restores the state of numpy's random generator.
+    """
+    import h5py
+    if isinstance(checkpoint, str):
+        import os
+        if not os.path.isfile(checkpoint):
+            return None
+        with h5py.File(checkpoint, 'r') as f:
+            return _load_state(f['pso_state']) if 'pso_state' in f else None
+    if not all(name in checkpoint for name in _state_names + ['rng_keys']):
+        return None
+    state = dict((name, np.asarray(checkpoint[name])) for name in _state_names)
+    state['fg'] = float(state['fg'])
+    state['it'] = int(state['it'])
+    np.random.set_state(('MT19937', np.asarray(checkpoint['rng_keys']),
+                         int(checkpoint.attrs['rng_pos']),
+                         int(checkpoint.attrs['rng_has_gauss']),
+                         float(checkpoint.attrs['rng_cached_gaussian'])))
+    return state
     
 def pso(func, x_0, lb, ub, ieqcons=[], f_ieqcons=None, args=(), kwargs={}, 
         swarmsize=100, omega=0.5, phip=0.5, phig=0.5, maxiter=100, 
         minstep=1e-8, minfunc=1e-8, debug=False, processes=1,
-        particle_output=False, use_initial_guess=False):
+        particle_output=False, use_initial_guess=False,
+        batch_func=False, executor=None, checkpoint=None, resume=False):
     """
     Perform a particle swarm optimization (PSO)
    
@@ -110,10 +158,26 @@ def pso(func, x_0, lb, ub, ieqcons=[], f_ieqcons=None, args=(), kwargs={},
         (Default: False)
     processes : int
         The number of processes to use to evaluate objective function and 
-        constraints (default: 1)
+        constraints (default: 1). The pool is closed when pso returns.
     particle_output : boolean
         Whether to include the best per-particle position and the objective
         values at those.
+    batch_func : boolean
+        If True, func is called once per iteration with the whole S x D swarm
+        and must return the S objective values (Default: False)
+    executor : object
+        Anything with a map(function, iterable) method, e.g. a
+        multiprocessing.Pool which is kept alive by the caller across calls.
+        Used to evaluate the objective function per particle instead of
+        creating a pool from ``processes`` (Default: None)
+    checkpoint : h5py group or file name
+        If given, the swarm state is saved there after every iteration,
+        replacing what was saved before (Default: None)
+    resume : boolean
+        If True and checkpoint holds a saved state, the optimization continues
+        from it; a finished optimization just returns its result. Raises
+        ValueError if the state was saved with a different swarmsize, number
+        of dimensions or bounds (Default: False)
    
     Returns
     =======
@@ -157,85 +221,113 @@ def pso(func, x_0, lb, ub, ieqcons=[], f_ieqcons=None, args=(), kwargs={},
     is_feasible = partial(_is_feasible_wrapper, cons)
 
     # Initialize the multiprocessing module if necessary
-    if processes > 1:
+    mp_pool = None
+    if executor is None and processes > 1 and not batch_func:
         import multiprocessing
         mp_pool = multiprocessing.Pool(processes)
-        
-    # Initialize the particle swarm ############################################
+        executor = mp_pool
+    try:
+        return _pso_iterate(func, obj, is_feasible, x_0, lb, ub, vlow, vhigh,
+                            args, kwargs, swarmsize, omega, phip, phig,
+                            maxiter, minstep, minfunc, debug, particle_output,
+                            use_initial_guess, batch_func, executor, checkpoint,
+                            resume)
+    finally:
+        if mp_pool is not None:
+            mp_pool.close()
+            mp_pool.join()
+
+def _pso_iterate(func, obj, is_feasible, x_0, lb, ub, vlow, vhigh,
+                 args, kwargs, swarmsize, omega, phip, phig,
+                 maxiter, minstep, minfunc, debug, particle_output,
+                 use_initial_guess, batch_func, executor, checkpoint, resume):
     S = swarmsize
     D = len(lb)  # the number of dimensions each particle has
-    
-    if use_initial_guess:# this is from thierry, use my handisch obtaine guess
-      x_vary = np.random.randn(S, D)  # particle positions
-      x_vary = 0.2*x_vary
-      x_vary_absolut = x_vary*(ub-lb)
-      #replicate inital guess
-      x = np.asarray([x_0,]*S)    
-      # Initialize the particle's position
-      x = x + x_vary_absolut
-    else:# this was before, dont us x_0
-      x = np.random.rand(S, D) # particle positions
-      # Initialize the particle's position
-      x = lb + x*(ub - lb)
-      
-    v = np.zeros_like(x)  # particle velocities
-    p = np.zeros_like(x)  # best particle positions
-    fx = np.zeros(S)  # current particle function values
-    fs = np.zeros(S, dtype=bool)  # feasibility of each particle
-    fp = np.ones(S)*np.inf  # best particle function values
-    g = []  # best swarm position
-    fg = np.inf  # best swarm position starting value
-
-    # Calculate objective and constraints for each particle
-    if processes > 1:
-        fx = np.array(mp_pool.map(obj, x))
-        fs = np.array(mp_pool.map(is_feasible, x))
-    else:
-        for i in range(S):
-            fx[i] = obj(x[i, :])
-            fs[i] = is_feasible(x[i, :])
-       
-    # Store particle's best position (if constraints are satisfied)
-    i_update = np.logical_and((fx < fp), fs)
-    p[i_update, :] = x[i_update, :].copy()
-    fp[i_update] = fx[i_update]
-
-    # Update swarm's best position
-    i_min = np.argmin(fp)
-    if fp[i_min] < fg:
-        fg = fp[i_min]
-        g = p[i_min, :].copy()
+
+    def evaluate(x):
+        # Calculate objective and constraints for each particle
+        if batch_func:
+            fx = np.asarray(func(x, *args, **kwargs), dtype=float).reshape(S)
+            fs = np.array([is_feasible(xi) for xi in x], dtype=bool)
+        elif executor is not None:
+            fx = np.array(executor.map(obj, x), dtype=float)
+            fs = np.array(executor.map(is_feasible, x), dtype=bool)
+        else:
+            # interleaved, because constraints may depend on the last objective evaluation
+            fx = np.zeros(S)
+            fs = np.zeros(S, dtype=bool)
+            for i in range(S):
+                fx[i] = obj(x[i, :])
+                fs[i] = is_feasible(x[i, :])
+        return fx, fs
+
+    def save(it):
+        if checkpoint is not None:
+            _save_state(checkpoint, dict(x=x, v=v, p=p, fx=fx, fs=fs, fp=fp, g=g, fg=fg, it=it, lb=lb, ub=ub))
+
+    state = _load_state(checkpoint) if (checkpoint is not None and resume) else None
+    if state is not None:
+        if state['x'].shape != (S, D) or not (np.array_equal(state['lb'], lb) and np.array_equal(state['ub'], ub)):
+            raise ValueError('Cannot resume: the checkpoint was saved with swarmsize {:}, bounds {:} and {:}'\
+                .format(len(state['x']), state['lb'], state['ub']))
+        x, v, p, fx, fs, fp, g, fg, it = [state[name] for name in _state_names[:-2]]
+        if debug:
+            print('Resuming from checkpoint after iteration {:}'.format(it))
+        it += 1
     else:
-        # At the start, there may not be any feasible starting point, so just
-        # give it a temporary "best" point since it's likely to change
-        g = x[0, :].copy()
-       
-    # Initialize the particle's velocity
-    v = vlow + np.random.rand(S, D)*(vhigh - vlow)
-       
+        # Initialize the particle swarm ####################################
+        if use_initial_guess:# this is from thierry, use my handisch obtaine guess
+          x_vary = np.random.randn(S, D)  # particle positions
+          x_vary = 0.2*x_vary
+          x_vary_absolut = x_vary*(ub-lb)
+          #replicate inital guess
+          x = np.asarray([x_0,]*S)    
+          # Initialize the particle's position
+          x = x + x_vary_absolut
+        else:# this was before, dont us x_0
+          x = np.random.rand(S, D) # particle positions
+          # Initialize the particle's position
+          x = lb + x*(ub - lb)
+
+        p = np.zeros_like(x)  # best particle positions
+        fp = np.ones(S)*np.inf  # best particle function values
+        g = []  # best swarm position
+        fg = np.inf  # best swarm position starting value
+
+        fx, fs = evaluate(x)
+
+        # Store particle's best position (if constraints are satisfied)
+        i_update = np.logical_and((fx < fp), fs)
+        p[i_update, :] = x[i_update, :].copy()
+        fp[i_update] = fx[i_update]
+
+        # Update swarm's best position
+        i_min = np.argmin(fp)
+        if fp[i_min] < fg:
+            fg = fp[i_min]
+            g = p[i_min, :].copy()
+        else:
+            # At the start, there may not be any feasible starting point, so just
+            # give it a temporary "best" point since it's likely to change
+            g = x[0, :].copy()
+
+        # Initialize the particle's velocity
+        v = vlow + np.random.rand(S, D)*(vhigh - vlow)
+        save(0)
+        it = 1
+
     # Iterate until termination criterion met ##################################
-    it = 1
     while it <= maxiter:
         rp = np.random.uniform(size=(S, D))
         rg = np.random.uniform(size=(S, D))
 
         # Update the particles velocities
         v = omega*v + phip*rp*(p - x) + phig*rg*(g - x)
-        # Update the particles' positions
-        x = x + v
-        # Correct for bound violations
-        maskl = x < lb
-        masku = x > ub
-        x = x*(~np.logical_or(maskl, masku)) + lb*maskl + ub*masku
+        # Update the particles' positions and correct for bound violations
+        x = np.clip(x + v, lb, ub)
 
         # Update objectives and constraints
-        if processes > 1:
-            fx = np.array(mp_pool.map(obj, x))
-            fs = np.array(mp_pool.map(is_feasible, x))
-        else:
-            for i in range(S):
-                fx[i] = obj(x[i, :])
-                fs[i] = is_feasible(x[i, :])
+        fx, fs = evaluate(x)
 
         # Store particle's best position (if constraints are satisfied)
         i_update = np.logical_and((fx < fp), fs)
@@ -272,6 +364,7 @@ def pso(func, x_0, lb, ub, ieqcons=[], f_ieqcons=None, args=(), kwargs={},
 
         if debug:
             print('Best after iteration {:}: {:} {:}'.format(it, g, fg))
+        save(it)
         it += 1
 
     print('Stopping search: maximum iterations reached --> {:}'.format(maxiter))
@@ -295,8 +388,15 @@ if __name__ == '__main__':
       x2 = x[1]
       return [-(x1 + 0.25)**2 + 0.75*x2]
 
+  def banana_batch(x):
+    x1 = x[:,0]
+    x2 = x[:,1]
+    return x1**4 - 2*x2*x1**2 + x2**2 + x1**2 - 2*x1 + 5
+
   lb = [-3, -1]
   ub = [2, 6]
   x_0= [0,0]
   
   xopt, fopt = pso(banana, x_0, lb, ub, f_ieqcons=con, debug=True)
+  xopt, fopt = pso(banana_batch, x_0, lb, ub, f_ieqcons=con, batch_func=True)
+  print(xopt, fopt)
@@ -30,6 +30,9 @@ import subprocess
 import math
 import time
 import re
+import imp
+import tempfile
+import shutil
 
 def printClientInfo():
   import socket
@@ -37,7 +40,7 @@ def printClientInfo():
   print('invoked by: %s' % sys._getframe(1).f_code.co_name)
   print('cwd: %s' % os.getcwd())
 
-__all__ = [ 'parse_args', 'submit', 'exe', 'func', 'is_client']
+__all__ = [ 'parse_args', 'submit', 'submit_array', 'exe', 'func', 'is_client']
 
 ''' globals '''
 defaultMemory = '1MB'
@@ -120,7 +123,7 @@ def fmtDate_(days, hours):
     return days, hours
     
 
-def write_directives_qsub_(f,name=None, days=None, hours=None, num_cpus=1, outdir=None, export_env=False, jobfiledir=None, change_cwd=False, dependsOnJob = None):
+def write_directives_qsub_(f,name=None, days=None, hours=None, num_cpus=1, outdir=None, export_env=False, jobfiledir=None, change_cwd=False, dependsOnJob = None, array_size = None, max_concurrent = None):
   mem =goodArgumentsQueue.memory  
   print >>f, '#PBS -j oe'
   if jobfiledir and not outdir: #DEPRECATED
@@ -143,9 +146,11 @@ def write_directives_qsub_(f,name=None, days=None, hours=None, num_cpus=1, outdi
     print >>f, '#PBS -V'
   if dependsOnJob:
     print >>f, '#PBS -W depend=afterok:%s' % dependsOnJob
+  if array_size:
+    print >>f, '#PBS -t 0-%i%s' % (array_size-1, ('%%%i' % max_concurrent) if max_concurrent else '')
     
     
-def write_directives_slurm_(f, name=None, days=None, hours=None, num_cpus=1, outdir=None, export_env=False, jobfiledir=None, change_cwd=False):
+def write_directives_slurm_(f, name=None, days=None, hours=None, num_cpus=1, outdir=None, export_env=False, jobfiledir=None, change_cwd=False, array_size = None, max_concurrent = None):
   #print >>f, '#PBS -j oe'
   #if jobfiledir and not outdir: #DEPRECATED
   #  outdir = jobfiledir
@@ -175,15 +180,128 @@ def write_directives_slurm_(f, name=None, days=None, hours=None, num_cpus=1, out
     if re.match(r'^\d+(kB|MB|GB)$', mem) is None:
       raise RuntimeError('mem argument needs integer number plus one of kB, MB, GB')
     print >>f, '#SBATCH --mem=%s' % mem
+  if array_size:
+    print >>f, '#SBATCH --array=0-%i%s' % (array_size-1, ('%%%i' % max_concurrent) if max_concurrent else '')
   #if export_env:
   #  print >>f, '#PBS -V'
 
 
-def submit_(interpreter, submission_program, script):
+class LocalJob(object):
+  def __init__(self, number, name, cmd, num_cpus, logbase):
+    self.number, self.name, self.cmd, self.num_cpus = number, name, cmd, num_cpus
+    self.stdout, self.stderr = logbase+'.out', logbase+'.err'
+    self.process = None
+    self.returncode = None
+    self.start_time = self.end_time = None
+
+  @property
+  def runtime(self):
+    if self.start_time is None:
+      return 0.
+    return (self.end_time or time.time()) - self.start_time
+
+
+class LocalExecutor(object):
+  '''
+    Runs jobs as subprocesses on this machine in place of a queuing system.
+    Jobs are started in submission order as long as the sum of their
+    num_cpus stays within max_cpus. Otherwise submission blocks until
+    enough running jobs have finished. Stdout and stderr of each job go
+    to <logdir>/<name>.<number>.out/.err. A summary of exit codes and
+    runtimes is written to <logdir>/summary.txt by wait().
+
+    max_cpus defaults to env. var. QSUB_LOCAL_CPUS or the number of cores.
+    logdir defaults to env. var. QSUB_LOCAL_LOGDIR or ./qsub-local-logs.
+  '''
+  poll_interval = 0.2
+
+  def __init__(self, max_cpus = None, logdir = None):
+    if max_cpus is None:
+      max_cpus = os.environ.get('QSUB_LOCAL_CPUS', None)
+    if not max_cpus:
+      import multiprocessing
+      max_cpus = multiprocessing.cpu_count()
+    self.max_cpus = max(1, int(max_cpus))
+    self.logdir = os.path.abspath(logdir or os.environ.get('QSUB_LOCAL_LOGDIR', 'qsub-local-logs'))
+    self.jobs = []
+    self.running = []
+
+  def used_cpus_(self):
+    return sum(j.num_cpus for j in self.running)
+
+  def poll_(self):
+    still_running = []
+    for j in self.running:
+      j.returncode = j.process.poll()
+      if j.returncode is None:
+        still_running.append(j)
+      else:
+        j.end_time = time.time()
+        j.process = None
+        if j.returncode != 0:
+          print('qsub.py: local job %s.%i failed with exit code %i, see %s' % (j.name, j.number, j.returncode, j.stderr))
+    self.running = still_running
+
+  def submit(self, cmd, name = 'unnamed', num_cpus = 1):
+    '''cmd - argument list for subprocess.Popen. Returns a LocalJob.'''
+    if not os.path.isdir(self.logdir):
+      os.makedirs(self.logdir)
+    # a job wider than the machine runs alone
+    num_cpus = min(max(1, int(num_cpus)), self.max_cpus)
+    number = len(self.jobs)
+    job = LocalJob(number, name, cmd, num_cpus, os.path.join(self.logdir, '%s.%i' % (name, number)))
+    self.jobs.append(job)
+    while True:
+      self.poll_()
+      if self.used_cpus_() + num_cpus <= self.max_cpus:
+        break
+      time.sleep(self.poll_interval)
+    env = dict(os.environ, OMP_NUM_THREADS = str(num_cpus))
+    with open(job.stdout, 'w') as out, open(job.stderr, 'w') as err:
+      job.start_time = time.time()
+      job.process = subprocess.Popen(cmd, stdout = out, stderr = err, env = env)
+    self.running.append(job)
+    if goodArgumentsQueue.q_verbose:
+      print('qsub.py: started local job %s.%i using %i cpus' % (name, number, num_cpus))
+    return job
+
+  def wait(self):
+    '''wait for all jobs and write the summary. Returns the number of failed jobs.'''
+    while self.running:
+      self.poll_()
+      if self.running:
+        time.sleep(self.poll_interval)
+    if not self.jobs:
+      return 0
+    failed = sum(1 for j in self.jobs if j.returncode != 0)
+    with open(os.path.join(self.logdir, 'summary.txt'), 'w') as f:
+      print >>f, '#%5s %8s %5s %12s  %s' % ('job', 'exitcode', 'cpus', 'runtime[s]', 'name')
+      for j in self.jobs:
+        print >>f, '%6i %8i %5i %12.1f  %s' % (j.number, j.returncode, j.num_cpus, j.runtime, j.name)
+    print('qsub.py: %i local jobs finished, %i failed, summary in %s' % (len(self.jobs), failed, os.path.join(self.logdir, 'summary.txt')))
+    return failed
+
+
+local_executor_ = None
+
+def get_local_executor():
+  '''the executor used for run_locally; created on first use and waited for at exit'''
+  global local_executor_
+  if local_executor_ is None:
+    import atexit
+    local_executor_ = LocalExecutor()
+    atexit.register(local_executor_.wait)
+  return local_executor_
+
+
+def submit_(interpreter, submission_program, script, name = 'unnamed', num_cpus = 1):
   global opts_
   # determine how to run
   if submission_program == 'run_locally':
     submission_program = interpreter
+    run_locally = True
+  else:
+    run_locally = False
   # verbose output
   if goodArgumentsQueue.q_verbose or goodArgumentsQueue.q_dry:
     print (' submission to %s ' % submission_program).center(30,'-')
@@ -191,12 +309,18 @@ def submit_(interpreter, submission_program, script):
     print ''.center(30,'-')
   # run stuff
   if not goodArgumentsQueue.q_dry:
+    if run_locally:
+      executor = get_local_executor()
+      if not os.path.isdir(executor.logdir):
+        os.makedirs(executor.logdir)
+      # named like the log files of the job
+      scriptfilename = os.path.join(executor.logdir, '%s.%i.%s' % (name, len(executor.jobs), 'py' if interpreter == 'python' else 'sh'))
+      with open(scriptfilename, 'w') as f:
+        f.write(script)
+      return executor.submit([sys.executable if interpreter == 'python' else '/bin/sh', scriptfilename], name, num_cpus)
     time.sleep(0.2)
-    if submission_program == 'python': # running python script with python locally?!! We can do it like so
-      exec script in dict(), dict()
-    else: # all the other cases go like so!
-      subprocess.call("%s <<EOFQSUB\n%s\nEOFQSUB" % (submission_program, script), shell=True)
-      #subprocess.check_output("%s <<EOFQSUB\n%s\nEOFQSUB" % (submission_program, script), shell=True)
+    subprocess.call("%s <<EOFQSUB\n%s\nEOFQSUB" % (submission_program, script), shell=True)
+    #subprocess.check_output("%s <<EOFQSUB\n%s\nEOFQSUB" % (submission_program, script), shell=True)
 
 pyfuncscript_ = """\
 import imp as imp__
@@ -237,10 +361,7 @@ class Func(object):
     self.args = (args, kwargs)
     self.name_hint = func.__name__
 
-  def generate_script(self, qsubopts):
-    func, (args, kwargs) = self.func, self.args
-    # generate the python script
-    a = base64.urlsafe_b64encode(cPickle.dumps((args,kwargs)))
+  def module_filename_(self):
     # doesn't work so well because if the module is not the main module,
     # the __module__ variable can point to something else than the file 
     # where func is defined. Example: /py/krebsjobs/__init__.pyc instead
@@ -248,8 +369,14 @@ class Func(object):
     #   m = __import__(func.__module__)
     #   filename = os.path.abspath(m.__file__)
     # next try:
-    filename = func.__globals__['__file__']  # seems simple enough?! '__globals__' just contains the global variables that the function sees.
-    filename = os.path.abspath(filename) # don't want to get in trouble because of changing work dir
+    filename = self.func.__globals__['__file__']  # seems simple enough?! '__globals__' just contains the global variables that the function sees.
+    return os.path.abspath(filename) # don't want to get in trouble because of changing work dir
+
+  def generate_script(self, qsubopts):
+    func, (args, kwargs) = self.func, self.args
+    # generate the python script
+    a = base64.urlsafe_b64encode(cPickle.dumps((args,kwargs)))
+    filename = self.module_filename_()
     functionname = func.__name__
     if filename.endswith('.pyc'):
       load_string = "your_module__ = imp__.load_compiled('your_module__', '%s')" % filename
@@ -260,6 +387,17 @@ class Func(object):
       s = (pychangecwd_ % os.getcwd()) + s
     return s
 
+  def generate_payload(self, qsubopts):
+    '''task description for job arrays, see submit_array'''
+    return dict(
+      interpreter = self.interpreter,
+      name = self.name_hint,
+      filename = self.module_filename_(),
+      functionname = self.func.__name__,
+      args = cPickle.dumps(self.args, cPickle.HIGHEST_PROTOCOL), # unpickled after the module is loaded
+      cwd = os.getcwd() if qsubopts.get('change_cwd', False) else None,
+    )
+
 func = Func
 
 
@@ -287,6 +425,12 @@ class Exe(object):
     if qsubopts.get('change_cwd', False):
       lines = [ 'cd %s' % os.getcwd() ] + lines
     return '\n'.join(lines)
+  def generate_payload(self, qsubopts):
+    return dict(
+      interpreter = self.interpreter,
+      name = self.name_hint,
+      script = self.generate_script(qsubopts),
+    )
 
 exe = Exe
 
@@ -346,7 +490,7 @@ def submit_qsub(obj, submission_program, **qsubopts):
   print >>f, first_line
   write_directives_qsub_(f, **qsubopts)
   print >>f, obj.generate_script(qsubopts)
-  return submit_(obj.interpreter, submission_program, f.getvalue())
+  return submit_(obj.interpreter, submission_program, f.getvalue(), qsubopts['name'], qsubopts.get('num_cpus', 1))
   
 
 def submit_slurm(obj, submission_program, **slurmopts):
@@ -397,6 +541,121 @@ def submit_slurm(obj, submission_program, **slurmopts):
         submit_('sh', submission_program, f.getvalue())
 
 
+arrayscript_ = """\
+#!/bin/sh
+%s
+TASK_ID=${SLURM_ARRAY_TASK_ID:-${PBS_ARRAYID:-$PBS_ARRAY_INDEX}}
+exec python%i %s --array-task %s $TASK_ID
+"""
+
+
+def run_array_task_(filename, index):
+  '''
+    Runs task number index from a job array side file written by submit_array.
+    Returns an exit code.
+  '''
+  global is_client
+  is_client = True
+  with open(filename, 'rb') as f:
+    tasks = cPickle.load(f)
+  try:
+    return run_task_(tasks[index])
+  finally:
+    mark_array_task_done_(filename, index, len(tasks))
+
+
+def mark_array_task_done_(filename, index, num_tasks):
+  '''the directory of the side file is deleted when all tasks have run, successful or not'''
+  directory = os.path.dirname(filename)
+  open(os.path.join(directory, 'done-%i' % index), 'w').close()
+  if sum(1 for n in os.listdir(directory) if n.startswith('done-')) >= num_tasks:
+    shutil.rmtree(directory, ignore_errors = True)
+
+
+def run_task_(task):
+  if task['interpreter'] == 'sh':
+    return subprocess.call(['/bin/sh', '-c', task['script']])
+  if task['cwd']:
+    os.chdir(task['cwd'])
+  if task['filename'].endswith('.pyc'):
+    module = imp.load_compiled('your_module__', task['filename'])
+  else:
+    module = imp.load_source('your_module__', task['filename'])
+  # pickled arguments may refer to things defined in the submitting
+  # script, which was __main__ at submission time
+  main = sys.modules['__main__']
+  for k, v in vars(module).iteritems():
+    if not k.startswith('__') and not hasattr(main, k):
+      setattr(main, k, v)
+  args, kwargs = cPickle.loads(task['args'])
+  getattr(module, task['functionname'])(*args, **kwargs)
+  return 0
+
+
+def submit_array(objs, submission_program, **qsubopts):
+  '''
+    Submit a list of Func/Exe objects as one array job (sbatch --array or
+    PBS -t). The payloads of all tasks go into one pickled side file in a
+    temporary directory in outdir (or the current directory), which is
+    deleted when all tasks have run. Each task runs
+    "qsub.py --array-task <side file> <task index>". The job script is
+    deleted once the submission program has read it.
+
+    qsubopts are the same as for submit and apply to each task. In addition
+      max_concurrent -> max. number of tasks running at the same time (int)
+
+    When running locally the tasks go to the LocalExecutor, and the
+    LocalJob objects are returned.
+  '''
+  objs = list(objs)
+  if not objs:
+    return
+  if not 'name' in qsubopts:
+    qsubopts['name'] = objs[0].name_hint or 'unnamed'
+  payloads = [ obj.generate_payload(qsubopts) for obj in objs ]
+  qsubopts['array_size'] = len(payloads)
+  directory = os.path.abspath(qsubopts.get('outdir', None) or os.getcwd())
+  if goodArgumentsQueue.q_dry:
+    tmpdir = os.path.join(directory, '%s-XXXXXX.qsubarray' % qsubopts['name'])
+  else:
+    tmpdir = tempfile.mkdtemp(prefix = qsubopts['name']+'-', suffix = '.qsubarray', dir = directory)
+  filename = os.path.join(tmpdir, 'tasks.pickle')
+  if not goodArgumentsQueue.q_dry:
+    with open(filename, 'wb') as f:
+      cPickle.dump(payloads, f, cPickle.HIGHEST_PROTOCOL)
+  f = cStringIO.StringIO()
+  if submission_program == 'sbatch':
+    write_directives_slurm_(f, **qsubopts)
+  else:
+    write_directives_qsub_(f, **qsubopts)
+  qsubpy = os.path.abspath(__file__)
+  if qsubpy.endswith('.pyc'):
+    qsubpy = qsubpy[:-1]
+  script = arrayscript_ % (f.getvalue().rstrip('\n'), sys.version_info.major, qsubpy, filename)
+  if goodArgumentsQueue.q_verbose or goodArgumentsQueue.q_dry:
+    print (' array of %i tasks to %s ' % (len(payloads), submission_program)).center(30,'-')
+    print script
+    for i, p in enumerate(payloads):
+      print '%i: %s' % (i, p['name'] or p.get('script', ''))
+    print ''.center(30,'-')
+  if goodArgumentsQueue.q_dry:
+    return
+  if submission_program == 'run_locally':
+    executor = get_local_executor()
+    return [ executor.submit([sys.executable, qsubpy, '--array-task', filename, str(i)], '%s-%i' % (qsubopts['name'], i), qsubopts.get('num_cpus', 1))
+             for i in xrange(len(payloads)) ]
+  scriptfilename = os.path.join(tmpdir, 'job.sh')
+  with open(scriptfilename, 'w') as f:
+    f.write(script)
+  # submitted as file, not as here-document, because $TASK_ID must not be expanded by the submitting shell
+  try:
+    ret = subprocess.call([submission_program, scriptfilename])
+  finally:
+    os.remove(scriptfilename) # sbatch and qsub keep their own copy
+  if ret != 0:
+    shutil.rmtree(tmpdir, ignore_errors = True)
+
+
 def submit(obj, **qsubopts):
     if 'mem' in qsubopts and goodArgumentsQueue.memory == defaultMemory:
       print('Memory setting provided by program')
@@ -412,6 +671,8 @@ def submit(obj, **qsubopts):
     #print(defaultMemory)
     
     prog = determine_submission_program_()
+    if isinstance(obj, (list, tuple)):
+      return submit_array(obj, prog, **qsubopts)
     if prog == 'sbatch':
       submit_slurm(obj, prog, **qsubopts)
     elif prog == 'qsub':
@@ -421,3 +682,9 @@ def submit(obj, **qsubopts):
     else:
       print("unknow submission sytem")
       
+
+
+if __name__ == '__main__':
+  if len(sys.argv) == 4 and sys.argv[1] == '--array-task':
+    import qsub # so that the client sees qsub.is_client set
+    sys.exit(qsub.run_array_task_(sys.argv[2], int(sys.argv[3])))
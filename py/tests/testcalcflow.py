@@ -0,0 +1,212 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import krebsutils
+
+
+def make_grid_edges_(nx, ny):
+  '''edges of a nx x ny grid of nodes, node index = x*ny+y'''
+  edges = []
+  for x in range(nx):
+    for y in range(ny):
+      i = x*ny+y
+      if x < nx-1: edges.append((i, i+ny))
+      if y < ny-1: edges.append((i, i+1))
+  return np.asarray(edges, dtype = np.int32)
+
+
+def write_grid_(g, nx = 8, ny = 6, num_isolated = 0, seed = 0):
+  '''
+    a REALWORLD vessel group: a grid of capillaries with random radii, an
+    inlet at one corner and outlets at the two adjacent corners, and
+    num_isolated uncirculated vessels which are not connected to the grid
+  '''
+  rnd = np.random.RandomState(seed)
+  num_nodes = nx*ny + 2*num_isolated
+  edges = make_grid_edges_(nx, ny)
+  num_grid_edges = len(edges)
+  edges = np.concatenate((edges, np.arange(nx*ny, num_nodes, dtype = np.int32).reshape((-1,2))))
+  pos = np.zeros((num_nodes, 3), dtype = np.float32)
+  pos[:nx*ny,0] = np.repeat(np.arange(nx), ny)*50.
+  pos[:nx*ny,1] = np.tile(np.arange(ny), nx)*50.
+  pos[nx*ny:,0] = np.arange(2*num_isolated)*50.
+  pos[nx*ny:,2] = 100.
+  roots = np.asarray([0, ny-1, (nx-1)*ny], dtype = np.int32)
+  pressure = np.full(num_nodes, 2., dtype = np.float32)
+  pressure[roots] = (4., 1., 1.5)
+  g.attrs['CLASS'] = 'REALWORLD'
+  gn = g.create_group('nodes')
+  gn.attrs['COUNT'] = num_nodes
+  gn['world_pos'] = pos
+  gn['roots'] = roots
+  gn['pressure'] = pressure
+  gn['bc_node_index'] = roots
+  gn['bc_type'] = np.full(len(roots), krebsutils.FLOWBC_PIN, dtype = np.int32)
+  gn['bc_value'] = pressure[roots]
+  gn['bc_conductivity_value'] = np.zeros(len(roots), dtype = np.float32)
+  ge = g.create_group('edges')
+  ge.attrs['COUNT'] = len(edges)
+  ge['node_a_index'] = edges[:,0]
+  ge['node_b_index'] = edges[:,1]
+  ge['radius'] = rnd.uniform(3., 8., len(edges)).astype(np.float32)
+  flags = np.full(len(edges), krebsutils.CIRCULATED | krebsutils.CONNECTED | krebsutils.CAPILLARY, dtype = np.int32)
+  flags[num_grid_edges:] = krebsutils.CAPILLARY
+  ge['flags'] = flags
+  return g
+
+
+def node_balance_(num_nodes, edges, pressure, q):
+  '''net inflow of q into each node, q flows from the higher to the lower pressure'''
+  a, b = edges[:,0], edges[:,1]
+  sign = np.where(pressure[a] > pressure[b], 1., -1.)
+  return np.bincount(b, sign*q, num_nodes) - np.bincount(a, sign*q, num_nodes)
+
+
+class GridTestCase(unittest.TestCase):
+  num_isolated = 0
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testcalcflow')
+    self.f = h5py.File(join(self.dir, 'vessels.h5'), 'w')
+    self.vesselgroup = write_grid_(self.f.create_group('vessels'), num_isolated = self.num_isolated)
+    self.edges = np.asarray([ self.vesselgroup['edges/node_a_index'], self.vesselgroup['edges/node_b_index'] ]).T
+    self.num_nodes = self.vesselgroup['nodes'].attrs['COUNT']
+    self.internal = np.setdiff1d(np.arange(self.num_nodes), self.vesselgroup['nodes/roots'])
+
+  def tearDown(self):
+    self.f.close()
+    shutil.rmtree(self.dir, True)
+
+
+class TestHematocrit(GridTestCase):
+  def test_rbc_conservation(self):
+    # the hematocrit of a vessel is computed after those of the vessels
+    # feeding it, else the rbc flux would not balance at the nodes
+    bloodflowparams = dict(inletHematocrit = 0.45, includePhaseSeparationEffect = True)
+    pressure, flow, shearforce, hema = krebsutils.calc_vessel_hydrodynamics(self.vesselgroup, bloodflowparams = bloodflowparams)
+    self.assertTrue(np.all((hema >= 0.) & (hema < 1.)))
+    self.assertTrue(np.all(hema[flow > 0.] > 0.))
+    inflow = node_balance_(self.num_nodes, self.edges, pressure, flow)
+    rbc = node_balance_(self.num_nodes, self.edges, pressure, flow*hema)
+    scale = np.amax(flow*hema)
+    self.assertLess(np.amax(np.abs(inflow[self.internal]))/np.amax(flow), 1.e-6)
+    self.assertLess(np.amax(np.abs(rbc[self.internal]))/scale, 1.e-3)
+    # the inlet vessel gets the inlet hematocrit
+    (inlet_edges,) = np.nonzero(np.any(self.edges == 0, axis=1))
+    self.assertTrue(np.allclose(hema[inlet_edges], 0.45, rtol = 1.e-3))
+
+  def test_deterministic(self):
+    results = [ krebsutils.calc_vessel_hydrodynamics(self.vesselgroup, calc_hematocrit = True, bloodflowparams = dict(inletHematocrit = 0.45))
+                for i in range(2) ]
+    for a, b in zip(*results):
+      self.assertTrue(np.all(a == b))
+
+
+class TestFlowSystem(unittest.TestCase):
+  def setUp(self):
+    n = 40 # large enough that the solver needs several iterations
+    self.edges = make_grid_edges_(n, n)
+    self.num_nodes = n*n
+    rnd = np.random.RandomState(0)
+    num_edges = len(self.edges)
+    self.cond = krebsutils.calc_vessel_conductivities(rnd.uniform(3., 8., num_edges), np.full(num_edges, 50.), np.full(num_edges, 0.45))
+    self.bcs = (np.asarray([0, self.num_nodes-1], dtype = np.int32), np.full(2, krebsutils.FLOWBC_PIN, dtype = np.int32),
+                np.asarray([4., 1.]), np.zeros(2))
+
+  def test_converged(self):
+    fs = krebsutils.FlowSystem(self.num_nodes, self.edges, dict())
+    press = fs.solve(self.cond, *self.bcs)
+    self.assertTrue(np.allclose(press[self.bcs[0]], self.bcs[2]))
+    self.assertTrue(np.all((press >= 1.-1.e-6) & (press <= 4.+1.e-6)))
+    a, b = self.edges[:,0], self.edges[:,1]
+    q = node_balance_(self.num_nodes, self.edges, press, self.cond*np.abs(press[a]-press[b]))
+    self.assertLess(np.amax(np.abs(q[1:-1])), 1.e-6*np.amax(np.abs(q)))
+
+  def test_not_converged(self):
+    fs = krebsutils.FlowSystem(self.num_nodes, self.edges, dict())
+    fs.max_iter = 1
+    self.assertFalse(fs.throw_on_failure) # like the solver params of calcflow
+    press = fs.solve(self.cond, *self.bcs) # returns the last iterate
+    self.assertEqual(press.shape, (self.num_nodes,))
+    self.assertTrue(np.all(np.isfinite(press)))
+    self.assertEqual(fs.num_solves, 1)
+    fs.throw_on_failure = True
+    self.assertRaises(RuntimeError, fs.solve, self.cond, *self.bcs)
+    self.assertEqual(fs.num_solves, 2)
+    # and recovers with enough iterations
+    fs.max_iter = 1000
+    press = fs.solve(self.cond, *self.bcs)
+    self.assertTrue(np.allclose(press[self.bcs[0]], self.bcs[2]))
+
+
+class TestFlowNetwork(GridTestCase):
+  num_isolated = 1
+
+  def setUp(self):
+    GridTestCase.setUp(self)
+    self.graph = krebsutils.read_vesselgraph(self.vesselgroup, ['flags', 'radius', 'position'])
+    self.bcs = krebsutils.read_flow_boundary_conditions(self.vesselgroup)
+    self.circulated = (np.asarray(self.graph.edges['flags']) & krebsutils.CIRCULATED) != 0
+    self.circulated_nodes = np.unique(self.edges[self.circulated])
+
+  def assertSameFlow(self, res, ref, rtol = 1.e-5):
+    pressure, flow, shearforce = res
+    ref_pressure, ref_flow, ref_shearforce = ref[:3]
+    self.assertTrue(np.allclose(pressure[self.circulated_nodes], ref_pressure[self.circulated_nodes], rtol = rtol))
+    self.assertTrue(np.allclose(flow, ref_flow, rtol = rtol, atol = rtol*np.amax(ref_flow)))
+    self.assertTrue(np.allclose(shearforce, ref_shearforce, rtol = rtol, atol = rtol*np.amax(ref_shearforce)))
+
+  def test_like_calcflow(self):
+    net = krebsutils.FlowNetwork(self.graph, self.bcs, dict(inletHematocrit = 0.45))
+    res = net.solve()
+    self.assertSameFlow(res, krebsutils.calc_vessel_hydrodynamics(self.vesselgroup, bloodflowparams = dict(inletHematocrit = 0.45)))
+    # no flow in the isolated vessel
+    self.assertEqual(res[1][-1], 0.)
+    self.assertEqual(res[2][-1], 0.)
+
+  def test_changed_radius(self):
+    net = krebsutils.FlowNetwork(self.graph, self.bcs, dict(inletHematocrit = 0.45))
+    net.solve()
+    radius = np.asarray(self.graph.edges['radius']) * np.random.RandomState(1).uniform(0.8, 1.2, len(self.edges))
+    radius = radius.astype(np.float32) # as calcflow reads it
+    res = net.solve(radius = radius)
+    self.assertEqual(net.flowsystem.num_solves, 2)
+    self.vesselgroup['edges/radius'][...] = radius
+    self.assertSameFlow(res, krebsutils.calc_vessel_hydrodynamics(self.vesselgroup, bloodflowparams = dict(inletHematocrit = 0.45)))
+
+  def test_phase_separation_hematocrit(self):
+    # with the hematocrit of the phase separation computation, the flow is that of the last iteration
+    ref = krebsutils.calc_vessel_hydrodynamics(self.vesselgroup, calc_hematocrit = True, bloodflowparams = dict(inletHematocrit = 0.45))
+    self.graph.edges['hematocrit'] = ref[3]
+    net = krebsutils.FlowNetwork(self.graph, self.bcs)
+    self.assertSameFlow(net.solve(), ref, rtol = 1.e-3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+'''
+  tests of the bookkeeping around the detailed o2 solver: warm starts,
+  caching and batches. The c++ solver is replaced by RecordingO2Library.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import h5files
+from krebs import detailedo2
+
+
+class RecordingO2Library(object):
+  '''writes po2 = parameters['x'] and records the initial po2 of every computation'''
+  def __init__(self):
+    self.calls = []
+
+  def compute_(self, parameters, gdst, initial):
+    self.calls.append((parameters['name'], None if initial is None else float(initial[0][0,0])))
+    gdst.create_dataset('po2vessels', data = np.full((3, 2), parameters['x'], dtype = np.float32))
+    gdst.create_dataset('po2field', data = np.full((2, 2, 2), parameters['x'], dtype = np.float32))
+    gdst.create_dataset('iterations', data = np.arange(3 if initial else 10))
+    gdst['warm_start_vessels'] = 'true' if initial else 'false'
+
+  def computePO2(self, vesselgroup, tumorgroup, parameters, calcflow, gdst, initial):
+    self.compute_(parameters, gdst, initial)
+
+  def computePO2Batch(self, vesselgroup, tumorgroup, parameters_list, calcflow, gdsts, initial, warm_start):
+    self.calls.append('batch')
+    for parameters, gdst in zip(parameters_list, gdsts):
+      self.compute_(parameters, gdst, initial)
+      if warm_start:
+        initial = detailedo2.readInitialState(gdst)
+
+
+def copy_vessels_(gvdst, gv, bloodflowparams):
+  gvdst.attrs['CLASS'] = 'GRAPH'
+  gv.copy('edges', gvdst)
+
+
+def params_(name, x, **kwargs):
+  return dict(name = name, x = x, calcflow = dict(), **kwargs)
+
+
+class O2TestCase(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testdetailedo2')
+    self.cwd = os.getcwd()
+    os.chdir(self.dir) # the results are written to the working directory
+    self.fn = join(self.dir, 'tum.h5')
+    with h5py.File(self.fn, 'w') as f:
+      f.attrs['VESSELFILE_ENSEMBLE_INDEX'] = 0
+      f.attrs['VESSELFILE_MESSAGE'] = 'test'
+      for name in ['out0000', 'out0001', 'out0002']:
+        f[name+'/vessels/edges/radius'] = np.ones(3)
+        f[name+'/tumor/ls'] = np.ones((2, 2, 2))
+    self.library = RecordingO2Library()
+    self.patched = dict(pickDetailedO2Library = lambda parameters: self.library,
+                        copyVesselnetworkAndComputeFlow = copy_vessels_)
+    self.originals = dict((k, getattr(detailedo2, k)) for k in self.patched)
+    for k, v in self.patched.iteritems():
+      setattr(detailedo2, k, v)
+
+  def tearDown(self):
+    for k, v in self.originals.iteritems():
+      setattr(detailedo2, k, v)
+    h5files.closeall()
+    os.chdir(self.cwd)
+    shutil.rmtree(self.dir, True)
+
+  def po2_(self, ref):
+    with h5py.File(ref.fn, 'r') as f:
+      return float(f[ref.path]['po2vessels'][0,0])
+
+
+class TestWarmStart(O2TestCase):
+  def test_doit_cold_by_default(self):
+    refs = detailedo2.doit(self.fn, 'out*', (params_('a', 1.), 'a'))
+    self.assertEqual(len(refs), 3)
+    self.assertEqual(self.library.calls, [('a', None)]*3)
+    with h5py.File(refs[1].fn, 'r') as f:
+      self.assertEqual(f[refs[1].path].attrs['WARM_START_SOURCE_PATH'], '')
+
+  def test_doit_warm_start(self):
+    refs = detailedo2.doit(self.fn, 'out*', (params_('a', 1.), 'a'), warm_start = True)
+    self.assertEqual(self.library.calls, [('a', None), ('a', 1.), ('a', 1.)])
+    with h5py.File(refs[1].fn, 'r') as f:
+      self.assertEqual(f[refs[1].path].attrs['WARM_START_SOURCE_PATH'], refs[0].path)
+
+  def test_sweep_order(self):
+    sets = [ (params_(n, x), n) for n, x in [('a', 1.), ('c', 3.), ('b', 1.25)] ]
+    self.assertEqual(detailedo2.orderForWarmStart(sets), [0, 2, 1])
+    res = detailedo2.computePO2Sweep(self.fn, 'out*', sets)
+    # back and forth, each run from the previous result
+    self.assertEqual([ (g, n) for g, n, _ in res ],
+                     [('out0000', 'a'), ('out0000', 'b'), ('out0000', 'c'),
+                      ('out0001', 'c'), ('out0001', 'b'), ('out0001', 'a'),
+                      ('out0002', 'a'), ('out0002', 'b'), ('out0002', 'c')])
+    calls = [ c for c in self.library.calls if c != 'batch' ]
+    self.assertEqual(calls[:4], [('a', None), ('b', 1.), ('c', 1.25), ('c', 3.)])
+    self.assertEqual([ self.po2_(ref) for _, _, ref in res ], [1., 1.25, 3., 3., 1.25, 1., 1., 1.25, 3.])
+
+  def test_read_initial_state(self):
+    refs = detailedo2.doit(self.fn, 'out*', (params_('a', 1.), 'a'), warm_start = True)
+    with h5py.File(refs[0].fn, 'r') as f:
+      po2vessels, po2field, cold_iterations = detailedo2.readInitialState(f[refs[0].path])
+      self.assertEqual(po2vessels.shape, (3, 2))
+      self.assertEqual(cold_iterations, 10)
+      # unknown for a warm started result
+      self.assertIs(detailedo2.readInitialState(f[refs[1].path])[2], None)
+
+
+class TestBatch(O2TestCase):
+  def run_batch_(self, sets, suffix = '', **kwargs):
+    cachelocations = [ ('o2_%s%s.h5' % (n, suffix), 'out0000') for _, n in sets ]
+    return detailedo2.computePO2Batch(self.fn, 'out0000', sets, cachelocations, **kwargs)
+
+  def test_like_single(self):
+    sets = [ (params_('a', 1.), 'a'), (params_('b', 2.), 'b') ]
+    batch_refs = self.run_batch_(sets, warm_start = False)
+    self.assertEqual(self.library.calls, ['batch', ('a', None), ('b', None)])
+    single_refs = [ detailedo2.computePO2(self.fn, 'out0000', p, ('o2_%s_single.h5' % n, 'out0000')) for p, n in sets ]
+    for ref1, ref2 in zip(batch_refs, single_refs):
+      with h5py.File(ref1.fn, 'r') as f1:
+        with h5py.File(ref2.fn, 'r') as f2:
+          g1, g2 = f1[ref1.path], f2[ref2.path]
+          self.assertTrue(np.all(g1['po2vessels'][...] == g2['po2vessels'][...]))
+          for name in ['VERSION', 'PARAMETER_CHECKSUM', 'SOURCE_PATH', 'SOURCE_VESSELS_PATH', 'SOURCE_TISSUE_PATH']:
+            self.assertEqual(g1.attrs[name], g2.attrs[name])
+          self.assertEqual(g1['SOURCE_VESSELS/edges/radius'].shape, (3,))
+
+  def test_split_by_grid(self):
+    sets = [ (params_('a', 1.), 'a'), (params_('b', 2., grid_lattice_const = 30.), 'b'), (params_('c', 3.), 'c') ]
+    refs = self.run_batch_(sets)
+    self.assertEqual(self.library.calls, ['batch', ('a', None), ('c', 1.), 'batch', ('b', 3.)])
+    self.assertEqual([ self.po2_(ref) for ref in refs ], [1., 2., 3.])
+
+  def test_cached(self):
+    sets = [ (params_('a', 1.), 'a'), (params_('b', 2.), 'b') ]
+    self.run_batch_(sets[:1])
+    del self.library.calls[:]
+    refs = self.run_batch_(sets)
+    self.assertEqual(self.library.calls, ['batch', ('b', None)])
+    del self.library.calls[:]
+    self.assertEqual(self.run_batch_(sets), refs)
+    self.assertEqual(self.library.calls, [])
+
+  def test_failure(self):
+    sets = [ (params_('a', 1.), 'a'), (params_('b', 2.), 'b') ]
+    compute = self.library.compute_
+    def fail_on_b(parameters, gdst, initial):
+      compute(parameters, gdst, initial)
+      if parameters['name'] == 'b':
+        raise RuntimeError('solver failed')
+    self.library.compute_ = fail_on_b
+    self.assertRaises(RuntimeError, self.run_batch_, sets)
+    # the result of a, which was written, is not kept without the rest of its batch
+    with h5py.File('o2_a.h5', 'r') as f:
+      self.assertNotIn('out0000', f['po2'])
+    self.library.compute_ = compute
+    del self.library.calls[:]
+    self.run_batch_(sets)
+    self.assertEqual(self.library.calls, ['batch', ('a', None), ('b', 1.)])
+
+
+if __name__ == '__main__':
+  unittest.main()
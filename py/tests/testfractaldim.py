@@ -0,0 +1,71 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import unittest
+import numpy as np
+from krebs import fractaldim
+
+
+def boxcount_dense_(coords, volume, boxsize, max_boxsize, area):
+  '''reference for boxcountSparse by brute force on the dense lattice'''
+  n = np.amax(coords, axis=0) + 1
+  dense = np.zeros(n)
+  np.add.at(dense, tuple(coords.T), volume)
+  res = []
+  k = 0
+  while k == 0 or boxsize*2.**k < max_boxsize:
+    b = 2**k
+    cnt = 0.
+    offsets = [(0,0,0)] if k == 0 else list(np.ndindex((2,2,2)))
+    for o in offsets:
+      boxes = {}
+      for p in np.ndindex(*n):
+        if dense[p] == 0.:
+          continue
+        key = tuple((np.asarray(p) + np.asarray(o)*b//2)//b)
+        boxes[key] = boxes.get(key, 0.) + dense[p]
+      cnt += sum(1 for v in boxes.values() if v > area*boxsize*b)
+    res.append((boxsize*b, cnt/len(offsets)))
+    k += 1
+  return np.asarray(res, dtype=np.double).transpose()
+
+
+class TestBoxcountSparse(unittest.TestCase):
+  def test_like_dense(self):
+    rnd = np.random.RandomState(1)
+    coords = rnd.randint(0, 12, size=(300, 3))
+    volume = rnd.uniform(0., 60., size=300)
+    res = fractaldim.boxcountSparse(coords, volume, 1., 10., area = 25.)
+    ref = boxcount_dense_(coords, volume, 1., 10., 25.)
+    self.assertEqual(res.shape, ref.shape)
+    self.assertTrue(np.allclose(res, ref))
+
+  def test_empty(self):
+    res = fractaldim.boxcountSparse(np.zeros((0, 3), dtype = np.int64), np.zeros((0,)), 1., 10.)
+    self.assertEqual(res.shape, (2, 1))
+    self.assertEqual(res[1,0], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import h5files
+
+
+class TestH5Files(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testh5files')
+    with h5py.File(join(self.dir, 'target.h5'), 'w') as f:
+      f['data'] = [1, 2, 3]
+    for name in ['src', 'other1', 'other2']:
+      with h5py.File(join(self.dir, name+'.h5'), 'w') as f:
+        f['link'] = h5py.ExternalLink('target.h5', 'data')
+    self.pools = []
+
+  def tearDown(self):
+    for pool in self.pools:
+      pool.closeall()
+    shutil.rmtree(self.dir, True)
+
+  def pool_(self, max_open):
+    pool = h5files.H5Files(max_open = max_open)
+    self.pools.append(pool)
+    return pool
+
+  def test_refcounts(self):
+    pool = self.pool_(0)
+    f1 = pool.open(join(self.dir, 'src.h5'))
+    f2 = pool.open(join(self.dir, 'src.h5'))
+    self.assertIs(f1, f2)
+    self.assertEqual(len(pool.files), 1)
+    pool.close(f1)
+    self.assertTrue(f2.id.valid)
+    pool.close(f2)
+    self.assertFalse(f2.id.valid)
+    self.assertFalse(pool.files)
+
+  def test_keep_open_and_evict(self):
+    pool = self.pool_(1)
+    f = pool.open(join(self.dir, 'src.h5'))
+    pool.close(f)
+    self.assertTrue(f.id.valid) # kept for reuse
+    self.assertIs(pool.open(join(self.dir, 'src.h5')), f)
+    pool.close(f)
+    g = pool.open(join(self.dir, 'other1.h5'))
+    pool.close(g)
+    self.assertFalse(f.id.valid) # least recently used unused file
+    self.assertTrue(g.id.valid)
+    self.assertEqual(len(pool.files), 1)
+
+  def test_link_targets_stay_open(self):
+    pool = self.pool_(1)
+    src = pool.open(join(self.dir, 'src.h5'))
+    data = pool.openLink(src, 'link')
+    pool.openLink(src, 'link') # counted once per source file
+    # opening other files must not evict the target while src is in use
+    for name in ['other1', 'other2']:
+      pool.close(pool.open(join(self.dir, name+'.h5')))
+    self.assertTrue(data.id.valid)
+    self.assertEqual(list(data[...]), [1, 2, 3])
+    pool.close(src)
+    pool.close(pool.open(join(self.dir, 'other1.h5')))
+    self.assertFalse(data.id.valid) # released together with src
+
+  def test_link_targets_closed_without_pooling(self):
+    pool = self.pool_(0)
+    src = pool.open(join(self.dir, 'src.h5'))
+    data = pool.openLink(src, 'link')
+    pool.close(src)
+    self.assertFalse(data.id.valid)
+    self.assertFalse(pool.files)
+
+  def test_reset_after_fork(self):
+    pool = self.pool_(4)
+    src = pool.open(join(self.dir, 'src.h5'))
+    pool.openLink(src, 'link')
+    lock = pool.lock
+    pool.reset_after_fork()
+    self.assertFalse(pool.files or pool.refcounts or pool.last_use)
+    self.assertFalse(pool.links or pool.link_refs)
+    self.assertIsNot(pool.lock, lock)
+    self.assertTrue(src.id.valid) # files are forgotten, not closed
+    src.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import xml.etree.ElementTree as ET
+import krebsutils
+from krebs import hdf2xdmf
+
+
+def write_step_(f, name, time, ld):
+  g = f.create_group(name)
+  g.attrs['time'] = time
+  shape = tuple(ld.shape)
+  for fieldname, fieldshape, dtype in [('conc', shape, np.float32), ('vel', shape+(3,), np.float64), ('flags', shape, np.uint8)]:
+    ds = g.create_dataset(fieldname, data = np.full(fieldshape, time, dtype = dtype))
+    ds.attrs['LATTICE_PATH'] = '/field_ld'
+  return g
+
+
+class TestXdmf(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testhdf2xdmf')
+    self.fn = join(self.dir, 'sim.h5')
+    self.ld = krebsutils.LatticeDataQuad3d((0, 5, 0, 3, 0, 2), 10.)
+    self.ld.SetCellCentering((True, True, True))
+    with h5py.File(self.fn, 'w') as f:
+      krebsutils.write_lattice_data_to_hdf(f, 'field_ld', self.ld)
+      write_step_(f, 'out0000', 0., self.ld)
+      write_step_(f, 'out0001', 5., self.ld)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def grids_(self):
+    root = ET.parse(join(self.dir, 'sim.xdmf')).getroot()
+    (collection,) = root.find('Domain').findall('Grid')
+    self.assertEqual(collection.get('CollectionType'), 'Temporal')
+    return collection.findall('Grid')
+
+  def test_index(self):
+    self.assertEqual(hdf2xdmf.hdf2xdmf(self.fn), 2)
+    grids = self.grids_()
+    self.assertEqual([ g.find('Time').get('Value') for g in grids ], ['0.0', '5.0'])
+    nodeshape = tuple(np.asarray(self.ld.shape)+1)
+    for g in grids:
+      self.assertEqual(g.find('Topology').get('Dimensions'), ' '.join(map(str, nodeshape)))
+      attrs = dict((a.get('Name'), a) for a in g.findall('Attribute'))
+      self.assertEqual(sorted(attrs), ['conc', 'flags', 'vel'])
+      self.assertEqual(attrs['vel'].get('AttributeType'), 'Vector')
+      item = attrs['vel'].find('DataItem')
+      self.assertEqual((item.get('NumberType'), item.get('Precision')), ('Float', '8'))
+      self.assertEqual(item.text, 'sim.h5:%s/vel' % g.get('Name'))
+      self.assertEqual(attrs['flags'].find('DataItem').get('NumberType'), 'UChar')
+    # node coordinates, x varying slowest like the fields
+    with h5py.File(join(self.dir, 'sim-geometry.h5'), 'r') as f:
+      (geom,) = f.values()
+      self.assertEqual(geom.shape, nodeshape+(3,))
+      wbox = self.ld.worldBox
+      self.assertTrue(np.allclose(geom[0,0,0], wbox[[0, 2, 4]]))
+      self.assertTrue(np.allclose(geom[1,2,1] - geom[0,0,0], (10., 20., 10.)))
+
+  def test_append(self):
+    self.assertEqual(hdf2xdmf.hdf2xdmf(self.fn), 2)
+    self.assertEqual(hdf2xdmf.hdf2xdmf(self.fn), 0)
+    with h5py.File(self.fn, 'a') as f:
+      write_step_(f, 'out0002', 10., self.ld)
+    self.assertEqual(hdf2xdmf.hdf2xdmf(self.fn), 1)
+    self.assertEqual([ g.get('Name') for g in self.grids_() ], ['/out0000', '/out0001', '/out0002'])
+
+  def test_add_snapshot(self):
+    series = hdf2xdmf.XdmfTimeSeries(join(self.dir, 'sim.xdmf'))
+    with h5py.File(self.fn, 'r') as f:
+      series.add_snapshot(f['out0001'], time = 3., name = 'step')
+    series.write()
+    self.assertFalse(os.path.exists(join(self.dir, 'sim.xdmf.tmp')))
+    (g,) = self.grids_()
+    self.assertEqual((g.get('Name'), g.find('Time').get('Value')), ('step', '3.0'))
+
+
+if __name__ == '__main__':
+  unittest.main()
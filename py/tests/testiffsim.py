@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from krebs.iff.iffsim import Measure
+
+
+class TestMeasure(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testiffsim')
+    self.fn = join(self.dir, 'out.h5')
+    h5py.File(self.fn, 'w').close()
+    rnd = np.random.RandomState(0)
+    self.times = np.arange(1., 26.)
+    self.conc = [ (rnd.uniform(0., 2., (4,3,2)), rnd.uniform(0., 2., (4,3,2))) for t in self.times ]
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def run_(self, measure, start, stop):
+    for t, conc in zip(self.times[start:stop], self.conc[start:stop]):
+      measure((t, None), conc)
+
+  def read_(self):
+    with h5py.File(self.fn, 'r') as f:
+      g = f.get('measurements/drug_local_integral')
+      if g is None:
+        return None
+      return dict((k, np.asarray(v)) for k, v in g.items()), g.attrs['tend']
+
+  def test_accumulate(self):
+    measure = Measure(self.fn, dict(flushintervall = None))
+    self.run_(measure, 0, 25)
+    self.assertIs(self.read_(), None)
+    measure.flush()
+    data, tend = self.read_()
+    self.assertEqual(tend, 25.)
+    dt = np.diff(np.concatenate(([0.], self.times)))
+    for i, in_ex in enumerate(['ex', 'in']):
+      c = np.asarray([ conc[i] for conc in self.conc ])
+      dtc = dt.reshape((-1,1,1,1))
+      self.assertTrue(np.allclose(data['auc_'+in_ex], np.sum(c*dtc, axis=0)))
+      self.assertTrue(np.allclose(data['c_max_'+in_ex], np.amax(c, axis=0)))
+      self.assertTrue(np.allclose(data['exposure_time_05_'+in_ex], np.sum((c > 1.)*dtc, axis=0)))
+
+  def test_flush_interval(self):
+    self.assertEqual(Measure(self.fn, dict()).flushintervall, 600.)
+    measure = Measure(self.fn, dict(flushintervall = 10.))
+    self.run_(measure, 0, 10)
+    self.assertIs(self.read_(), None)
+    self.run_(measure, 10, 12) # flushes at t = 11, ten after the first callback
+    self.assertEqual(self.read_()[1], 11.)
+    measure = Measure(self.fn, dict(flushintervall = 0.))
+    self.run_(measure, 0, 1)
+    self.assertEqual(self.read_()[1], 1.)
+
+  def test_continue_file(self):
+    measure = Measure(self.fn, dict(flushintervall = None))
+    self.run_(measure, 0, 25)
+    measure.flush()
+    auc = self.read_()[0]['auc_ex']
+    measure = Measure(self.fn, dict(flushintervall = None))
+    measure.lastt = self.times[-1]
+    measure((26., None), self.conc[0])
+    measure.flush()
+    self.assertTrue(np.allclose(self.read_()[0]['auc_ex'], auc + self.conc[0][0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import krebsutils
+from krebsutils import VesselSamplingFlags
+
+
+def make_chain_(n = 10, flags = krebsutils.CAPILLARY):
+  '''a chain of n nodes along x which zigzags a little in y'''
+  g = krebsutils.Graph(np.asarray([ (i, i+1) for i in range(n-1) ], dtype = np.int32))
+  pos = np.zeros((n, 3), dtype = np.float32)
+  pos[:,0] = np.arange(n)*10.
+  pos[1::2,1] = 0.1
+  g.nodes['position'] = pos
+  g.edges['radius'] = np.linspace(4., 5., n-1).astype(np.float32)
+  g.edges['flags'] = np.full((n-1,), flags, dtype = np.int32)
+  g.edges['flow'] = np.arange(n-1, dtype = np.float32)
+  return g
+
+
+class TestLazyGraph(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testkrebsutils')
+    self.fn = join(self.dir, 'graph.h5')
+    g = make_chain_()
+    with h5py.File(self.fn, 'w') as f:
+      f['edges/node_a_index'] = g.edgelist[:,0]
+      f['edges/node_b_index'] = g.edgelist[:,1]
+      f['edges/radius'] = g.edges['radius']
+      f['nodes/position'] = g.nodes['position']
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def test_load_on_access(self):
+    with h5py.File(self.fn, 'r') as f:
+      g, not_found = krebsutils.read_graph_(f, 'radius', 'position', 'pressure', lazy = True)
+      self.assertEqual(not_found, set(['pressure']))
+      self.assertFalse(g.edges.is_loaded('radius'))
+      self.assertEqual(g.num_nodes, 10)
+      self.assertTrue(np.all(g.edges['radius'] == f['edges/radius'][...]))
+      self.assertTrue(g.edges.is_loaded('radius'))
+      g.edges.release()
+      self.assertFalse(g.edges.is_loaded('radius'))
+
+  def test_filtered(self):
+    with h5py.File(self.fn, 'r') as f:
+      g, _ = krebsutils.read_graph_(f, 'radius', 'position', lazy = True)
+      sub = g.get_filtered(edge_indices = np.asarray([2, 3]))
+      self.assertFalse(sub.edges.is_loaded('radius'))
+      self.assertTrue(np.all(sub.edges['radius'] == f['edges/radius'][2:4]))
+      self.assertTrue(np.all(sub.nodes['position'] == f['nodes/position'][2:5]))
+
+  def test_filtered_roots(self):
+    g = make_chain_()
+    g.roots = np.asarray([0, 9], dtype = np.int32)
+    for lazy in (False, True):
+      sub = g.get_filtered(edge_indices = np.arange(4), lazy = lazy)
+      self.assertEqual(list(g.roots), [0, 9])
+      self.assertEqual(list(sub.roots), [0])
+
+
+class TestSampleGraph(unittest.TestCase):
+  def test_like_sample_edges(self):
+    g = make_chain_()
+    pos, edges, flow = g.nodes['position'], g.edgelist, g.edges['flow']
+    linear = VesselSamplingFlags.DATA_PER_NODE | VesselSamplingFlags.DATA_LINEAR
+    # the default averages edge data onto the nodes, like plotVessels.generate_samples
+    s = krebsutils.sample_graph(g, ['flow', 'position'], 3.)
+    ref = krebsutils.sample_edges(pos, edges, krebsutils.edge_to_node_property(len(pos), edges, flow, 'avg'), 3., linear)
+    self.assertTrue(np.allclose(s['flow'], ref))
+    self.assertTrue(np.allclose(s['position'], krebsutils.sample_edges(pos, edges, pos, 3., linear)))
+    s = krebsutils.sample_graph(g, ['flow'], 3., edge_mode = 'const')
+    self.assertTrue(np.allclose(s['flow'], krebsutils.sample_edges(pos, edges, flow, 3., VesselSamplingFlags.DATA_CONST)))
+
+  def test_empty(self):
+    g = make_chain_().get_filtered(edge_indices = np.zeros((0,), dtype = np.int64))
+    s = krebsutils.sample_graph(g, ['flow', 'position'], 3.)
+    self.assertEqual(len(s['flow']), 0)
+    self.assertEqual(len(s['position']), 0)
+
+
+class TestVolumeFractionSparse(unittest.TestCase):
+  def test_like_dense(self):
+    # the lattice is split into boxes of 16 to 32 sites, so these vessels
+    # cross box boundaries in every direction
+    ld = krebsutils.LatticeDataQuad3d((0, 63, 0, 47, 0, 39), 10.)
+    ld.SetCellCentering((True, True, True))
+    wb = ld.worldBox.reshape(3,2)
+    pos = np.asarray([ wb[:,0], wb[:,1], (wb[0,0], wb[1,1], wb[2,0]), (wb[0,1], wb[1,0], wb[2,1]),
+                       np.average(wb, axis=1) + (3., 161., -2.) ], dtype = np.float32)
+    edges = np.asarray([(0, 1), (2, 3), (4, 0), (4, 3)], dtype = np.int32)
+    radius = np.asarray([6., 12., 3., 20.], dtype = np.float32)
+    dense = krebsutils.make_vessel_volume_fraction_field(pos, edges, radius, ld, 5)
+    coords, values = krebsutils.make_vessel_volume_fraction_sparse(pos, edges, radius, ld, 5)
+    sparse = krebsutils.sparse_to_dense(coords, values, dense.shape)
+    # sample counts are rounded randomly, so only small differences are allowed
+    self.assertLess(np.amax(np.abs(sparse - dense)), 0.05)
+    self.assertAlmostEqual(np.sum(sparse)/np.sum(dense), 1., places = 2)
+
+
+def correlation_fields_():
+  x, y, z = np.ogrid[:16, :16, :16]
+  field = np.asarray(np.sin(x/3.) + np.cos(y/4.) + 0.*z, dtype = np.float64)
+  mask = np.zeros(field.shape, dtype = np.ubyte)
+  mask[2:14, 3:15, 1:12] = 2 # every nonzero value counts as inside
+  return field, mask
+
+
+class TestRadialCorrelation(unittest.TestCase):
+  def assertAllClose(self, a, b):
+    for u, v in zip(a, b):
+      self.assertTrue(np.allclose(u, v))
+
+  def test_fft_mask(self):
+    field, mask = correlation_fields_()
+    corr = lambda **kwargs: krebsutils.radial_correlation(field, field, 4, return_raw_data = True, method = 'fft', **kwargs)
+    self.assertAllClose(corr(mask = mask), corr(mask = mask != 0))
+    self.assertAllClose(corr(mask = np.ones(field.shape)), corr())
+
+  def test_fft_vs_direct(self):
+    field, mask = correlation_fields_()
+    r, n1, c1, _ = krebsutils.radial_correlation(field, field, 4, return_raw_data = True, mask = mask, method = 'fft')
+    r, n2, c2, _ = krebsutils.radial_correlation(field, field, 4, return_raw_data = True, mask = mask, method = 'direct')
+    # both bin with random offsets, so only the statistics agree
+    sel = slice(1, len(r)-1)
+    self.assertTrue(np.allclose(n1[sel], n2[sel], rtol = 0.1))
+    self.assertTrue(np.allclose(c1[sel]/n1[sel], c2[sel]/n2[sel], atol = 0.1*np.std(field)))
+
+  def test_direct_by_default(self):
+    field, _ = correlation_fields_()
+    fft = krebsutils.radial_correlation_fft_
+    def fail(*args):
+      raise AssertionError('fft used')
+    krebsutils.radial_correlation_fft_ = fail
+    try:
+      # a window for which 'auto' would take the fft
+      krebsutils.radial_correlation(field, field, 15)
+      self.assertRaises(AssertionError, krebsutils.radial_correlation, field, field, 15, method = 'auto')
+    finally:
+      krebsutils.radial_correlation_fft_ = fft
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import krebsutils
+from krebs import measureBulkTissue
+
+
+def write_state_(f):
+  '''a spherical tumor on a small lattice and a few straight vessels through it'''
+  ld = krebsutils.LatticeDataQuad3d((0, 15, 0, 11, 0, 9), 30.)
+  ld.SetCellCentering((True, True, True))
+  ld = krebsutils.LatticeDataGetCentered(ld)
+  krebsutils.write_lattice_data_to_hdf(f, 'field_ld', ld)
+  rnd = np.random.RandomState(0)
+  radial = krebsutils.make_radial_field(ld)
+  shape = radial.shape
+  g = f.create_group('out0001')
+  g.attrs['time'] = 1.
+  tum = g.create_group('tumor')
+  fields = dict(ls = (100. - radial).astype(np.float32),
+                ptc = (radial < 100.).astype(np.float32),
+                conc = rnd.uniform(0.5, 1., shape).astype(np.float32),
+                sources = rnd.normal(size = shape).astype(np.float32),
+                press = rnd.normal(size = shape).astype(np.float32),
+                vel = rnd.normal(size = shape+(3,)).astype(np.float32))
+  for name, a in fields.iteritems():
+    tum.create_dataset(name, data = a)
+    tum[name].attrs['LATTICE_PATH'] = '/field_ld'
+  for name in ['fieldOxy', 'fieldGf']:
+    g.create_dataset(name, data = rnd.uniform(size = shape).astype(np.float32))
+    g[name].attrs['LATTICE_PATH'] = '/field_ld'
+  n = 9
+  pos = np.zeros((2*n, 3), dtype = np.float32)
+  pos[:n,0] = pos[n:,1] = np.linspace(-160., 160., n)
+  pos[:n,1:] = (7., 3.)
+  pos[n:,2] = -11.
+  edges = [ (i, i+1) for i in range(n-1) ] + [ (n+i, n+i+1) for i in range(n-1) ]
+  v = g.create_group('vessels')
+  v.attrs['CLASS'] = 'GRAPH'
+  v['nodes/position'] = pos
+  v['nodes/roots'] = np.asarray([0, n-1, n, 2*n-1], dtype = np.int32)
+  v['edges/node_a_index'] = np.asarray([ e[0] for e in edges ], dtype = np.int32)
+  v['edges/node_b_index'] = np.asarray([ e[1] for e in edges ], dtype = np.int32)
+  num_edges = len(edges)
+  v['edges/flags'] = np.full((num_edges,), krebsutils.CIRCULATED | krebsutils.CAPILLARY, dtype = np.int32)
+  for name in ['radius', 'flow', 'shearforce', 'maturation']:
+    v['edges/'+name] = rnd.uniform(1., 5., num_edges).astype(np.float32)
+  return g
+
+
+class TestStreaming(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testmeasureBulkTissue')
+    self.f = h5py.File(join(self.dir, 'state.h5'), 'w')
+    self.fdst = h5py.File(join(self.dir, 'measure.h5'), 'w')
+    self.state = write_state_(self.f)
+
+  def tearDown(self):
+    self.f.close()
+    self.fdst.close()
+    shutil.rmtree(self.dir, True)
+
+  def test_like_in_memory(self):
+    ref = self.fdst.create_group('ref')
+    measureBulkTissue.generate_data(self.state, ref, slab_size = 0)
+    dst = self.fdst.create_group('streaming')
+    measureBulkTissue.generate_data(self.state, dst, slab_size = 3)
+    # the radial velocity is computed analytically instead of by finite
+    # differences, and the vessel radius is not interpolated from a field
+    fields = ['ptc', 'conc', 'phi_tumor', 'sources', 'press', 'oxy', 'gf']
+    compare = dict(vs_dr = fields + ['mvd', 'radius', 'flow', 'shearforce', 'maturation'], vs_r = fields)
+    for flavor, names in compare.iteritems():
+      for name in names:
+        for q in ('cnt', 'sum', 'sqr'):
+          a = np.asarray(ref['radial'][flavor][name][q])
+          b = np.asarray(dst['radial'][flavor][name][q])
+          self.assertTrue(np.allclose(a, b, rtol = 1.e-4), (flavor, name, q))
+    for name in ['volume', 'radius', 'area']:
+      self.assertAlmostEqual(ref['geometry'][name][()], dst['geometry'][name][()], places = 3)
+
+  def test_distmap_cached(self):
+    dst = self.fdst.create_group('streaming')
+    measureBulkTissue.generate_data(self.state, dst, slab_size = 4)
+    ds = dst['distmap']
+    self.assertEqual(ds.dtype, np.float32)
+    self.assertEqual(ds.chunks[0], 4)
+    self.assertTrue(np.allclose(ds[...], measureBulkTissue.calc_distmap(self.state['tumor'])))
+    calc_distmap = measureBulkTissue.calc_distmap
+    def fail(*args):
+      raise AssertionError('distmap recomputed')
+    measureBulkTissue.calc_distmap = fail
+    try:
+      measureBulkTissue.generate_data(self.state, dst, slab_size = 4)
+    finally:
+      measureBulkTissue.calc_distmap = calc_distmap
+
+  def test_calc_distmap_slabs(self):
+    tum = self.state['tumor']
+    self.assertTrue(np.all(measureBulkTissue.calc_distmap(tum, 5) == measureBulkTissue.calc_distmap(tum)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import time
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import h5files
+import myutils
+
+
+calls_ = []
+
+def cached_value(dataman, g):
+  calls_.append(g.name)
+  return np.asarray(g['x'])
+
+
+class TestDiskCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testmyutils')
+    del calls_[:]
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def write_files_(self):
+    with h5py.File(join(self.dir, 'src.h5'), 'w') as f:
+      f['x'] = np.arange(3.)
+    with h5py.File(join(self.dir, 'measure.h5'), 'w') as f:
+      f.attrs['SOURCE'] = 'src.h5'
+      f['source'] = h5py.ExternalLink('src.h5', '/')
+      f.create_group('g')['x'] = np.arange(5.)
+
+  def test_reuse_by_other_datamanager(self):
+    self.write_files_()
+    dc = myutils.DiskCache(join(self.dir, 'cache'))
+    with h5py.File(join(self.dir, 'measure.h5'), 'r') as f:
+      for i in range(2): # the second one could run in another process
+        dataman = myutils.DataManager(10, [cached_value], diskcache = dc)
+        self.assertTrue(np.all(dataman.obtain_data('cached_value', f['g']) == np.arange(5.)))
+    self.assertEqual(len(calls_), 1)
+
+  def test_unpicklable_arguments(self):
+    dc = myutils.DiskCache(self.dir)
+    self.assertIs(dc.makeKey_('cached_value', (lambda: 0,), cached_value), None)
+    self.assertEqual(dc('x', (lambda: 0,), lambda: 1), 1)
+    self.assertFalse(os.listdir(self.dir))
+
+  def test_linked_file_modified(self):
+    self.write_files_()
+    dc = myutils.DiskCache(join(self.dir, 'cache'))
+    with h5py.File(join(self.dir, 'measure.h5'), 'r') as f:
+      myutils.DataManager(10, [cached_value], diskcache = dc).obtain_data('cached_value', f['g'])
+    time.sleep(1.1) # mtime resolution
+    with h5py.File(join(self.dir, 'src.h5'), 'a') as f:
+      f['x'][0] = 7.
+    with h5py.File(join(self.dir, 'measure.h5'), 'r') as f:
+      myutils.DataManager(10, [cached_value], diskcache = dc).obtain_data('cached_value', f['g'])
+    self.assertEqual(len(calls_), 2)
+
+  def test_handler_modified(self):
+    def cached_value2(dataman, g):
+      return np.asarray(g['x'])*2.
+    dc = myutils.DiskCache(self.dir)
+    self.assertNotEqual(dc.makeKey_('v', (1,), cached_value), dc.makeKey_('v', (1,), cached_value2))
+    self.assertEqual(dc.makeKey_('v', (1,), cached_value), dc.makeKey_('v', (1,), cached_value))
+
+  def test_size_limit(self):
+    dc = myutils.DiskCache(self.dir, maxbytes = 3000)
+    for i in range(5):
+      dc('data', (i,), lambda: np.zeros(1000, dtype=np.uint8))
+      time.sleep(0.01)
+    files = [ n for n in os.listdir(self.dir) if n.endswith(dc.suffix) ]
+    self.assertEqual(len(files), 2)
+    self.assertEqual(dc.nbytes, sum(os.path.getsize(join(self.dir, n)) for n in files))
+    self.assertIn(dc.makeKey_('data', (4,)) + dc.suffix, files)
+
+
+class TestReduceLargeDataset(unittest.TestCase):
+  def test_chunked_dataset(self):
+    d = tempfile.mkdtemp(prefix='testmyutils')
+    try:
+      a = np.random.RandomState(0).normal(1.e6, 1., size = (37, 23, 11))
+      with h5py.File(join(d, 'data.h5'), 'w') as f:
+        ds = f.create_dataset('a', data = a, chunks = (8, 8, 4), compression = 'gzip')
+        for num_threads in (1, 3):
+          s = myutils.reduceLargeDataset(ds, bins = [0., 1.e6, 2.e6], blocksize = 500, num_threads = num_threads)
+          self.assertEqual(s.cnt, a.size)
+          self.assertAlmostEqual(s.mean, np.mean(a))
+          self.assertAlmostEqual(s.std, np.std(a))
+          self.assertEqual((s.min, s.max), (np.amin(a), np.amax(a)))
+          self.assertEqual(list(s.hist), list(np.histogram(a, [0., 1.e6, 2.e6])[0]))
+    finally:
+      shutil.rmtree(d, True)
+
+
+def histogram_reference_(bins, x, y, w = 1.):
+  """MeanValueArray.fromHistogram1d as it was implemented with np.histogram"""
+  if isinstance(w, (float, int)):
+    w = w * np.ones(x.shape, dtype=np.float32)
+  cnt, _ = np.histogram(x, bins=bins, weights = w)
+  sum, _ = np.histogram(x, bins=bins, weights = w * y)
+  sqr, _ = np.histogram(x, bins=bins, weights = w * np.power(y, 2.))
+  return myutils.MeanValueArray(cnt, sum, sqr)
+
+
+class TestBinning(unittest.TestCase):
+  def setUp(self):
+    rnd = np.random.RandomState(0)
+    self.bins = np.asarray([-1., 0., 0.5, 2., 3.])
+    # values on the edges and outside of the bins
+    self.x = np.concatenate((rnd.uniform(-2., 4., 1000), self.bins, [-2., 5.]))
+    self.y = rnd.normal(size = self.x.shape)
+    self.w = rnd.uniform(size = self.x.shape)
+
+  def assertSameMeanValues(self, a, b):
+    for q in ('cnt', 'sum', 'sqr'):
+      self.assertTrue(np.allclose(getattr(a, q), getattr(b, q)), q)
+
+  def test_like_histogram(self):
+    for w in (1., 2, self.w):
+      self.assertSameMeanValues(myutils.MeanValueArray.fromHistogram1d(self.bins, self.x, self.y, w),
+                                histogram_reference_(self.bins, self.x, self.y, w))
+
+  def test_reuse(self):
+    binning = myutils.Binning(self.bins, self.x, self.w)
+    for y in (self.y, np.square(self.y)):
+      self.assertSameMeanValues(binning.meanValueArray(y), histogram_reference_(self.bins, self.x, y, self.w))
+
+  def test_fields(self):
+    x, y = self.x[:1000].reshape((10, 10, 10)), self.y[:1000].reshape((10, 10, 10))
+    a, b = myutils.histogramFields1d(self.bins, x, [y, 2.*y], blocksize = 128)
+    self.assertSameMeanValues(a, histogram_reference_(self.bins, x.ravel(), y.ravel()))
+    self.assertSameMeanValues(b, histogram_reference_(self.bins, x.ravel(), 2.*y.ravel()))
+
+
+class TestLRUCache(unittest.TestCase):
+  def test_eviction(self):
+    calls = []
+    def f(x):
+      calls.append(x)
+      return np.zeros(x, dtype=np.uint8)
+    c = myutils.LRU_Cache(f, maxsize=2, maxbytes=100)
+    c(10); c(20); c(10)
+    self.assertEqual(calls, [10, 20])
+    c(30) # evicts 20, the least recently used
+    c(10)
+    self.assertEqual(calls, [10, 20, 30])
+    c(200) # larger than maxbytes, returned but not stored
+    self.assertEqual(c.statistics[None].uncached, 1)
+    self.assertEqual(c.statistics[None].evictions, 1)
+    self.assertEqual(c.nbytes, 40)
+
+  def test_exclusive_compute_time(self):
+    def inner(dataman):
+      time.sleep(0.2)
+      return 1
+    def outer(dataman):
+      time.sleep(0.05)
+      return dataman.obtain_data('inner')
+    dataman = myutils.DataManager(10, [inner, outer], diskcache = False)
+    dataman.obtain_data('outer')
+    self.assertGreaterEqual(dataman.statistics['inner'].compute_time, 0.2)
+    self.assertLess(dataman.statistics['outer'].compute_time, 0.15)
+
+  def test_maxbytes_with_disk_cache_env(self):
+    d = tempfile.mkdtemp(prefix='testmyutils')
+    env = dict(os.environ)
+    try:
+      os.environ['DATAMANAGER_CACHE_DIR'] = d
+      os.environ['DATAMANAGER_CACHE_SIZE_GB'] = '1'
+      dataman = myutils.DataManager(10, [], maxbytes = 1000)
+      self.assertEqual(dataman.cache_.maxbytes, 1000)
+      self.assertEqual(dataman.diskcache_.maxbytes, 1024**3)
+    finally:
+      os.environ.clear()
+      os.environ.update(env)
+      shutil.rmtree(d, True)
+
+
+class EnsembleHandler(object):
+  keywords = ['ensemble_value']
+  def obtain_data(self, dataman, dataname, g):
+    return (os.getpid(), float(g['x'][()]), g.file.mode)
+
+
+class TestEnsemble(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testmyutils')
+    self.files = []
+    for i in range(3):
+      fn = join(self.dir, 'f%i.h5' % i)
+      with h5py.File(fn, 'w') as f:
+        f['x'] = float(i)
+      self.files.append(h5files.open(fn, 'r'))
+    self.dataman = myutils.DataManager(10, [EnsembleHandler()], diskcache = False)
+
+  def tearDown(self):
+    self.dataman.close_pool()
+    for f in self.files:
+      h5files.close(f)
+    shutil.rmtree(self.dir, True)
+
+  def test_workers(self):
+    args = [ (f,) for f in self.files ]
+    res = self.dataman.obtain_data_ensemble('ensemble_value', args, list, num_workers = 2)
+    self.assertEqual([ r[1] for r in res ], [0., 1., 2.])
+    self.assertTrue(all(r[2] == 'r' for r in res))
+    self.assertNotIn(os.getpid(), [ r[0] for r in res ])
+    pool = self.dataman.pool_
+    self.dataman.obtain_data_ensemble('ensemble_value', args, list, num_workers = 2)
+    self.assertIs(self.dataman.pool_, pool)
+    self.dataman.close_pool()
+    self.assertIs(self.dataman.pool_, None)
+
+  def test_serial(self):
+    res = self.dataman.obtain_data_ensemble('ensemble_value', [ (f,) for f in self.files ], list, num_workers = 1)
+    self.assertEqual([ r[0] for r in res ], [os.getpid()]*3)
+    self.assertIs(self.dataman.pool_, None)
+
+  def test_fallback_if_workers_cannot_open_files(self):
+    fn = self.files[1].filename
+    os.rename(fn, fn+'.moved') # still readable through the open handle
+    try:
+      res = self.dataman.obtain_data_ensemble('ensemble_value', [ (f,) for f in self.files ], list, num_workers = 2)
+    finally:
+      os.rename(fn+'.moved', fn)
+    self.assertEqual([ r[1] for r in res ], [0., 1., 2.])
+    self.assertEqual([ r[0] for r in res ], [os.getpid()]*3)
+
+
+if __name__ == '__main__':
+  unittest.main()
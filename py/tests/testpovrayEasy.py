@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import time
+import shutil
+import tempfile
+import unittest
+from krebs.povrayEasy import ExportCache
+
+
+def writer(fn):
+  with open(fn, 'w') as f:
+    f.write('x'*100)
+
+
+class TestExportCache(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testpovrayEasy')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def test_reuse(self):
+    calls = []
+    def counting_writer(fn):
+      calls.append(fn)
+      writer(fn)
+    cache = ExportCache(self.dir)
+    fn = cache.get('a', '.inc', counting_writer)
+    self.assertEqual(fn, join(self.dir, 'a.inc'))
+    self.assertEqual(cache.get('a', '.inc', counting_writer), fn)
+    self.assertEqual(len(calls), 1)
+    self.assertNotEqual(calls[0], fn) # written to a temporary file first
+
+  def test_size_limit(self):
+    cache = ExportCache(self.dir, maxbytes = 250)
+    for key in 'abc':
+      cache.get(key, '.inc', writer)
+      time.sleep(0.01)
+    self.assertEqual(sorted(os.listdir(self.dir)), ['b.inc', 'c.inc'])
+    cache.get('b', '.inc', writer) # a hit makes b the most recently used
+    time.sleep(0.01)
+    cache.get('d', '.inc', writer)
+    self.assertEqual(sorted(os.listdir(self.dir)), ['b.inc', 'd.inc'])
+    self.assertEqual(cache.nbytes, 200)
+
+  def test_larger_than_limit(self):
+    cache = ExportCache(self.dir, maxbytes = 50)
+    fn = cache.get('a', '.inc', writer)
+    self.assertTrue(os.path.isfile(fn)) # the requested entry is kept
+    cache.get('b', '.inc', writer)
+    self.assertEqual(os.listdir(self.dir), ['b.inc'])
+
+  def test_failing_writer(self):
+    def failing(fn):
+      raise ValueError()
+    cache = ExportCache(self.dir)
+    self.assertRaises(ValueError, cache.get, 'a', '.inc', failing)
+    self.assertEqual(os.listdir(self.dir), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pso import pso
+
+
+def banana(x):
+  return x[0]**4 - 2*x[1]*x[0]**2 + x[1]**2 + x[0]**2 - 2*x[0] + 5
+
+def banana_batch(x):
+  return banana(x.T)
+
+lb, ub, x_0 = [-3, -1], [2, 6], [0, 0]
+options = dict(swarmsize = 10, minstep = 0., minfunc = 0.)
+
+
+def run_(maxiter, **kwargs):
+  np.random.seed(1)
+  return pso(banana, x_0, lb, ub, maxiter = maxiter, **dict(options, **kwargs))
+
+
+class TestPSO(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testpso')
+    self.checkpoint = join(self.dir, 'checkpoint.h5')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir, True)
+
+  def test_batch_func(self):
+    g, fg = run_(10)
+    np.random.seed(1)
+    g2, fg2 = pso(banana_batch, x_0, lb, ub, maxiter = 10, batch_func = True, **options)
+    self.assertTrue(np.allclose(g, g2))
+    self.assertAlmostEqual(fg, fg2)
+
+  def test_resume(self):
+    g, fg = run_(10)
+    run_(4, checkpoint = self.checkpoint) # interrupted
+    np.random.seed(2) # the random state is restored from the checkpoint
+    g2, fg2 = pso(banana, x_0, lb, ub, maxiter = 10, checkpoint = self.checkpoint, resume = True, **options)
+    self.assertTrue(np.allclose(g, g2))
+    self.assertEqual(fg, fg2)
+
+  def test_no_resume_by_default(self):
+    run_(4, checkpoint = self.checkpoint, swarmsize = 7)
+    g, fg = run_(10)
+    g2, fg2 = run_(10, checkpoint = self.checkpoint)
+    self.assertTrue(np.allclose(g, g2))
+    self.assertEqual(fg, fg2)
+
+  def test_resume_mismatch(self):
+    run_(4, checkpoint = self.checkpoint)
+    self.assertRaises(ValueError, run_, 10, checkpoint = self.checkpoint, resume = True, swarmsize = 7)
+    self.assertRaises(ValueError, pso, banana, x_0, lb, [3, 6], maxiter = 10, checkpoint = self.checkpoint, resume = True, **options)
+
+
+if __name__ == '__main__':
+  unittest.main()
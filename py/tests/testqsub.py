@@ -0,0 +1,155 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import argparse
+import cPickle
+import glob
+import shutil
+import tempfile
+import unittest
+import qsub
+
+
+def write_marker(fn, value):
+  with open(fn, 'w') as f:
+    f.write(str(value))
+
+
+class QsubTestCase(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp(prefix='testqsub')
+    self.args = qsub.goodArgumentsQueue
+    qsub.goodArgumentsQueue = argparse.Namespace(q_local = True, q_dry = False, q_verbose = False, memory = qsub.defaultMemory)
+    qsub.local_executor_ = qsub.LocalExecutor(max_cpus = 2, logdir = join(self.dir, 'logs'))
+
+  def tearDown(self):
+    qsub.local_executor_.wait()
+    qsub.local_executor_ = None
+    qsub.goodArgumentsQueue = self.args
+    qsub.is_client = False
+    shutil.rmtree(self.dir, True)
+
+
+class TestArray(QsubTestCase):
+  def jobs_(self):
+    return [ qsub.func(write_marker, join(self.dir, 'marker%i' % i), i) for i in range(3) ]
+
+  def test_run_locally(self):
+    qsub.submit(self.jobs_(), name = 'arr', outdir = self.dir)
+    self.assertEqual(qsub.local_executor_.wait(), 0)
+    for i in range(3):
+      with open(join(self.dir, 'marker%i' % i)) as f:
+        self.assertEqual(f.read(), str(i))
+    self.assertFalse(glob.glob(join(self.dir, '*.qsubarray')))
+
+  def test_side_file(self):
+    # a fake scheduler which keeps a copy of the job script
+    fake = join(self.dir, 'sbatch')
+    with open(fake, 'w') as f:
+      f.write('#!/bin/sh\ncp "$1" %s\n' % join(self.dir, 'submitted.sh'))
+    os.chmod(fake, 0755)
+    qsub.submit_array(self.jobs_(), fake, name = 'arr', outdir = self.dir, num_cpus = 2)
+    with open(join(self.dir, 'submitted.sh')) as f:
+      script = f.read()
+    self.assertIn('#PBS -t 0-2', script)
+    (tmpdir,) = glob.glob(join(self.dir, 'arr-*.qsubarray'))
+    self.assertEqual(os.listdir(tmpdir), ['tasks.pickle']) # the job script is removed after submission
+    filename = join(tmpdir, 'tasks.pickle')
+    self.assertIn('--array-task %s $TASK_ID' % filename, script)
+    with open(filename, 'rb') as f:
+      self.assertEqual([ p['functionname'] for p in cPickle.load(f) ], ['write_marker']*3)
+    for i in range(3):
+      self.assertEqual(qsub.run_array_task_(filename, i), 0)
+      self.assertTrue(os.path.isfile(join(self.dir, 'marker%i' % i)))
+    self.assertFalse(os.path.exists(tmpdir)) # removed by the last task
+
+
+class TestLocalExecutor(QsubTestCase):
+  def test_cpu_limit(self):
+    executor = qsub.local_executor_
+    sleep = [sys.executable, '-c', 'import time; time.sleep(0.3)']
+    a = executor.submit(sleep, 'a', num_cpus = 2)
+    b = executor.submit(sleep, 'b', num_cpus = 1) # waits for a
+    c = executor.submit(sleep, 'c', num_cpus = 1)
+    self.assertEqual(executor.wait(), 0)
+    self.assertGreaterEqual(b.start_time, a.end_time)
+    self.assertLess(c.start_time, b.end_time) # b and c fit together
+    self.assertEqual(executor.submit(sleep, 'd', num_cpus = 8).num_cpus, 2)
+
+  def test_failures_and_logs(self):
+    executor = qsub.local_executor_
+    executor.submit(['/bin/sh', '-c', 'echo out; echo err >&2; exit 3'], 'fail')
+    executor.submit(['/bin/sh', '-c', 'true'], 'ok')
+    self.assertEqual(executor.wait(), 1)
+    with open(join(self.dir, 'logs', 'fail.0.out')) as f:
+      self.assertEqual(f.read(), 'out\n')
+    with open(join(self.dir, 'logs', 'fail.0.err')) as f:
+      self.assertEqual(f.read(), 'err\n')
+    with open(join(self.dir, 'logs', 'summary.txt')) as f:
+      lines = f.read().splitlines()
+    self.assertEqual([ l.split()[1] for l in lines[1:] ], ['3', '0'])
+
+  def test_submit_func(self):
+    qsub.submit(qsub.func(write_marker, join(self.dir, 'marker'), 'x'), name = 'single')
+    self.assertEqual(qsub.local_executor_.wait(), 0)
+    with open(join(self.dir, 'marker')) as f:
+      self.assertEqual(f.read(), 'x')
+    self.assertTrue(os.path.isfile(join(self.dir, 'logs', 'single.0.py')))
+
+
+class TestSubmitDetailedO2(QsubTestCase):
+  def test_array_only_for_equal_resources(self):
+    import h5py
+    from krebsjobs import submitDetailedO2
+    from krebsjobs.parameters import parameterSetsO2
+    filenames = []
+    for i in range(4):
+      fn = join(self.dir, 'vessels%i.h5' % i)
+      with h5py.File(fn, 'w') as f:
+        f.create_group('vessels')
+      filenames.append(fn)
+    submitted = []
+    def submit(obj, **qsubopts):
+      submitted.append((qsubopts['name'], len(obj) if isinstance(obj, list) else None, qsubopts['num_cpus']))
+    def params(count):
+      return [ dict(name = 'testset', num_threads = n) for n in (2, 4, 2, 2) ]
+    submit_, qsub.submit = qsub.submit, submit
+    parameterSetsO2.testset = params
+    try:
+      submitDetailedO2.run('testset', filenames, 'vessels', None)
+      self.assertEqual(submitted, [('job_o2_testset_2threads', 3, 2), ('job_o2_testset_vessels1.h5', None, 4)])
+      del submitted[:]
+      parameterSetsO2.testset = dict(num_threads = 2)
+      submitDetailedO2.run('testset', filenames, 'vessels', None)
+      self.assertEqual(submitted, [('job_o2_testset', 4, 2)])
+      del submitted[:]
+      submitDetailedO2.run('testset', filenames[:1], 'vessels', None)
+      self.assertEqual(submitted, [('job_o2_testset_vessels0.h5', None, 2)])
+    finally:
+      qsub.submit = submit_
+      del parameterSetsO2.testset
+
+
+if __name__ == '__main__':
+  unittest.main()
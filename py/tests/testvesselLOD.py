@@ -0,0 +1,66 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+'''
+This file is part of tumorcode project.
+(http://www.uni-saarland.de/fak7/rieger/homepage/research/tumor/tumor.html)
+
+Copyright (C) 2016  Michael Welter and Thierry Fredrich
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import os,sys
+from os.path import join, dirname
+if __name__=='__main__': sys.path.append(join(dirname(__file__),'..'))
+import unittest
+import numpy as np
+import krebsutils
+from krebs import vesselLOD
+from testkrebsutils import make_chain_
+
+
+class TestVesselLOD(unittest.TestCase):
+  def test_levels(self):
+    g = make_chain_(33)
+    lod = vesselLOD.VesselLOD(g)
+    self.assertIs(lod.apply(g, 0), g)
+    coarse = lod.apply(g, 3)
+    self.assertTrue(0 < len(coarse.edgelist) < len(g.edgelist))
+    # the end points of the chain stay
+    self.assertTrue(np.allclose(coarse.nodes['position'][[0,-1]], g.nodes['position'][[0,-1]]))
+    self.assertAlmostEqual(np.sum(lod.level(3).length), np.sum(lod.level(0).length), places = 3)
+
+  def test_protected(self):
+    g = make_chain_(33, krebsutils.ARTERY)
+    self.assertEqual(len(vesselLOD.VesselLOD(g).apply(g, 3).edgelist), len(g.edgelist))
+
+  def test_budget(self):
+    g = make_chain_(33)
+    coarse = vesselLOD.decimate(g, max_segments = 4)
+    self.assertLessEqual(len(coarse.edgelist), 4)
+    self.assertIs(vesselLOD.decimate(g), g)
+
+  def test_cache(self):
+    lod = vesselLOD.getVesselLOD(make_chain_())
+    self.assertIs(vesselLOD.getVesselLOD(make_chain_()), lod) # same content
+    g = make_chain_()
+    g.nodes['position'] = g.nodes['position']*2.
+    self.assertIsNot(vesselLOD.getVesselLOD(g), lod)
+    for n in range(11, 16):
+      vesselLOD.getVesselLOD(make_chain_(n))
+    self.assertEqual(len(vesselLOD.lod_cache_.mapping), 4)
+    self.assertIsNot(vesselLOD.getVesselLOD(make_chain_()), lod)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -23,6 +23,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include "common/trilinos_linsys_construction.h"
 #include "common/vessels3d.h"
 #include "common/calcflow_common.h" //at least for remap_keys
+#include "common/calcflow_linsys.h"
 
 #include "mwlib/math_ext.h"
 #include "hdf_wrapper.h"
@@ -1057,7 +1058,9 @@ uint runAdaption_Loop(const Parameters *params, const BloodFlowParameters *bfpar
 #if 1
   ChangeBoundaryConditions(*vl);
 #endif
-  CalcFlow(*vl, *bfparams);
+  // the network topology stays the same during the adaption, so the flow system is kept
+  FlowSystem flowsys;
+  CalcFlow(*vl, *bfparams, &flowsys);
   int no_Vessels_before_adaption = vl->GetECount();
   //adaption loop local variables
   FlReal qdev=std::numeric_limits<FlReal>::max();
@@ -1167,7 +1170,7 @@ uint runAdaption_Loop(const Parameters *params, const BloodFlowParameters *bfpar
     std::tie(qdev,max_stot,max_delta_r) = Adaption::CalcRadiiChange_mw(*params,*vl,delta_t);
 #if 1
     UpdateBoundaryConditions(*vl);//new boundary flows, can show up after adaption
-    CalcFlow(*vl, *bfparams);//vice versa, network can expire different flows because of change in BC
+    CalcFlow(*vl, *bfparams, &flowsys);//vice versa, network can expire different flows because of change in BC
 #endif
     qdev = sqrt(qdev);
     nqdev = qdev/vl->GetECount();
@@ -244,7 +244,7 @@ T Median(const std::vector<T> &x)
 
 /*------------------------------------------------------------------
 --------------------------------------------------------------------*/
-void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &bloodFlowParameters, bool keepTheVesselHematocrit)
+void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &bloodFlowParameters, bool keepTheVesselHematocrit, FlowSystem *flowsys)
 {
   {
 #ifndef SILENT
@@ -322,10 +322,10 @@ void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &bloodFlowParame
   }
 #else
   {
-    Linsys flowsys;
-    flowsys.scaling_const = CalcFlowCoeff(bloodFlowParameters.viscosityPlasma, 4., 100.); //Median(cond);
-    flowsys.initialize_pattern(flownet.num_vertices(), flownet.edges);
-    flowsys.fill_values(flownet.edges, cond, flownet.bcs);
+    FlowSystem local_flowsys;
+    FlowSystem &fs = flowsys ? *flowsys : local_flowsys;
+    fs.set_network(flownet.num_vertices(), flownet.edges, CalcFlowCoeff(bloodFlowParameters.viscosityPlasma, 4., 100.)); //Median(cond);
+    fs.solve(cond, flownet.bcs, flownet.press);
 
 #if 0   // thierrys sparse output
     time_t rawtime;
@@ -336,41 +336,36 @@ void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &bloodFlowParame
     std::string myString ("Epetra_Matrix");
     myString = myString + asctime(timeinfo) +".txt";
     myMatrixFile.open(myString.c_str());
-    flowsys.sys->Print(myMatrixFile);
+    fs.linsys.sys->Print(myMatrixFile);
     std::string myString2 ("Epetra_Sparsity_Pattern");
     myString2 = myString2 + asctime(timeinfo) + ".ps";
-    Ifpack_PrintSparsity(*flowsys.sys,myString2.c_str());
+    Ifpack_PrintSparsity(*fs.linsys.sys,myString2.c_str());
     myMatrixFile.close();
 #endif
 
-    flowsys.solve();
-  
-    flownet.press.resize(flownet.num_vertices());
-    
-    for (int i=0; i<flownet.num_vertices(); ++i) flownet.press[i] = flowsys.lhs_get(i);
     SetFlowValues(&vl, flownet, cond, flownet.press, flownet.hema);
     
 #if 0
     {
-      Epetra_Vector residuals(flowsys.lhs->Map(), true);
-      flowsys.sys->Multiply(false, *flowsys.lhs, residuals);
-      residuals.Update(-1., *flowsys.rhs, 1.);
+      Epetra_Vector residuals(fs.linsys.lhs->Map(), true);
+      fs.linsys.sys->Multiply(false, *fs.linsys.lhs, residuals);
+      residuals.Update(-1., *fs.linsys.rhs, 1.);
     
       std::ofstream f("failsol.txt");
-      f << format("%i x %i matrix)") % flowsys.sys->NumGlobalRows() % flowsys.sys->NumGlobalCols() << endl;
+      f << format("%i x %i matrix)") % fs.linsys.sys->NumGlobalRows() % fs.linsys.sys->NumGlobalCols() << endl;
       for (int i=0; i<flownet.num_vertices(); ++i)
       {
         int cnt;
         double *values;
         int *indices;
-        flowsys.sys->ExtractMyRowView(i, cnt, values, indices);
+        fs.linsys.sys->ExtractMyRowView(i, cnt, values, indices);
         f << format("m[%i,...] = ") % i;
         for (int k=0; k<cnt; ++k) f << format("%10i ") % indices[k];
         f << "\n";
         f << "             ";
         for (int k=0; k<cnt; k++) f << format("%.10lf ") % values[k];
         f << "\n";
-        //f << format(" lhs = %.20lf rhs = %.20lf\n") %  flowsys.lhs_get(i) % residuals[i];
+        //f << format(" lhs = %.20lf rhs = %.20lf\n") %  fs.linsys.lhs_get(i) % residuals[i];
       }
       f.flush();
       std::exit(0);
@@ -394,7 +389,7 @@ void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &bloodFlowParame
   if (!ok)
   {
     ComputeCirculatedComponents(&vl);
-    CalcFlowSimple(vl, bloodFlowParameters, keepTheVesselHematocrit);
+    CalcFlowSimple(vl, bloodFlowParameters, keepTheVesselHematocrit, flowsys);
   }
 }
 
@@ -437,17 +432,29 @@ class HematocritCalculator
     return make_node_neighbor(edge.first==i ? edge.second : edge.first, id_of_edge);
   }
 
-  void UpdateHematocritRecursive(int iv, int ind_up);
+  // nodes sorted by decreasing pressure, i.e. in flow direction, and grouped into levels
+  // so that nodes of the same level are not adjacent. Nodes of level k are
+  // node_order[level_offsets[k]] ... node_order[level_offsets[k+1]-1].
+  DynArray<int> node_order, level_offsets;
+
+  int  GetUpstreamNode(int i) const
+  {
+    const my::eqpair<int> &e = GetEdge(i);
+    return (GetPress(e.first) > GetPress(e.second)) ? e.first : e.second;
+  }
+  void ComputeNodeOrder();
+  void UpdateHematocritAtUpstreamNode(int ind);
   void UpdateHematocritAtNode(int ind, int iv);
 
 public:
   bool check_hematocrit_range;
+  int min_nodes_per_level_for_parallel; // the nodes of a level are processed in parallel if there are at least this many on average
   HematocritCalculator(CompressedFlowNetwork &fl, const FlArray &flow, const FlArray &press, const FlReal h0);
   void UpdateHematocrit();
 };
 
 HematocritCalculator::HematocritCalculator(CompressedFlowNetwork &fl_, const FlArray &flow_, const FlArray &press_, const FlReal h0_) :
-  nw(fl_), flow(flow_), press(press_), h0(h0_), iteration_id(0), check_hematocrit_range(false)
+  nw(fl_), flow(flow_), press(press_), h0(h0_), iteration_id(0), check_hematocrit_range(false), min_nodes_per_level_for_parallel(1024)
 {
   int ecnt = nw.edges.size();
   int ncnt = nw.num_vertices();
@@ -486,40 +493,95 @@ void HematocritCalculator::SetHematocrit(int i,FlReal x) const
 }
 
 
+struct HematocritNodeOrderCompare
+{
+  const FlArray &press;
+  HematocritNodeOrderCompare(const FlArray &press_) : press(press_) {}
+  // decreasing pressure, ties broken by index, so it is a strict total order
+  bool operator()(int a, int b) const { return press[a] > press[b] || (press[a] == press[b] && a < b); }
+};
+
+
+void HematocritCalculator::ComputeNodeOrder()
+{
+  // Blood flows from high to low pressure. So a node comes after all of its
+  // upstream neighbors if the nodes are sorted by decreasing pressure.
+  const int ncnt = nw.num_vertices();
+  HematocritNodeOrderCompare before(press);
+  DynArray<int> sorted(ncnt);
+  for (int i=0; i<ncnt; ++i) sorted[i] = i;
+  std::sort(sorted.begin(), sorted.end(), before);
+
+  // level = length of the longest chain of preceding neighbors
+  DynArray<int> level(ncnt, 0);
+  int num_levels = 0;
+  for (int k=0; k<ncnt; ++k)
+  {
+    const int i = sorted[k];
+    for (int j=0; j<GetNeighborCount(i); ++j)
+    {
+      const int nb = GetNeighbor(i, j).node;
+      if (before(nb, i))
+        level[i] = std::max(level[i], level[nb]+1);
+    }
+    num_levels = std::max(num_levels, level[i]+1);
+  }
+
+  // group by level (stable, so the pressure order is kept within levels)
+  level_offsets.resize(num_levels+1);
+  level_offsets.fill(0);
+  for (int i=0; i<ncnt; ++i)
+    level_offsets[level[i]+1]++;
+  for (int l=0; l<num_levels; ++l)
+    level_offsets[l+1] += level_offsets[l];
+  node_order.resize(ncnt);
+  DynArray<int> fill_pos(num_levels);
+  std::copy(level_offsets.begin(), level_offsets.end()-1, fill_pos.begin());
+  for (int k=0; k<ncnt; ++k)
+  {
+    const int i = sorted[k];
+    node_order[fill_pos[level[i]]++] = i;
+  }
+}
+
+
 void HematocritCalculator::UpdateHematocrit()
 {
+  // Visits nodes in flow direction, so the hematocrit of the inflowing
+  // vessels is always known when a node is evaluated. The order is
+  // recomputed for each call since the pressure changes between calls.
   ++iteration_id;
   nw.hema.fill(-1.);
-  for (int i=0; i<nw.num_edges(); ++i)
+  ComputeNodeOrder();
+  const int num_levels = level_offsets.size()-1;
+  if (my::GetNumThreads() > 1 && node_order.size() >= num_levels*min_nodes_per_level_for_parallel)
   {
-    if (markers[i] == iteration_id) continue;
-    const my::eqpair<int> &e = GetEdge(i);
-    int upstream_node = (GetPress(e.first) > GetPress(e.second)) ? e.first : e.second;
-    UpdateHematocritRecursive(i, upstream_node);
+    // nodes of one level are not adjacent, so they write to different vessels
+    for (int l=0; l<num_levels; ++l)
+    {
+      #pragma omp parallel for schedule(dynamic, 256)
+      for (int k=level_offsets[l]; k<level_offsets[l+1]; ++k)
+        UpdateHematocritAtUpstreamNode(node_order[k]);
+    }
+  }
+  else
+  {
+    for (int k=0; k<node_order.size(); ++k)
+      UpdateHematocritAtUpstreamNode(node_order[k]);
   }
 }
 
 
-void HematocritCalculator::UpdateHematocritRecursive( int edge_id, int upstream_node )
+void HematocritCalculator::UpdateHematocritAtUpstreamNode( int upstream_node )
 {
-  // upstream_node is the node of edge_id which is more upstream than the other
-  // we march through the vessel graph against the stream
-  // at the upmost nodes the hematocrit is set to the initial value
-  // when the function call stack is rewound all the hematocrit values are computed
-  // in the correct order in downstream direction
-  if( markers[edge_id]==iteration_id ) return;
-
-  if( !IsBoundary(upstream_node) ) // compute upstream segments
+  // computes the hematocrit of the vessels which have upstream_node as their upstream node
+  for( int k=0; k<GetNeighborCount(upstream_node); ++k )
   {
-    for( int k=0; k<GetNeighborCount(upstream_node); ++k )
-    {      
-      NodeNeighbor<int,int> nb = GetNeighbor(upstream_node,k);
-      if (GetPress(nb.node)<=GetPress(upstream_node)) continue; // do not go downstream
-      UpdateHematocritRecursive( nb.edge, nb.node ); // this is an upstream edge, go further upstream
-    }
+    const int edge_id = GetNeighbor(upstream_node, k).edge;
+    if( markers[edge_id]==iteration_id ) continue;
+    if( GetUpstreamNode(edge_id) != upstream_node ) continue;
+    UpdateHematocritAtNode(upstream_node, edge_id);
   }
-  if( markers[edge_id]==iteration_id ) return;
-  UpdateHematocritAtNode(upstream_node, edge_id);
 }
 
 
@@ -701,7 +763,7 @@ void HematocritCalculator::UpdateHematocritAtNode( int upstream_node, int edge_i
 
 
 
-void CalcFlowWithPhaseSeparation(VesselList3d &vl, const BloodFlowParameters &bloodFlowParameters)
+void CalcFlowWithPhaseSeparation(VesselList3d &vl, const BloodFlowParameters &bloodFlowParameters, FlowSystem *flowsys)
 {
 #ifndef SILENT
   cout << "calcflow (with hematocrit)" << endl;
@@ -718,13 +780,11 @@ void CalcFlowWithPhaseSeparation(VesselList3d &vl, const BloodFlowParameters &bl
     FlArray hema_last(flownet.num_edges(), getNAN<FlReal>()), flow_last(flownet.num_edges(), getNAN<FlReal>());
 
     HematocritCalculator hematocritCalculator(flownet, flownet.flow, flownet.press, bloodFlowParameters.inletHematocrit);
-    Linsys flowsys;
-    flowsys.initialize_pattern(flownet.num_vertices(), flownet.edges);
-    flowsys.scaling_const = CalcFlowCoeff(bloodFlowParameters.viscosityPlasma, 4., 100.);
-    EllipticEquationSolver solver;
+    FlowSystem local_flowsys;
+    FlowSystem &fs = flowsys ? *flowsys : local_flowsys;
+    fs.set_network(flownet.num_vertices(), flownet.edges, CalcFlowCoeff(bloodFlowParameters.viscosityPlasma, 4., 100.));
     ptree solver_params = make_ptree("output", 1)("preconditioner","multigrid")("use_smoothed_aggregation", false)("max_iter", 200)("throw",false)("conv","rhs")("max_resid",1.e-10);
 
-    int last_solver_iterations = std::numeric_limits<int>::max();
     /* note:
      * earlier we initialized with nan.
      * This worked for the gxx but not for icc
@@ -739,16 +799,8 @@ void CalcFlowWithPhaseSeparation(VesselList3d &vl, const BloodFlowParameters &bl
       CalcViscosities(flownet.rad, flownet.hema, bloodFlowParameters, visc);
       CalcConductivities(flownet.rad, flownet.len, visc, cond);
 
-      flowsys.fill_values(flownet.edges, cond, flownet.bcs);
-
-      solver_params.put("keep_preconditioner", iteration>3 && last_solver_iterations<15); // && solver.time_iteration<solver.time_precondition);
-      solver.init(*flowsys.sys, *flowsys.rhs, solver_params);
-      solver.solve(*flowsys.lhs);
-      last_solver_iterations = solver.iteration_count;
-
-      flowsys.clear_values();
-
-      for (int i=0; i<flownet.num_vertices(); ++i) flownet.press[i] = flowsys.lhs_get(i);
+      // the preconditioner is kept while the solver converges fast with it
+      fs.solve(cond, flownet.bcs, flownet.press, solver_params);
 
       SetFlowValues(&vl, flownet, cond, flownet.press, flownet.hema);
       ok = MarkFailingVesselHidden(vl);
@@ -802,18 +854,18 @@ void CalcFlowWithPhaseSeparation(VesselList3d &vl, const BloodFlowParameters &bl
   if (!ok)
   {
     ComputeCirculatedComponents(&vl);
-    CalcFlowWithPhaseSeparation(vl, bloodFlowParameters);
+    CalcFlowWithPhaseSeparation(vl, bloodFlowParameters, flowsys);
   }
 }
 
 
-void CalcFlow(VesselList3d &vl, const BloodFlowParameters &params)
+void CalcFlow(VesselList3d &vl, const BloodFlowParameters &params, FlowSystem *flowsys)
 {
   ComputeCirculatedComponents(&vl);
   if (params.includePhaseSeparationEffect)
-    CalcFlowWithPhaseSeparation(vl, params);
+    CalcFlowWithPhaseSeparation(vl, params, flowsys);
   else
-    CalcFlowSimple(vl, params, false);
+    CalcFlowSimple(vl, params, false, flowsys);
 }
 
 
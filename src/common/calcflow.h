@@ -123,8 +123,11 @@ struct FlowBC
 };
 
 
-void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &params, bool keepTheVesselHematocrit); // Either override the vessel hematocrit with a constant or leave the vessel hematocrit values alone and just compute pressure, flow and force using the segments hematocrit
-void CalcFlow(VesselList3d &vl, const BloodFlowParameters &params);
+struct FlowSystem; // see calcflow_linsys.h
+
+// flowsys (optional) keeps the linear system between calls, for repeated computations on the same network
+void CalcFlowSimple(VesselList3d &vl, const BloodFlowParameters &params, bool keepTheVesselHematocrit, FlowSystem *flowsys = NULL); // Either override the vessel hematocrit with a constant or leave the vessel hematocrit values alone and just compute pressure, flow and force using the segments hematocrit
+void CalcFlow(VesselList3d &vl, const BloodFlowParameters &params, FlowSystem *flowsys = NULL);
 void ChangeBoundaryConditions(VesselList3d &vl);
 bool MarkFailingVesselHidden(VesselList3d &vl);
 #endif // CALCFLOW_H
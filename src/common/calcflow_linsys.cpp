@@ -34,10 +34,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include <EpetraExt_VectorOut.h>
 #include <mwlib/timer.h>
 #include "calcflow_linsys.h"
+#include <algorithm>
 
 using boost::property_tree::ptree;
 using boost::property_tree::make_ptree;
 
+static int FindRowSlot(int cnt, const int *indices, int col)
+{
+  for (int k=0; k<cnt; ++k)
+    if (indices[k] == col) return k;
+  myAssert(false);
+  return -1;
+}
+
 void Linsys::initialize_pattern(int num_vertices, const std::vector< my::eqpair< int > >& edges)
 {
     std::vector<int> column_cnt(num_vertices, 1);
@@ -76,6 +85,28 @@ void Linsys::initialize_pattern(int num_vertices, const std::vector< my::eqpair<
     rhs.reset(new Epetra_Vector(epetra_map));
     lhs.reset(new Epetra_Vector(epetra_map));
     //scaling_const = 1.;
+
+    // the pattern is fixed, so the row storage stays where it is
+    row_values.resize(num_vertices);
+    diag_slot.resize(num_vertices);
+    for (int i=0; i<num_vertices; ++i)
+    {
+      int cnt, *indices;
+      sys->ExtractMyRowView(i, cnt, row_values[i], indices);
+      diag_slot[i] = FindRowSlot(cnt, indices, i);
+    }
+    edge_slot.resize(2*edges.size());
+    for (int i=0; i<edges.size(); ++i)
+    {
+      int a = edges[i].first, b = edges[i].second, cnt, *indices;
+      double *values;
+      sys->ExtractMyRowView(a, cnt, values, indices);
+      edge_slot[2*i] = FindRowSlot(cnt, indices, b);
+      sys->ExtractMyRowView(b, cnt, values, indices);
+      edge_slot[2*i+1] = FindRowSlot(cnt, indices, a);
+    }
+    pinned_nodes.clear();
+    pinned_entries.clear();
 }
 void Linsys::sys_add(int a, int b, double val)
 {
@@ -120,12 +151,51 @@ void Linsys::fill_edge_values(int a, int b, FlReal coeff_diag, FlReal coeff_offd
 void Linsys::fill_values(std::vector< my::eqpair< int > >& edges, const FlArray& cond, const Linsys::BcsMap& bcs)
 {
   // sum_i w_i (p_i - p_0) = in_flussW
+  // same as fill_edge_values, but with the positions from initialize_pattern
+  myAssert(edge_slot.size() == 2*edges.size());
   for (int i=0; i<edges.size(); ++i)
   {
-    fill_edge_values(edges[i].first, edges[i].second, cond[i], bcs);
+    const int a = edges[i].first, b = edges[i].second;
+    const double c = cond[i];
+    row_values[a][diag_slot[a]] -= c;
+    row_values[b][diag_slot[b]] -= c;
+    row_values[a][edge_slot[2*i]] += c;
+    row_values[b][edge_slot[2*i+1]] += c;
   }
   end_filling(bcs);
 }
+void Linsys::update_pinned_entries(const Linsys::BcsMap& bcs)
+{
+  std::vector<int> nodes;
+  for(BcsMap::const_iterator bc = bcs.begin(); bc != bcs.end(); ++bc)
+  {
+    if (bc->second.type == FlowBC::PIN)
+      nodes.push_back(bc->first);
+  }
+  std::sort(nodes.begin(), nodes.end());
+  if (nodes == pinned_nodes) return;
+
+  pinned_nodes.swap(nodes);
+  pinned_entries.clear();
+  for (int i=0; i<pinned_nodes.size(); ++i)
+  {
+    const int id = pinned_nodes[i];
+    int cnt, *indices;
+    double *values;
+    sys->ExtractMyRowView(id, cnt, values, indices);
+    for (int k=0; k<cnt; ++k)
+    {
+      const int otherid = indices[k];
+      // rows of pinned nodes are replaced completely
+      if (std::binary_search(pinned_nodes.begin(), pinned_nodes.end(), otherid)) continue;
+      int othercnt, *other_indices;
+      double *other_values;
+      sys->ExtractMyRowView(otherid, othercnt, other_values, other_indices);
+      PinnedEntry e = { otherid, FindRowSlot(othercnt, other_indices, id), id };
+      pinned_entries.push_back(e);
+    }
+  }
+}
 void Linsys::end_filling(const Linsys::BcsMap& bcs)
 {
     //scaling_const /= sys->NumGlobalRows();
@@ -138,49 +208,31 @@ void Linsys::end_filling(const Linsys::BcsMap& bcs)
     }
 #endif
 #endif
+    // Pinned nodes get their value also during the matrix solve. Their row becomes the identity.
+    // The entries of their column go to the rhs of the other rows, so the matrix stays symmetric.
+    update_pinned_entries(bcs);
+    for (int i=0; i<pinned_entries.size(); ++i)
+    {
+      const PinnedEntry &e = pinned_entries[i];
+      double &coeff = row_values[e.row][e.slot];
+      rhs_add(e.row, -coeff * bcs.find(e.node)->second.val);
+      coeff = 0.;  // no contribution from pinned value
+    }
+    for (int i=0; i<pinned_nodes.size(); ++i)
+    {
+      const int id = pinned_nodes[i];
+      int cnt;
+      double *values;
+      sys->ExtractMyRowView(id, cnt, values);
+      std::fill(values, values+cnt, 0.);  // clear all row values
+      sys_set(id, id, 1. * -scaling_const); // set diagonal, must be negative, otherwise the matrix is not pos. definite
+      rhs_set(id, bcs.find(id)->second.val * -scaling_const);
+    }
     for(BcsMap::const_iterator bc = bcs.begin(); bc != bcs.end(); ++bc)
     {
-      // Add elements to the matrix at the place of the boundary node. So boundary nodes get their value also during the matrix solve.
       int id = bc->first;
       const FlowBC &bcx = bc->second;
-      if (bcx.type == FlowBC::PIN)
-      {
-        int cnt;
-        #if 0
-        // leave the matrix unsymmetric -> probably bad
-        // note: it IS bad
-        double *values;
-        sys->ExtractGlobalRowView(id, cnt, values);
-        for (int i=0; i<cnt; ++i) values[i] = 0.;  // clear all row values
-        sys_set(id, id, 1. * -scaling_const); // set diagonal, must be negative, otherwise the matrix is not pos. definite
-        rhs_set(id, bcx.val * -scaling_const);
-        #else
-        double *values;
-        int *indices;
-        sys->ExtractMyRowView(id, cnt, values, indices);
-        for (int i=0; i<cnt; ++i)
-        {
-          values[i] = 0.;  // clear all row values
-          // remove entry from other rows
-          int othercnt, otherid = indices[i];
-          double *other_values;
-          int *other_indices;
-          sys->ExtractMyRowView(otherid, othercnt, other_values, other_indices);
-          for (int j=0; j<othercnt; ++j)
-          {
-            if (other_indices[j] == id)
-            {
-              double coeff = other_values[j];
-              other_values[j] = 0.;  // no contribution from pinned value
-              rhs_add(otherid, -coeff * bcx.val);
-            }
-          }
-        }
-        sys_set(id, id, 1. * -scaling_const); // set diagonal, must be negative, otherwise the matrix is not pos. definite
-        rhs_set(id, bcx.val * -scaling_const);
-        #endif
-      }
-      else if (bcx.type == FlowBC::CURRENT)
+      if (bcx.type == FlowBC::CURRENT)
       {
         rhs_add(id, bcx.val);
       }
@@ -214,6 +266,66 @@ void Linsys::solve()
 }
 
 
+
+FlowSystem::FlowSystem() :
+  num_vertices(-1), have_preconditioner(false), max_iterations_for_preconditioner_reuse(15),
+  last_iteration_count(0), num_solves(0), num_pattern_builds(0)
+{
+  solver_params = make_ptree("output", true)("max_iter", 1000)("throw",false)("conv","rhs")("max_resid",1.e-14)("solver","cg")("preconditioner","multigrid")("use_smoothed_aggregation", false);
+}
+
+bool FlowSystem::set_network(int num_vertices_, const std::vector<my::eqpair<int> > &edges_, double scaling_const)
+{
+  linsys.scaling_const = scaling_const;
+  if (linsys.sys.get() && num_vertices_ == num_vertices && edges_ == edges)
+    return false;
+  num_vertices = num_vertices_;
+  edges = edges_;
+  linsys.initialize_pattern(num_vertices, edges);
+  linsys.lhs->PutScalar(0.);
+  have_preconditioner = false;
+  ++num_pattern_builds;
+  return true;
+}
+
+void FlowSystem::solve(const FlArray &cond, const BcsMap &bcs, FlArray &press, const ptree &params)
+{
+  myAssert(linsys.sys.get() && cond.size() == edges.size());
+  linsys.clear_values();
+  linsys.fill_values(edges, cond, bcs);
+
+  bool reuse = have_preconditioner && last_iteration_count <= max_iterations_for_preconditioner_reuse;
+  if (!reuse)
+    solver.reset_preconditioner();
+  ptree pt = params.empty() ? solver_params : params;
+  const bool throw_on_failure = pt.get<bool>("throw", true);
+  pt.put("keep_preconditioner", true);
+  pt.put("throw", false); // failures are handled below, after the retry
+  Epetra_Vector lhs_start(*linsys.lhs);
+  solver.init(*linsys.sys, *linsys.rhs, pt);
+  solver.solve(*linsys.lhs); // starts from the last solution
+  if (!solver.convergent && reuse)
+  {
+    // the old preconditioner may not fit the new conductivities
+    solver.reset_preconditioner();
+    linsys.lhs->Update(1., lhs_start, 0.);
+    solver.init(*linsys.sys, *linsys.rhs, pt);
+    solver.solve(*linsys.lhs);
+  }
+  have_preconditioner = solver.convergent;
+  last_iteration_count = solver.iteration_count;
+  ++num_solves;
+  if (!solver.convergent && throw_on_failure)
+  {
+    int reason = solver.iteration_count >= pt.get<int>("max_iter", 50) ? ConvergenceFailureException::MAX_ITERATIONS : ConvergenceFailureException::OTHER;
+    throw ConvergenceFailureException("flow system solve did not converge", reason);
+  }
+
+  press.resize(num_vertices);
+  for (int i=0; i<num_vertices; ++i) press[i] = linsys.lhs_get(i);
+}
+
+
 // struct Linsys
 // {
 //   
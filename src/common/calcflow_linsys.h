@@ -53,6 +53,19 @@ struct Linsys
   std::auto_ptr<Vector> rhs, lhs;
   double scaling_const;
 
+  // positions of the matrix entries, computed in initialize_pattern, so that
+  // fill_values does not have to search the rows
+  std::vector<double*> row_values; // points into the storage of sys
+  std::vector<int> diag_slot; // position of the diagonal in each row
+  std::vector<int> edge_slot; // for edge i (a,b): position of b in row a at 2i, of a in row b at 2i+1
+
+  // entries coupling pinned nodes to other rows, recomputed in end_filling
+  // only when the set of pinned nodes changes
+  struct PinnedEntry { int row, slot, node; };
+  std::vector<int> pinned_nodes;
+  std::vector<PinnedEntry> pinned_entries;
+  void update_pinned_entries(const BcsMap &bcs);
+
   Linsys() : scaling_const(0.) {}
   
   void initialize_pattern(int num_vertices, const std::vector<my::eqpair<int> > &edges);
@@ -73,4 +86,37 @@ struct Linsys
   void solve();
 };
 
+
+/*
+  Keeps the sparsity pattern, the matrix and the preconditioner of the flow
+  system between solves on the same network, so that only the conductivities
+  and boundary values are filled in again. Each solve starts from the last
+  solution. The preconditioner is rebuilt when the solver needed more than
+  max_iterations_for_preconditioner_reuse iterations with the old one, or
+  when the solve with the old one did not converge. If the solver does not
+  converge with a new preconditioner, solve throws ConvergenceFailureException
+  if the solver parameters ask for it ("throw"), else it returns the last
+  iterate like SolveEllipticEquation.
+*/
+struct FlowSystem : boost::noncopyable
+{
+  typedef Linsys::BcsMap BcsMap;
+
+  Linsys linsys;
+  EllipticEquationSolver solver;
+  ptree solver_params;
+  std::vector<my::eqpair<int> > edges;
+  int num_vertices;
+  bool have_preconditioner;
+  int max_iterations_for_preconditioner_reuse;
+  // statistics
+  int last_iteration_count, num_solves, num_pattern_builds;
+
+  FlowSystem();
+  // rebuilds the pattern if the network differs from the last one, returns true if so
+  bool set_network(int num_vertices, const std::vector<my::eqpair<int> > &edges, double scaling_const);
+  // params, if not empty, are used instead of solver_params for this solve
+  void solve(const FlArray &cond, const BcsMap &bcs, FlArray &press, const ptree &params = ptree());
+};
+
 #endif //CALCFLOW_LINSYS_H
\ No newline at end of file
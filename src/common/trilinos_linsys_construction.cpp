@@ -505,6 +505,13 @@ void EllipticEquationSolver::solve ( Epetra_Vector& lhs )
   }
   solver_impl.reset();
 }
+
+
+void EllipticEquationSolver::reset_preconditioner()
+{
+  prec.reset(NULL);
+  ifpackprec.reset(NULL);
+}
 #endif
 
 
@@ -384,6 +384,7 @@ class EllipticEquationSolver : boost::noncopyable
 public:
   void init(const Epetra_Operator &matrix, const Epetra_Vector &rhs, const boost::property_tree::ptree &params);
   void solve(Epetra_Vector &lhs);
+  void reset_preconditioner(); // the next init builds a new one, even with keep_preconditioner
   double time_precondition, time_iteration;
   int iteration_count;
   bool convergent;
@@ -1227,13 +1227,32 @@ void ComputePO2(const Parameters &params,
 		VesselPO2Storage &vesselpo2, 
 		const TissuePhases &phases,
 		ptree &metadata,
-		bool world
+		bool world,
+		const Array3df *po2field_init,
+		const VesselPO2Storage *vesselpo2_init,
+		ComputePO2Workspace *workspace
                )
 {
-  DynArray<const Vessel*> sorted_vessels;
-  DynArray<const VesselNode*> roots;
-  //executes topological ordering
-  PrepareNetworkInfo(vl, sorted_vessels, roots);
+  ComputePO2Workspace local_workspace;
+  ComputePO2Workspace &ws = workspace ? *workspace : local_workspace;
+  DynArray<const Vessel*> &sorted_vessels = ws.sorted_vessels;
+  DynArray<const VesselNode*> &roots = ws.roots;
+  //sets up the linear trilionos matrix system, builder is implemented as struct
+  //could use for example different stencils
+  FiniteVolumeMatrixBuilder &tissue_diff_matrix_builder = ws.tissue_diff_matrix_builder;
+  //eqation solver is also implemented as struct
+  EllipticEquationSolver &tissue_diff_solver = ws.tissue_diff_solver;
+  if (!ws.initialized)
+  {
+    //executes topological ordering
+    PrepareNetworkInfo(vl, sorted_vessels, roots);
+#if APPROXIMATE_FEM_TRANSVASCULAR_EXCHANGE_TERMS
+    tissue_diff_matrix_builder.Init7Point(grid.ld, grid.dim);
+#else
+    tissue_diff_matrix_builder.Init27Point(grid.ld, grid.dim);
+#endif
+    ws.initialized = true;
+  }
   
   //set up field with same discrete points as in the given grid, leave data memory uninitialized
   //po2field is declared by mother function by not initialized, that happening here
@@ -1242,35 +1261,43 @@ void ComputePO2(const Parameters &params,
   
   vesselpo2.resize(vl.GetECount(), Float2(NANf()));
 
-  //sets up the linear trilionos matrix system, builder is implemented as struct
-  //could use for example different stencils
-  FiniteVolumeMatrixBuilder tissue_diff_matrix_builder;
-  //eqation solver is also implemented as struct
-  EllipticEquationSolver tissue_diff_solver;
+  // warm start from a previous solution, given the sizes match
+  bool warm_start_field = po2field_init && ::Size(po2field_init->getBox()) == ::Size(grid.Box());
+  if (warm_start_field)
+  {
+    const Int3 offset = po2field_init->getBox().min - grid.Box().min;
+    FOR_BBOX3(p, grid.Box())
+      po2field(p) = std::max(0.f, (*po2field_init)(p + offset));
+  }
+  else if (po2field_init)
+    cout << "ComputePO2: initial po2 field does not match the grid, starting from scratch" << endl;
+  bool warm_start_vessels = vesselpo2_init && vesselpo2_init->size() == vl.GetECount();
+  if (vesselpo2_init && !warm_start_vessels)
+    cout << "ComputePO2: initial vessel po2 does not match the vessel list, starting from scratch" << endl;
+  metadata.put("warm_start_field", warm_start_field);
+  metadata.put("warm_start_vessels", warm_start_vessels);
 
-#if APPROXIMATE_FEM_TRANSVASCULAR_EXCHANGE_TERMS
-  tissue_diff_matrix_builder.Init7Point(grid.ld, grid.dim);
-#else
-  tissue_diff_matrix_builder.Init27Point(grid.ld, grid.dim);
-#endif
-  
   //buffer within consecutive runs
   Array3df last_po2field(grid.Box());
   //maybe 0 or prams.po2init_cutoff
   last_po2field.fill(po2field);
   // an other buffer
   DynArray<Float2> last_vessel_po2(vl.GetECount(), Float2(0.));//begining and end 0.
+  if (warm_start_vessels)
+    last_vessel_po2 = *vesselpo2_init;
 
   metadata.add_child("iterations", ptree());
   
   ConvergenceCriteriumAccumulator2Norm<double> delta_field2, delta_vess2;
   ConvergenceCriteriumAccumulatorMaxNorm<double> delta_fieldM, delta_vessM;
   
+  int num_iterations = 0;
   /*
    * ****** MAIN LOOP **********
    */
   for (int iteration_num = 0;; ++iteration_num)
   {
+    num_iterations = iteration_num;
     if (!params.debug_fn.empty() && ((iteration_num % 1) == 0) && iteration_num>0)
     {
       h5cpp::File f(params.debug_fn, iteration_num==0 ? "w" : "a");
@@ -1304,12 +1331,14 @@ void ComputePO2(const Parameters &params,
                   tissue_diff_matrix_builder);
     }
     
-    bool keep_preconditioner = (iteration_num>2 && tissue_diff_solver.iteration_count<25);
+    // a preconditioner from a previous computation with other parameters is a good start, too
+    bool keep_preconditioner = ((iteration_num>2 || ws.have_preconditioner) && tissue_diff_solver.iteration_count<25);
     
     /*
      * 2) propagate the oxygen from the blood stream to the tissue
      */
     ComputePo2Field(params, grid, mtboxes, phases, po2field, tissue_diff_matrix_builder, tissue_diff_solver, keep_preconditioner);
+    ws.have_preconditioner = true;
     
     /*
      * From here on the results are handled
@@ -1364,6 +1393,7 @@ void ComputePO2(const Parameters &params,
     if (my::checkAbort())
       return;
   }//end loop nointerations
+  metadata.put("num_iterations", num_iterations);
   if (params.loglevel == 0)
     cout << endl;
   else
@@ -25,6 +25,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include "common/shared-objects.h"
 #include "common/continuum-grid.h"
 #include "common/vessels3d.h"
+#include "common/trilinos_linsys_construction.h"
 
 
 namespace DetailedPO2
@@ -135,7 +136,23 @@ struct TissuePhases
 };
 
 
-void ComputePO2(const Parameters &params, VesselList3d& vl, ContinuumGrid &grid, DomainDecomposition &mtboxes, Array3df &po2field, VesselPO2Storage &storage, const TissuePhases &phases, ptree &metadata, bool world);
+/* Things which can be shared by consecutive ComputePO2 calls for the same vessel list
+   (including flow) and grid, e.g. for several parameter sets: the topological ordering
+   of the network, the structure of the tissue matrix and the preconditioner. */
+struct ComputePO2Workspace : boost::noncopyable
+{
+  ComputePO2Workspace() : initialized(false), have_preconditioner(false) {}
+  bool initialized, have_preconditioner;
+  DynArray<const Vessel*> sorted_vessels;
+  DynArray<const VesselNode*> roots;
+  FiniteVolumeMatrixBuilder tissue_diff_matrix_builder;
+  EllipticEquationSolver tissue_diff_solver;
+};
+
+/* po2field_init and vesselpo2_init are an optional initial state, e.g. the result for a similar configuration.
+   They are ignored if their size does not match the grid or the vessel list, respectively.
+   workspace is optional, see ComputePO2Workspace. */
+void ComputePO2(const Parameters &params, VesselList3d& vl, ContinuumGrid &grid, DomainDecomposition &mtboxes, Array3df &po2field, VesselPO2Storage &storage, const TissuePhases &phases, ptree &metadata, bool world, const Array3df *po2field_init = NULL, const VesselPO2Storage *vesselpo2_init = NULL, ComputePO2Workspace *workspace = NULL);
 double ComputeCircumferentialMassTransferCoeff(const Parameters &params, double r);
 
 typedef Eigen::Matrix<float, 5, 1> VesselPO2SolutionRecord; //x, po2, ext_po2, conc_flux, dS/dx;
@@ -337,27 +337,32 @@ static void PyComputePO2world(py::object py_vesselgroup, py::object py_tumorgrou
 #endif
 
 
-/** 
- * @brief Callback for the main functions
- * 
- * Calls the important stuff.
+/**
+ * @brief Vessel list, grid and tissue phases of a po2 computation.
+ * They do not depend on the oxygen parameters, except for the grid settings,
+ * so they can be shared by computations with several parameter sets.
  */
-static void PyComputePO2(py::object py_vesselgroup, py::object py_tumorgroup, py::dict py_parameters, py::object py_bfparams, py::object py_h5outputGroup)
+struct PO2Problem
+{
+  std::auto_ptr<VesselList3d> vl;
+  ContinuumGrid grid;
+  DomainDecomposition mtboxes;
+  DetailedPO2::TissuePhases phases;
+};
+
+
+static void SetupPO2Problem(PO2Problem &problem, const DetailedPO2::Parameters &params, py::object py_vesselgroup, py::object py_tumorgroup, py::dict py_parameters, py::object py_bfparams)
 {
-  bool world = false;
-  DetailedPO2::Parameters params;
-  InitParameters(params, py_parameters);
-  
   //h5cpp::Group group = PythonToCppGroup(py_group);
   //h5cpp::Group vesselgroup = group.open_group(path_vessels);
   h5cpp::Group vesselgroup = PythonToCppGroup(py_vesselgroup);
   
   // THIIIIRYYYYY, filter muss = false sein sonst stimmt in der Ausgabe in der Hdf5 Datei die Anzahl der Vessels nicht mehr mit den daten im recomputed_flow Verzeichnis ueberein!
-  std::auto_ptr<VesselList3d> vl = ReadVesselList3d(vesselgroup, make_ptree("filter",false));
+  problem.vl = ReadVesselList3d(vesselgroup, make_ptree("filter",false));
+  VesselList3d *vl = problem.vl.get();
   
-  
-  ContinuumGrid grid;
-  DomainDecomposition mtboxes;
+  ContinuumGrid &grid = problem.grid;
+  DomainDecomposition &mtboxes = problem.mtboxes;
   double grid_lattice_const              = py::extract<double>(py_parameters.get("grid_lattice_const", 30.));
   double safety_layer_size               = py::extract<double>(py_parameters.get("safety_layer_size", grid_lattice_const*3.));
   boost::optional<Int3> grid_lattice_size = getOptional<Int3>("grid_lattice_size", py_parameters);
@@ -403,28 +408,45 @@ static void PyComputePO2(py::object py_vesselgroup, py::object py_tumorgroup, py
   }
   isVesselListGood(*vl);
 
-  Array3df po2field;
-  DetailedPO2::VesselPO2Storage po2vessels;
-  ptree metadata;
-
-  //cout << format("in c++: %.20f %.20f %.20f\n") % params.conductivity_coeff1 % params.conductivity_coeff2 % params.conductivity_coeff_gamma;
-  
   // Get to know where tumor is and where normal tissue is.
   // I.e. get volume fractions of each cell type.
   // after this call the 3D field phases is filled with
   // 3 vallues giving the portion of corresponding tissue type
-  DetailedPO2::TissuePhases phases;//Declaration
-  SetupTissuePhases(phases, grid, mtboxes, py_tumorgroup);//filling
-  
-  { //ReleaseGIL unlock(); // allow the python interpreter to do things while this is running
-  /**
-   * MOST IMPORTANT CALL
-   * grid is conitnuum grid, mtboxes is decomposition into threads
-   */
-  DetailedPO2::ComputePO2(params, *vl, grid, mtboxes, po2field, po2vessels, phases, metadata, world);
+  SetupTissuePhases(problem.phases, grid, mtboxes, py_tumorgroup);//filling
+}
+
+
+/**
+ * @brief initial state from a previous solution
+ * py_initial is None or a tuple (po2vessels, po2field, cold_iterations), where
+ * cold_iterations is the number of iterations which the computation took when
+ * started from scratch (or None if unknown). The data of po2field is not copied,
+ * so py_initial must be kept alive while po2field_init is used.
+ */
+static void ReadInitialState(py::object py_initial, boost::optional<Array3df> &po2field_init, boost::optional<DetailedPO2::VesselPO2Storage> &po2vessels_init, boost::optional<int> &cold_iterations)
+{
+  if (py_initial.is_none())
+    return;
+  py::object py_init_vessels = py_initial[0], py_init_field = py_initial[1], py_cold_iterations = py_initial[2];
+  if (!py_init_vessels.is_none())
+  {
+    np::arrayt<float> a(py_init_vessels);
+    po2vessels_init = DetailedPO2::VesselPO2Storage(a.shape()[0]);
+    for (int i=0; i<a.shape()[0]; ++i)
+      (*po2vessels_init)[i] = Float2(a(i, 0), a(i, 1));
   }
-  if (PyErr_Occurred() != NULL) return; // don't save stuff
-  
+  if (!py_init_field.is_none())
+  {
+    np::arrayt<float> a(py_init_field);
+    po2field_init = Array3dFromPy<float>(a);
+  }
+  if (!py_cold_iterations.is_none())
+    cold_iterations = py::extract<int>(py_cold_iterations);
+}
+
+
+static void WritePO2Output(py::object py_h5outputGroup, const ContinuumGrid &grid, const Array3df &po2field, DetailedPO2::VesselPO2Storage &po2vessels, const ptree &metadata)
+{
   //This writes the results back to python
 #if 0
   Int2 sz(2,po2vessels.size());
@@ -434,13 +456,137 @@ static void PyComputePO2(py::object py_vesselgroup, py::object py_tumorgroup, py
   
   return py::make_tuple(py_po2vessels, py_ld, py_po2field);
 #endif
+  h5cpp::Group outputGroup = PythonToCppGroup(py_h5outputGroup);
+  h5cpp::Group ldgroup = outputGroup.create_group("field_ld");
+  WriteHdfLd(ldgroup, grid.ld);
+  WriteScalarField<float>(outputGroup, "po2field", po2field, grid.ld, ldgroup);
+  h5cpp::create_dataset<float>(outputGroup, "po2vessels", h5cpp::Dataspace::simple_dims(po2vessels.size(), 2), (float*)po2vessels[0].data(), h5cpp::CREATE_DS_COMPRESSED); // FIX ME: transpose the array!
+  WriteHdfPtree(outputGroup, metadata, HDF_WRITE_PTREE_AS_DATASETS);
+}
+
+
+static void RecordIterationsSaved(ptree &metadata, const boost::optional<int> &cold_iterations)
+{
+  if (!cold_iterations) return;
+  metadata.put("cold_iterations", *cold_iterations);
+  metadata.put("iterations_saved", *cold_iterations - metadata.get<int>("num_iterations"));
+}
+
+
+/** 
+ * @brief Callback for the main functions
+ * 
+ * Calls the important stuff.
+ * py_initial is an optional initial state, see ReadInitialState.
+ */
+static void PyComputePO2(py::object py_vesselgroup, py::object py_tumorgroup, py::dict py_parameters, py::object py_bfparams, py::object py_h5outputGroup, py::object py_initial)
+{
+  bool world = false;
+  DetailedPO2::Parameters params;
+  InitParameters(params, py_parameters);
+
+  PO2Problem problem;
+  SetupPO2Problem(problem, params, py_vesselgroup, py_tumorgroup, py_parameters, py_bfparams);
+
+  Array3df po2field;
+  DetailedPO2::VesselPO2Storage po2vessels;
+  ptree metadata;
+
+  //cout << format("in c++: %.20f %.20f %.20f\n") % params.conductivity_coeff1 % params.conductivity_coeff2 % params.conductivity_coeff_gamma;
+
+  // initial state from a previous solution
+  boost::optional<Array3df> po2field_init;
+  boost::optional<DetailedPO2::VesselPO2Storage> po2vessels_init;
+  boost::optional<int> cold_iterations;
+  ReadInitialState(py_initial, po2field_init, po2vessels_init, cold_iterations);
+
+  { //ReleaseGIL unlock(); // allow the python interpreter to do things while this is running
+  /**
+   * MOST IMPORTANT CALL
+   * grid is conitnuum grid, mtboxes is decomposition into threads
+   */
+  DetailedPO2::ComputePO2(params, *problem.vl, problem.grid, problem.mtboxes, po2field, po2vessels, problem.phases, metadata, world,
+                          po2field_init ? po2field_init.get_ptr() : NULL,
+                          po2vessels_init ? po2vessels_init.get_ptr() : NULL);
+  }
+  if (PyErr_Occurred() != NULL) return; // don't save stuff
+
+  RecordIterationsSaved(metadata, cold_iterations);
+  WritePO2Output(py_h5outputGroup, problem.grid, po2field, po2vessels, metadata);
+}
+
+
+/**
+ * @brief po2 for several parameter sets on the same vessel network and tissue.
+ *
+ * The vessel list, grid and tissue phases are set up once, from the first
+ * parameter set. The parameter sets must therefore agree in the grid settings
+ * and in the blood flow parameters. The topological ordering of the network,
+ * the tissue matrix and the preconditioner of the tissue diffusion solver are
+ * shared by all computations. The result for parameter set i is written to
+ * py_h5outputGroups[i]. py_initial is an optional initial state for the first
+ * computation (see ReadInitialState). With warm_start, each further computation
+ * starts from the result of the previous one.
+ */
+static void PyComputePO2Batch(py::object py_vesselgroup, py::object py_tumorgroup, py::list py_parameters_list, py::object py_bfparams, py::list py_h5outputGroups, py::object py_initial, bool warm_start)
+{
+  bool world = false;
+  const int num_sets = py::len(py_parameters_list);
+  if (num_sets != py::len(py_h5outputGroups))
+    throw std::invalid_argument("number of parameter sets and output groups differ");
+  if (num_sets == 0)
+    return;
+
+  py::dict py_parameters0 = py::extract<py::dict>(py_parameters_list[0]);
+  DetailedPO2::Parameters params0;
+  InitParameters(params0, py_parameters0);
+
+  PO2Problem problem;
+  SetupPO2Problem(problem, params0, py_vesselgroup, py_tumorgroup, py_parameters0, py_bfparams);
+
+  DetailedPO2::ComputePO2Workspace workspace;
+
+  boost::optional<Array3df> po2field_init;
+  boost::optional<DetailedPO2::VesselPO2Storage> po2vessels_init;
+  boost::optional<int> cold_iterations;
+  ReadInitialState(py_initial, po2field_init, po2vessels_init, cold_iterations);
+
+  for (int k=0; k<num_sets; ++k)
   {
-    h5cpp::Group outputGroup = PythonToCppGroup(py_h5outputGroup);
-    h5cpp::Group ldgroup = outputGroup.create_group("field_ld");
-    WriteHdfLd(ldgroup, grid.ld);
-    WriteScalarField<float>(outputGroup, "po2field", po2field, grid.ld, ldgroup);
-    h5cpp::create_dataset<float>(outputGroup, "po2vessels", h5cpp::Dataspace::simple_dims(po2vessels.size(), 2), (float*)po2vessels[0].data(), h5cpp::CREATE_DS_COMPRESSED); // FIX ME: transpose the array!
-    WriteHdfPtree(outputGroup, metadata, HDF_WRITE_PTREE_AS_DATASETS);
+    py::dict py_parameters = py::extract<py::dict>(py_parameters_list[k]);
+    DetailedPO2::Parameters params;
+    InitParameters(params, py_parameters);
+
+    Array3df po2field;
+    DetailedPO2::VesselPO2Storage po2vessels;
+    ptree metadata;
+    metadata.put("batch_index", k);
+    metadata.put("batch_size", num_sets);
+
+    {
+    DetailedPO2::ComputePO2(params, *problem.vl, problem.grid, problem.mtboxes, po2field, po2vessels, problem.phases, metadata, world,
+                            po2field_init ? po2field_init.get_ptr() : NULL,
+                            po2vessels_init ? po2vessels_init.get_ptr() : NULL,
+                            &workspace);
+    }
+    if (PyErr_Occurred() != NULL) return; // don't save stuff
+
+    RecordIterationsSaved(metadata, cold_iterations);
+    WritePO2Output(py_h5outputGroups[k], problem.grid, po2field, po2vessels, metadata);
+
+    if (warm_start)
+    {
+      if (!po2field_init && !po2vessels_init && !cold_iterations)
+        cold_iterations = metadata.get<int>("num_iterations");
+      po2field_init = po2field;
+      po2vessels_init = po2vessels;
+    }
+    else
+    {
+      po2field_init = boost::none;
+      po2vessels_init = boost::none;
+      cold_iterations = boost::none;
+    }
   }
 }
 
@@ -811,6 +957,7 @@ void export_oxygen_computation()
     .def("PInit", &Parameters::PInit);
   py::def("AllocateDetailedO2ParametersFromDict", &AllocateParametersFromDict, py::return_value_policy<py::manage_new_object>());
   py::def("computePO2", PyComputePO2);
+  py::def("computePO2Batch", PyComputePO2Batch);
   py::def("computeSaturation_", PyComputeSaturation);
   py::def("computeConcentration_", PyComputeConcentration);
   py::def("computeMassTransferCoefficient_", PyComputeMassTransferCoefficient);
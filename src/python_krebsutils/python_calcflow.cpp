@@ -25,6 +25,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #include "hdf_wrapper.h"
 
 #include "calcflow.h"
+#include "calcflow_linsys.h"
 #include "shared-objects.h"
 #include "vessels3d.h"
 
@@ -212,6 +213,106 @@ static py::object PyCalcConductivities(nm::array pyRad, nm::array pyLen, nm::arr
 }
 
 
+/*
+  FlowSystem for repeated flow computations on the same network. Edges are
+  given as (n x 2) array of node indices, boundary conditions like in the
+  nodes group of vessel files (bc_node_index, bc_type, bc_value,
+  bc_conductivity_value). solve takes the edge conductivities and returns
+  the node pressures. If the solver does not converge within max_iter
+  iterations, solve raises an error if throw_on_failure is set, else it
+  returns the last iterate.
+*/
+class PyFlowSystem : boost::noncopyable
+{
+  FlowSystem fs;
+public:
+  PyFlowSystem(int num_nodes, nm::array pyedges, const BloodFlowParameters &bfparams)
+  {
+    CheckArray2(int, pyedges, 0, 2);
+    np::arrayt<int> edges_arr(pyedges);
+    std::vector<my::eqpair<int> > edges(edges_arr.shape()[0]);
+    for (int i=0; i<edges.size(); ++i)
+    {
+      int a = edges_arr(i, 0), b = edges_arr(i, 1);
+      if (a<0 || a>=num_nodes || b<0 || b>=num_nodes)
+        throw std::invalid_argument(str(format("FlowSystem: edge %i refers to node out of range") % i));
+      edges[i] = my::make_eqpair(a, b);
+    }
+    fs.set_network(num_nodes, edges, CalcFlowCoeff(bfparams.viscosityPlasma, 4., 100.));
+  }
+
+  py::object solve(nm::array pycond, nm::array py_bc_node_index, nm::array py_bc_type, nm::array py_bc_value, nm::array py_bc_conductivity_value)
+  {
+    FpExceptionStateGuard exception_state_guard(FE_DIVBYZERO | FE_INVALID | FE_OVERFLOW);
+
+    const int ecnt = fs.edges.size();
+    CheckArray1(FlReal, pycond, ecnt);
+    CheckArray1(int, py_bc_node_index, 0);
+    np::arrayt<int> bc_node_index(py_bc_node_index);
+    const int bccnt = bc_node_index.shape()[0];
+    CheckArray1(int, py_bc_type, bccnt);
+    CheckArray1(FlReal, py_bc_value, bccnt);
+    CheckArray1(FlReal, py_bc_conductivity_value, bccnt);
+    np::arrayt<FlReal> pya_cond(pycond);
+    np::arrayt<int> bc_type(py_bc_type);
+    np::arrayt<FlReal> bc_value(py_bc_value);
+    np::arrayt<FlReal> bc_conductivity_value(py_bc_conductivity_value);
+
+    FlArray cond(ecnt);
+    for (int i=0; i<ecnt; ++i) cond[i] = pya_cond(i);
+    FlowSystem::BcsMap bcs;
+    for (int i=0; i<bccnt; ++i)
+    {
+      const int id = bc_node_index(i);
+      if (id<0 || id>=fs.num_vertices)
+        throw std::invalid_argument(str(format("FlowSystem: boundary node %i out of range") % id));
+      switch (bc_type(i))
+      {
+        case FlowBC::PIN:
+          bcs[id] = FlowBC(FlowBC::PIN, bc_value(i));
+          break;
+        case FlowBC::CURRENT:
+          bcs[id] = FlowBC(FlowBC::CURRENT, bc_value(i));
+          break;
+        case FlowBC::RESIST:
+          bcs[id] = FlowBC(FlowBC::RESIST, bc_conductivity_value(i), bc_value(i));
+          break;
+        default:
+          throw std::invalid_argument(str(format("FlowSystem: unknown boundary condition type %i") % bc_type(i)));
+      }
+    }
+
+    FlArray press;
+    fs.solve(cond, bcs, press);
+
+    py::ssize_t num_nodes = fs.num_vertices;
+    np::arrayt<double> pya_press(np::empty(1, &num_nodes, np::getItemtype<double>()));
+    for (int i=0; i<num_nodes; ++i) pya_press(i) = press[i];
+    return pya_press.getObject();
+  }
+
+  int num_nodes() const { return fs.num_vertices; }
+  int num_edges() const { return fs.edges.size(); }
+  int num_solves() const { return fs.num_solves; }
+  int last_iteration_count() const { return fs.last_iteration_count; }
+  int max_iter() const { return fs.solver_params.get<int>("max_iter"); }
+  void set_max_iter(int n) { fs.solver_params.put("max_iter", n); }
+  bool throw_on_failure() const { return fs.solver_params.get<bool>("throw"); }
+  void set_throw_on_failure(bool b) { fs.solver_params.put("throw", b); }
+
+  static void export_me()
+  {
+    py::class_<PyFlowSystem, boost::noncopyable>("FlowSystem", py::init<int, nm::array, BloodFlowParameters>())
+    .def("solve", &PyFlowSystem::solve)
+    .add_property("num_nodes", &PyFlowSystem::num_nodes)
+    .add_property("num_edges", &PyFlowSystem::num_edges)
+    .add_property("num_solves", &PyFlowSystem::num_solves)
+    .add_property("last_iteration_count", &PyFlowSystem::last_iteration_count)
+    .add_property("max_iter", &PyFlowSystem::max_iter, &PyFlowSystem::set_max_iter)
+    .add_property("throw_on_failure", &PyFlowSystem::throw_on_failure, &PyFlowSystem::set_throw_on_failure);
+  }
+};
+
 
 void export_calcflow()
 {
@@ -223,5 +324,6 @@ void export_calcflow()
   py::def("PressureRadiusRelation", PressureRadiusRelation);
   py::def("CalcViscosities", PyCalcViscosities);
   py::def("CalcConductivities", PyCalcConductivities);
+  PyFlowSystem::export_me();
 }
 
@@ -151,6 +151,61 @@ py::object sample_edges_weights(nm::array pypos, nm::array pyedges, float sample
 
 
 
+/*
+ * sample locations on all edges, generated exactly like in sample_edges (same
+ * random numbers), but without data. Returns a tuple of 1d arrays
+ * (edge index, axial coordinate fpos[2] in [0,1], weight) with one entry per sample.
+ * Any number of properties can then be interpolated at the samples in python,
+ * see krebsutils.sample_edges_multi. The sampler draws from one random number
+ * stream, so the loop must be sequential to be reproducible.
+ */
+py::object sample_edges_plan(nm::array pypos, nm::array pyedges, float sample_len)
+{
+  np::arrayt<float> pos(pypos);
+  np::arrayt<int> edges(pyedges);
+  int cnt = edges.shape()[0];
+
+  DynArray<int> tmp_edge(1024, ConsTags::RESERVE);
+  DynArray<float> tmp_f(1024, ConsTags::RESERVE);
+  DynArray<float> tmp_w(1024, ConsTags::RESERVE);
+
+  CylinderNetworkSampler sampler;
+  sampler.Init(sample_len, ptree());
+
+  for(int i=0; i<cnt; ++i)
+  {
+    Float3 p0, p1;
+    for (int j=0; j<3; ++j)
+    {
+      p0[j] = pos(edges(i,0), j);
+      p1[j] = pos(edges(i,1), j);
+    }
+
+    sampler.Set(p0, p1, 0.); // 3rd arg is the radius
+    int num_samples = sampler.GenerateLineSamples();
+
+    for (int j=0; j<num_samples; ++j)
+    {
+      tmp_edge.push_back(i);
+      tmp_f.push_back(sampler.GetSample(j).fpos[2]);
+      tmp_w.push_back(sampler.weight);
+    }
+  }
+
+  np::ssize_t num_total_samples = tmp_edge.size();
+  np::arrayt<int> res_edge = np::zeros(1, &num_total_samples, np::getItemtype<int>());
+  np::arrayt<float> res_f = np::zeros(1, &num_total_samples, np::getItemtype<float>());
+  np::arrayt<float> res_w = np::zeros(1, &num_total_samples, np::getItemtype<float>());
+  for (int i=0; i<num_total_samples; ++i)
+  {
+    res_edge(i) = tmp_edge[i];
+    res_f(i) = tmp_f[i];
+    res_w(i) = tmp_w[i];
+  }
+  return py::make_tuple(res_edge.getObject(), res_f.getObject(), res_w.getObject());
+}
+
+
 template<class T>
 np::arraytbase sample_field(const nm::array py_pos, const np::arrayt<T> field, const py::object &py_ld, bool linear_interpolation, bool use_extrapolation_value, const T extrapolation_value)
 {
@@ -262,25 +317,21 @@ np::arraytbase compute_vessel_volume_fraction_field(np::arrayt<float> pos, np::a
 }
 
 
-double compute_vessel_boxcounts(nm::array pypos, nm::array pyedges, nm::array pyradius, const py::object &py_ldfield, double volume_scaling, double volume_threshold)
+/* sort vessels into the boxes which they overlap */
+static void sort_vessels_into_boxes(const LatticeDataQuad3d &ld, np::arrayt<float> &pos, np::arrayt<int> &edges, np::arrayt<float> &radius, const DynArray<BBox3> &boxes, DynArray<DynArray<int> > &vesselgrid)
 {
-  LatticeDataQuad3d ld = py::extract<LatticeDataQuad3d>(py_ldfield);
-
-  np::arrayt<float> pos(pypos);
-  np::arrayt<int> edges(pyedges);
-  np::arrayt<float> radius(pyradius);
   int cnt = edges.shape()[0];
+  vesselgrid.resize(boxes.size());
 
-  // first sort vessels into boxes
-  DynArray<BBox3> boxes = MakeMtBoxGridLarge(ld.Box(), 160);
-  DynArray<DynArray<int> > vesselgrid(boxes.size());
-  
+  // AddSmoothDelta spreads each sample over +/- 2 sites, so vessels up to
+  // 2 cells outside of a box still contribute to it
+  const float margin = 2.5*ld.Scale();
   DynArray<FloatBBox3> wboxes(boxes.size());
   for (int i=0; i<boxes.size(); ++i)
   {
     BBox3 bb = boxes[i];
-    wboxes[i] = FloatBBox3(ld.LatticeToWorld(bb.min) - Float3(0.5*ld.Scale()),
-                           ld.LatticeToWorld(bb.max) + Float3(0.5*ld.Scale()));
+    wboxes[i] = FloatBBox3(ld.LatticeToWorld(bb.min) - Float3(margin),
+                           ld.LatticeToWorld(bb.max) + Float3(margin));
   }
 
   for (int vi=0; vi<cnt; ++vi)
@@ -298,6 +349,20 @@ double compute_vessel_boxcounts(nm::array pypos, nm::array pyedges, nm::array py
       vesselgrid[i].push_back(vi);
     }
   }
+}
+
+
+double compute_vessel_boxcounts(nm::array pypos, nm::array pyedges, nm::array pyradius, const py::object &py_ldfield, double volume_scaling, double volume_threshold)
+{
+  LatticeDataQuad3d ld = py::extract<LatticeDataQuad3d>(py_ldfield);
+
+  np::arrayt<float> pos(pypos);
+  np::arrayt<int> edges(pyedges);
+  np::arrayt<float> radius(pyradius);
+
+  DynArray<BBox3> boxes = MakeMtBoxGridLarge(ld.Box(), 160);
+  DynArray<DynArray<int> > vesselgrid;
+  sort_vessels_into_boxes(ld, pos, edges, radius, boxes, vesselgrid);
 
   int64 boxcount = 0;
   #pragma omp parallel
@@ -353,6 +418,90 @@ double compute_vessel_boxcounts(nm::array pypos, nm::array pyedges, nm::array py
   return boxcount;
 }
 
+
+/*
+  Like compute_vessel_volume_fraction_field but returns only the sites with
+  a volume fraction above threshold, as tuple (coords, values) where coords
+  is a (n,3) array of lattice indices and values the (clamped) volume
+  fractions. The field is computed box by box, so memory is proportional
+  to the number of occupied sites rather than to the size of the lattice.
+*/
+py::object compute_vessel_volume_fraction_sparse(nm::array pypos, nm::array pyedges, nm::array pyradius, const py::object &py_ldfield, int samples_per_cell, double threshold)
+{
+  LatticeDataQuad3d ld = py::extract<LatticeDataQuad3d>(py_ldfield);
+
+  np::arrayt<float> pos(pypos);
+  np::arrayt<int> edges(pyedges);
+  np::arrayt<float> radius(pyradius);
+
+  DynArray<BBox3> boxes = MakeMtBoxGridLarge(ld.Box(), 160);
+  DynArray<DynArray<int> > vesselgrid;
+  sort_vessels_into_boxes(ld, pos, edges, radius, boxes, vesselgrid);
+
+  DynArray<Int3> sites(1024, ConsTags::RESERVE);
+  DynArray<float> values(1024, ConsTags::RESERVE);
+
+  #pragma omp parallel
+  {
+    CylinderNetworkSampler sampler;
+    sampler.Init(ld.Scale(), make_ptree("samples_per_cell", samples_per_cell));
+    Array3d<float> buffer;
+    DynArray<Int3> th_sites(1024, ConsTags::RESERVE);
+    DynArray<float> th_values(1024, ConsTags::RESERVE);
+
+    #pragma omp for nowait schedule(dynamic, 1)
+    for (int ibox=0; ibox<boxes.size(); ++ibox)
+    {
+      if (vesselgrid[ibox].size() == 0) continue;
+      buffer.initFromBox(boxes[ibox]);
+      for(int vi=0; vi<vesselgrid[ibox].size(); ++vi)
+      {
+        int i = vesselgrid[ibox][vi];
+        Float3 p0, p1;
+        for (int j=0; j<3; ++j)
+        {
+          p0[j] = pos(edges(i,0), j);
+          p1[j] = pos(edges(i,1), j);
+        }
+        sampler.Set(p0, p1, radius(i));
+        int num_samples = sampler.GenerateVolumeSamples();
+        for (int k=0; k<num_samples; ++k)
+        {
+          AddSmoothDelta(buffer, boxes[ibox], ld, 3, sampler.GetSample(k).wpos, sampler.weight_per_volume);
+        }
+      }
+      FOR_BBOX3(p, boxes[ibox])
+      {
+        if (buffer(p) > threshold)
+        {
+          th_sites.push_back(p);
+          th_values.push_back(std::min<float>(1., buffer(p)));
+        }
+      }
+    }
+
+    #pragma omp critical
+    {
+      for (int i=0; i<th_sites.size(); ++i)
+      {
+        sites.push_back(th_sites[i]);
+        values.push_back(th_values[i]);
+      }
+    }
+  }
+
+  np::ssize_t dims[2] = { (np::ssize_t)sites.size(), 3 };
+  np::arrayt<int> res_coords = np::zeros(2, dims, np::getItemtype<int>());
+  np::arrayt<float> res_values = np::zeros(1, dims, np::getItemtype<float>());
+  for (int i=0; i<sites.size(); ++i)
+  {
+    for (int j=0; j<3; ++j)
+      res_coords(i, j) = sites[i][j];
+    res_values(i) = values[i];
+  }
+  return py::make_tuple(res_coords.getObject(), res_values.getObject());
+}
+
 py::object calculate_within_fake_tumor_lattice_based(const py::str &property_name, py::object &ld_grp_obj, const py::object &vess_grp_obj, const py::object &tumor_range, const bool av)
 {
   std::string property = py::extract<std::string>(property_name);
@@ -736,9 +885,11 @@ void export_samplevessels()
   DEFINE_sample_field_t(float)
   DEFINE_sample_field_t(double)
   py::def("sample_edges_weights", sample_edges_weights);
+  py::def("sample_edges_plan", sample_edges_plan);
   py::def("make_position_field", make_position_field);
   py::def("make_vessel_volume_fraction_field", compute_vessel_volume_fraction_field);
   py::def("calc_vessel_boxcounts", compute_vessel_boxcounts);
+  py::def("make_vessel_volume_fraction_sparse", compute_vessel_volume_fraction_sparse);
 //  py::def("calculate_lengths_lattice_based", calculate_lengths_lattice_based);
 //  py::def("get_radii_within_fake_tumor", get_radii_within_fake_tumor);
   py::def("calculate_within_fake_tumor_lattice_based", calculate_within_fake_tumor_lattice_based);